@@ -0,0 +1,142 @@
+"""
+Description: 预计算看板用的聚合数据
+
+    <folder>/*.parquet     按天/小时/星期的 token 和时长汇总、聚类大小、最长的对话，供离线分析
+    <folder>/api/*.json    每个看板接口对应的小 JSON，接口直接返回文件内容
+
+看板不再读取和解析整张 conversation.csv，接口返回的数据量与对话条数无关。
+"""
+
+import json
+import os
+
+import pandas as pd
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+_METRICS = {
+    "conversations": ("uuid", "size"),
+    "input_tokens": ("input_tokens", "sum"),
+    "output_tokens": ("output_tokens", "sum"),
+    "duration_seconds": ("duration", "sum"),
+    "dialogue_turns": ("dialogue_turns", "sum"),
+}
+
+
+def _local_start(df, tz):
+    return pd.to_datetime(df["start_time"], utc=True).dt.tz_convert(tz)
+
+
+def _rollup(df, key, index=None):
+    rollup = df.groupby(key).agg(**_METRICS)
+    if index is not None:
+        rollup = rollup.reindex(index, fill_value=0)
+    rollup["total_tokens"] = rollup["input_tokens"] + rollup["output_tokens"]
+    return rollup
+
+
+def daily_rollup(df, tz="UTC"):
+    day = _local_start(df, tz).dt.strftime("%Y-%m-%d").rename("day")
+    return _rollup(df, day).reset_index()
+
+
+def hourly_rollup(df, tz="UTC"):
+    hour = _local_start(df, tz).dt.hour.rename("hour")
+    return _rollup(df, hour, index=pd.RangeIndex(24, name="hour")).reset_index()
+
+
+def weekday_rollup(df, tz="UTC"):
+    weekday = _local_start(df, tz).dt.weekday.rename("weekday")
+    rollup = _rollup(df, weekday, index=pd.RangeIndex(7, name="weekday")).reset_index()
+    rollup["name"] = WEEKDAYS
+    return rollup
+
+
+def top_conversations(df, n=20):
+    """按 token 总数排序的前 n 段对话"""
+    top = df.assign(total_tokens=df["input_tokens"] + df["output_tokens"]).nlargest(
+        n, "total_tokens"
+    )
+    return top[
+        ["uuid", "name", "start_time", "duration", "dialogue_turns", "input_tokens", "output_tokens", "total_tokens"]
+    ].reset_index(drop=True)
+
+
+def cluster_sizes(summaries):
+    """聚类摘要转成 (label, topic, nums) 表，按大小降序，不含噪声"""
+    rows = [
+        {"label": int(label), "topic": info["cluster"], "nums": int(info["nums"])}
+        for label, info in summaries.items()
+        if int(label) != -1
+    ]
+    frame = pd.DataFrame(rows, columns=["label", "topic", "nums"])
+    return frame.sort_values("nums", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def _records(frame):
+    # 经过 to_json 把 numpy 类型和时间统一转成 JSON 原生类型
+    return json.loads(frame.to_json(orient="records", date_format="iso"))
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def write_activity_aggregates(folder, df, tz="UTC", top_n=20):
+    """写出 token、活跃时间和对话排行相关的聚合"""
+    api = os.path.join(folder, "api")
+    os.makedirs(api, exist_ok=True)
+
+    daily = daily_rollup(df, tz)
+    hourly = hourly_rollup(df, tz)
+    weekday = weekday_rollup(df, tz)
+    top = top_conversations(df, top_n)
+    for name, frame in [("daily", daily), ("hourly", hourly), ("weekday", weekday), ("top_conversations", top)]:
+        frame.to_parquet(os.path.join(folder, f"{name}.parquet"), index=False)
+
+    input_tokens = int(df["input_tokens"].sum())
+    output_tokens = int(df["output_tokens"].sum())
+    _write_json(
+        os.path.join(api, "token_stats.json"),
+        {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        },
+    )
+    _write_json(
+        os.path.join(api, "daily_activity.json"),
+        {
+            "timezone": tz,
+            "from": daily["day"].min() if len(daily) else None,
+            "to": daily["day"].max() if len(daily) else None,
+            "days": _records(daily),
+        },
+    )
+    _write_json(
+        os.path.join(api, "hourly_activity.json"),
+        {"timezone": tz, "hours": _records(hourly)},
+    )
+    _write_json(
+        os.path.join(api, "weekday_activity.json"),
+        {"timezone": tz, "weekdays": _records(weekday)},
+    )
+    _write_json(os.path.join(api, "top_conversations.json"), _records(top))
+
+
+def write_time_series(folder, series):
+    """TimeSeriesRollup.to_dict() 的结果，供趋势图和热力图使用"""
+    api = os.path.join(folder, "api")
+    os.makedirs(api, exist_ok=True)
+    _write_json(os.path.join(api, "time_series.json"), series)
+
+
+def write_cluster_aggregates(folder, summaries):
+    api = os.path.join(folder, "api")
+    os.makedirs(api, exist_ok=True)
+    clusters = cluster_sizes(summaries)
+    clusters.to_parquet(os.path.join(folder, "clusters.parquet"), index=False)
+    _write_json(os.path.join(api, "clusters.json"), _records(clusters))
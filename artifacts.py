@@ -0,0 +1,101 @@
+"""
+Description: ClusterClassifier 模型目录的存储格式（format_version=2）
+
+    meta.json                  版本号和模型参数
+    embeddings.npy             np.load(mmap_mode="r") 只读映射
+    projections.npy            同上
+    cluster_labels.npy         同上
+    texts.bin / texts_offsets.npy
+                               所有文本的 UTF-8 拼接及 N+1 个字节偏移，按需解码单条文本
+    label_ids.npy / label_offsets.npy / label_doc_ids.npy
+                               CSR 形式的 类别 -> 文档id
+    cluster_centers.npy        与 label_ids 对齐的簇中心
+    faiss.index / cluster_summaries.json / umap_mapper.pkl
+
+映射打开的文件在多个工作进程之间共享同一份页缓存，加载模型不需要复制数据。
+所有文件都先写临时文件再替换，加载后的模型可以原地保存。
+"""
+
+import json
+import os
+from collections.abc import Sequence
+
+import numpy as np
+
+FORMAT_VERSION = 2
+
+
+class TextStore(Sequence):
+    """按偏移量从 texts.bin 中按需读取文本的只读序列"""
+
+    def __init__(self, folder):
+        self._offsets = np.load(os.path.join(folder, "texts_offsets.npy"), mmap_mode="r")
+        blob_path = os.path.join(folder, "texts.bin")
+        if os.path.getsize(blob_path) > 0:
+            self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self._blob = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("text index out of range")
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+
+def replace_file(path, write):
+    """先写到 path.tmp 再替换，已经映射打开的旧文件（如加载后原地保存）不会被截断"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def write_texts(folder, texts):
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+
+    def write(f):
+        for i, text in enumerate(texts):
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+
+    replace_file(os.path.join(folder, "texts.bin"), write)
+    save_array(folder, "texts_offsets", offsets)
+
+
+def write_meta(folder, **meta):
+    with open(os.path.join(folder, "meta.json"), "w") as f:
+        json.dump({"format_version": FORMAT_VERSION, **meta}, f, indent=2)
+
+
+def read_meta(folder):
+    """旧格式（没有 meta.json）返回 None"""
+    path = os.path.join(folder, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        meta = json.load(f)
+    if meta.get("format_version", 0) > FORMAT_VERSION:
+        raise ValueError(
+            f"Model format version {meta['format_version']} is newer than "
+            f"supported version {FORMAT_VERSION}."
+        )
+    return meta
+
+
+def load_array(folder, name):
+    return np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+
+
+def save_array(folder, name, array):
+    array = np.asarray(array)
+    replace_file(os.path.join(folder, f"{name}.npy"), lambda f: np.save(f, array))
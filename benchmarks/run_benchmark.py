@@ -0,0 +1,244 @@
+"""
+Description: 端到端基准测试，分阶段计时并输出 JSON，便于跨版本对比和寻找规模拐点
+
+用法：
+    python -m benchmarks.run_benchmark --sizes 1000 5000 20000 --output out/benchmark.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.stub_llm import StubLLMServer
+from benchmarks.synthetic_data import write_conversations
+from chat_analyzer import ChatAnalyzer
+from token_counter import TokenCounter
+from utils import iter_chat_data
+
+
+def _peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, items=None):
+        """执行一个阶段并记录墙钟时间、CPU时间和执行后的进程峰值内存"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        n = items(result) if callable(items) else items
+        self.stages[name] = {
+            "seconds": wall,
+            "cpu_seconds": cpu,
+            "peak_rss_mb": _peak_rss_mb(),
+            "items": n,
+            "items_per_sec": n / wall if n and wall > 0 else None,
+        }
+        logging.info(f"[{name}] {wall:.3f}s")
+        return result
+
+
+def run_once(path, args, workdir):
+    from text_clustering import ClusterClassifier
+
+    timer = StageTimer()
+    # 与 main.py 的 load 阶段使用同一个流式读取器；后面几个阶段要多次遍历，这里物化成列表
+    chat_data = timer.run("load", lambda: list(iter_chat_data(path)), items=len)
+
+    texts = [
+        " ".join(msg["text"] for msg in chat["chat_messages"] if msg.get("text"))
+        for chat in chat_data
+    ]
+    counter = TokenCounter(num_workers=args.token_workers)
+    timer.run("tokenize", lambda: counter.count_batch(texts), items=len(texts))
+
+    # _prepare_data 内部也会统计token，单独传入一个新的计数器，避免命中上一阶段的缓存
+    analyzer = timer.run(
+        "prepare_data",
+        lambda: ChatAnalyzer(
+            chat_data, token_counter=TokenCounter(num_workers=args.token_workers)
+        ),
+        items=len(chat_data),
+    )
+    names = analyzer.df["name"].tolist()
+
+    with StubLLMServer(latency=args.llm_latency) as llm:
+        clf = ClusterClassifier(
+            embed_model_name=args.embed_model,
+            embed_batch_size=args.embed_batch_size,
+            embed_num_workers=args.embed_workers,
+            index_type=args.index_type,
+            umap_pca_components=args.umap_pca_components,
+            umap_landmarks=args.umap_landmarks,
+            dbscan_eps=args.dbscan_eps,
+            dbscan_min_samples=args.dbscan_min_samples,
+            summary_model="stub",
+            summary_model_base=llm.base_url,
+            summary_model_token="stub",
+            summary_concurrency=args.llm_concurrency,
+        )
+        clf.texts = names
+        clf.embeddings = timer.run("embed", lambda: clf.embed(names), items=len(names))
+        clf.faiss_index = timer.run(
+            "faiss_build", lambda: clf.build_faiss_index(clf.embeddings), items=len(names)
+        )
+        clf.projections, clf.umap_mapper = timer.run(
+            "umap", lambda: clf.project(clf.embeddings), items=len(names)
+        )
+        projection_quality = None
+        if args.projection_quality:
+            projection_quality = clf.evaluate_projection(full_fit=clf.umap_landmarks is not None)
+        clf.cluster_labels = timer.run(
+            "dbscan",
+            lambda: clf.cluster(clf.cluster_space(clf.embeddings, clf.projections)),
+            items=len(names),
+        )
+        sweep = None
+        if args.dbscan_sweep:
+            # 10 个 eps × 5 个 min_samples，与上面的单次聚类对比耗时
+            eps_values = np.linspace(0.25, 2.5, 10) * args.dbscan_eps
+            m = args.dbscan_min_samples
+            min_samples_values = [max(2, m // 4), max(2, m // 2), m, 2 * m, 4 * m]
+            sweep = timer.run(
+                "dbscan_sweep",
+                lambda: clf.sweep(eps_values, min_samples_values),
+                items=len(eps_values) * len(min_samples_values),
+            )
+        clf._build_cluster_index()
+        n_clusters = int((clf.membership.label_ids != -1).sum())
+        clf.cluster_summaries = timer.run(
+            "summarize",
+            lambda: clf.summarize(names, clf.cluster_labels),
+            items=n_clusters,
+        )
+
+    folder = os.path.join(workdir, "model")
+    timer.run("save", lambda: clf.save(folder))
+    timer.run("load_model", lambda: ClusterClassifier.load(clf, folder))
+
+    return {
+        "n_conversations": len(chat_data),
+        "n_messages": sum(len(chat["chat_messages"]) for chat in chat_data),
+        "file_mb": os.path.getsize(path) / (1024 * 1024),
+        "n_clusters": n_clusters,
+        "stages": timer.stages,
+        "projection_quality": projection_quality,
+        "dbscan_sweep": sweep,
+    }
+
+
+def scaling_exponents(results):
+    """相邻两个规模之间每个阶段的时间增长指数 log(t2/t1)/log(n2/n1)
+
+    约等于 1 为线性，明显大于 1 的位置就是该阶段的规模拐点。
+    """
+    rows = []
+    for prev, cur in zip(results, results[1:]):
+        ratio = math.log(cur["n_conversations"] / prev["n_conversations"])
+        exponents = {}
+        for stage, stats in cur["stages"].items():
+            t1, t2 = prev["stages"][stage]["seconds"], stats["seconds"]
+            if ratio > 0 and t1 > 0 and t2 > 0:
+                exponents[stage] = math.log(t2 / t1) / ratio
+        rows.append(
+            {"from": prev["n_conversations"], "to": cur["n_conversations"], "exponents": exponents}
+        )
+    return rows
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分阶段端到端基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--messages", type=int, default=8)
+    parser.add_argument("--words-mean", type=float, default=40)
+    parser.add_argument("--words-sigma", type=float, default=1.0)
+    parser.add_argument("--languages", default="en,zh,ja,es,ru")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--embed-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--embed-workers", type=int, default=1)
+    parser.add_argument("--token-workers", type=int, default=None)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--umap-landmarks", type=int, default=None, help="umap 最多拟合的点数")
+    parser.add_argument("--umap-pca-components", type=int, default=None)
+    parser.add_argument(
+        "--projection-quality",
+        action="store_true",
+        help="记录投影的 trustworthiness / 近邻保持率，使用 landmark 时同时与完整拟合对比",
+    )
+    parser.add_argument("--dbscan-eps", type=float, default=0.08)
+    parser.add_argument("--dbscan-min-samples", type=int, default=10)
+    parser.add_argument(
+        "--dbscan-sweep",
+        action="store_true",
+        help="在同一张近邻图上评估 50 组 (eps, min_samples)，记录各组的簇数和噪声比例",
+    )
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="桩服务每次请求的模拟耗时（秒）")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument(
+        "--no-warmup",
+        action="store_true",
+        help="跳过预热；默认先用小规模数据跑一遍，排除 numba JIT 编译和模型加载的耗时",
+    )
+    parser.add_argument("--output", default="out/benchmark.json")
+    args = parser.parse_args()
+
+    def run_size(size):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "conversations.json")
+            write_conversations(
+                path,
+                size,
+                messages_per_conversation=args.messages,
+                words_mean=args.words_mean,
+                words_sigma=args.words_sigma,
+                languages=tuple(args.languages.split(",")),
+                seed=args.seed,
+            )
+            return run_once(path, args, workdir)
+
+    if not args.no_warmup:
+        run_size(min(200, min(args.sizes)))
+    results = [run_size(size) for size in sorted(args.sizes)]
+
+    report = {
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": vars(args),
+        "results": results,
+        "scaling": scaling_exponents(results),
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"benchmark results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Description: 检索服务的并发压测，记录不同凑批大小和并发数下的 p50 / p99 延迟和 QPS
+
+服务在子进程中运行（与实际部署相同，客户端线程不与服务争抢 GIL），每组参数重新启动服务。
+不指定 --model 时先用模拟对话的标题训练并保存一个模型目录。指定 --stub-embed-ms 时训练和服务都用
+StubEmbedder 代替 embedding 模型，不需要下载模型，结果只反映凑批和检索本身的开销。
+
+用法：
+    python -m benchmarks.serve_benchmark --size 5000 --batch-sizes 1 64 --concurrency 1 8 32
+    python -m benchmarks.serve_benchmark --stub-embed-ms 5 --concurrency 1 16
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from benchmarks.run_benchmark import _git_revision
+from benchmarks.synthetic_data import generate_conversations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _stub_model(stub_embed_ms):
+    if stub_embed_ms is None:
+        return None
+    from benchmarks.stub_embedder import StubEmbedder
+
+    return StubEmbedder(call_ms=stub_embed_ms)
+
+
+def build_model(folder, size, embed_model, seed=42, stub_embed_ms=None):
+    """用模拟对话的标题训练一个模型目录"""
+    from text_clustering import ClusterClassifier
+
+    chats = generate_conversations(size, messages_per_conversation=2, seed=seed)
+    names = [chat["name"] for chat in chats]
+    clf = ClusterClassifier(
+        embed_model_name=embed_model,
+        embed_model=_stub_model(stub_embed_ms),
+        summary_create=False,
+        dedup_method="exact",
+        dbscan_eps=0.3,
+        dbscan_min_samples=10,
+    )
+    clf.fit(names)
+    clf.save(folder)
+    return folder
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class ServerProcess:
+    def __init__(self, model, max_batch_size, max_wait_ms, stub_embed_ms=None, startup_timeout=300):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        command = [
+            sys.executable,
+            os.path.join(ROOT, "serve.py"),
+            "--model", model,
+            "--port", str(self.port),
+            "--max-batch-size", str(max_batch_size),
+            "--max-wait-ms", str(max_wait_ms),
+        ]  # fmt: skip
+        if stub_embed_ms is not None:
+            command += ["--stub-embed-ms", str(stub_embed_ms)]
+        self.process = subprocess.Popen(
+            command,
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+        )
+        deadline = time.perf_counter() + startup_timeout
+        while True:
+            try:
+                _get(f"{self.url}/health", timeout=1)
+                return
+            except (urllib.error.URLError, ConnectionError):
+                if self.process.poll() is not None or time.perf_counter() > deadline:
+                    self.close()
+                    raise RuntimeError("search service failed to start")
+                time.sleep(0.5)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def run_load(url, queries, concurrency, n_requests, top_k=10):
+    """concurrency 个客户端线程共发出 n_requests 个请求，返回每个请求的延迟（秒）和总耗时"""
+    latencies = np.zeros(n_requests)
+    counter = iter(range(n_requests))
+    lock = threading.Lock()
+    errors = []
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            body = json.dumps({"query": queries[i % len(queries)], "top_k": top_k}).encode()
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(f"{url}/search", data=body)) as r:
+                    r.read()
+            except (urllib.error.URLError, ConnectionError) as e:
+                errors.append(e)
+            latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise RuntimeError(f"{len(errors)} requests failed: {errors[0]}")
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索服务并发压测")
+    parser.add_argument("--model", default=None, help="模型目录，不指定时用模拟数据训练一个")
+    parser.add_argument("--size", type=int, default=5000, help="模拟数据的对话数")
+    parser.add_argument("--embed-model", default="all-MiniLM-L6-v2")
+    parser.add_argument(
+        "--stub-embed-ms",
+        type=float,
+        default=None,
+        help="用每次调用固定耗时的 StubEmbedder 代替 embedding 模型，不需要下载模型",
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64], help="1 表示不凑批")
+    parser.add_argument("--max-wait-ms", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=2000, help="每组参数的请求数")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="out/serve_benchmark.json")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model = args.model or build_model(
+            os.path.join(workdir, "model"),
+            args.size,
+            args.embed_model,
+            seed=args.seed,
+            stub_embed_ms=args.stub_embed_ms,
+        )
+        # 查询用另一批模拟标题，不与模型中的文本完全相同
+        chats = generate_conversations(1000, messages_per_conversation=2, seed=args.seed + 1)
+        queries = [chat["name"] for chat in chats]
+
+        results = []
+        for max_batch_size in args.batch_sizes:
+            server = ServerProcess(model, max_batch_size, args.max_wait_ms, args.stub_embed_ms)
+            try:
+                for concurrency in args.concurrency:
+                    run_load(server.url, queries, concurrency, min(100, args.requests), args.top_k)
+                    before = _get(f"{server.url}/health")
+                    latencies, seconds = run_load(
+                        server.url, queries, concurrency, args.requests, args.top_k
+                    )
+                    after = _get(f"{server.url}/health")
+                    batches = after["batches"] - before["batches"]
+                    row = {
+                        "max_batch_size": max_batch_size,
+                        "concurrency": concurrency,
+                        "requests": args.requests,
+                        "qps": args.requests / seconds,
+                        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+                        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+                        "mean_batch_size": args.requests / max(batches, 1),
+                    }
+                    results.append(row)
+                    logging.info(
+                        f"batch<={max_batch_size} concurrency={concurrency}: "
+                        f"{row['qps']:.1f} qps, p50 {row['p50_ms']:.1f} ms, p99 {row['p99_ms']:.1f} ms, "
+                        f"mean batch {row['mean_batch_size']:.1f}"
+                    )
+            finally:
+                server.close()
+
+    report = {
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": vars(args),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"benchmark results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
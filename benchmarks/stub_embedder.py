@@ -0,0 +1,31 @@
+"""
+Description: 代替 SentenceTransformer 的 embedding 模型，压测检索服务时不需要下载模型
+
+每次 encode 固定耗时 call_ms 毫秒、每条文本再加 per_text_ms 毫秒，模拟模型一次前向的开销；
+向量由文本的哈希决定，同一文本总是得到同一个向量。
+"""
+
+import time
+
+import numpy as np
+
+from utils import text_digest
+
+
+class StubEmbedder:
+    def __init__(self, call_ms=5.0, per_text_ms=0.1, dim=384, max_seq_length=512):
+        self.call_ms = call_ms
+        self.per_text_ms = per_text_ms
+        self.dim = dim
+        self.max_seq_length = max_seq_length
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=False, **kwargs):
+        texts = list(texts)
+        time.sleep((self.call_ms + self.per_text_ms * len(texts)) / 1000)
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(text_digest(text)[:8], "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
@@ -0,0 +1,140 @@
+"""
+Description: 生成指定规模的模拟 Claude 导出文件 (conversations.json)，用于基准测试
+"""
+
+import argparse
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# 每种语言若干话题，同一话题的对话共享主题词，聚类时能形成簇
+TOPICS = {
+    "en": [
+        ["python", "pandas", "dataframe", "groupby", "index", "merge"],
+        ["travel", "flight", "hotel", "itinerary", "visa", "museum"],
+        ["recipe", "oven", "flour", "butter", "bake", "dough"],
+        ["resume", "interview", "salary", "offer", "manager", "career"],
+    ],
+    "zh": [
+        ["机器学习", "模型", "训练", "数据集", "损失函数", "梯度"],
+        ["旅行", "机票", "酒店", "签证", "行程", "景点"],
+        ["论文", "摘要", "引用", "实验", "结论", "审稿"],
+    ],
+    "ja": [
+        ["日本語", "文法", "敬語", "単語", "発音", "練習"],
+        ["料理", "レシピ", "味噌", "出汁", "醤油", "炊飯"],
+    ],
+    "es": [
+        ["contrato", "alquiler", "abogado", "cláusula", "fianza", "firma"],
+        ["fútbol", "partido", "entrenador", "liga", "gol", "equipo"],
+    ],
+    "ru": [
+        ["программа", "ошибка", "сервер", "запрос", "база", "данные"],
+    ],
+}
+FILLER = {
+    "en": ["the", "and", "please", "could", "you", "explain", "why", "how", "this", "with"],
+    "zh": ["请", "帮我", "一下", "这个", "为什么", "怎么", "可以", "我们", "然后", "问题"],
+    "ja": ["これは", "です", "ください", "どう", "なぜ", "して", "ます", "あの", "その", "もの"],
+    "es": ["por", "favor", "cómo", "porque", "esto", "con", "para", "que", "una", "el"],
+    "ru": ["пожалуйста", "как", "почему", "это", "с", "для", "что", "и", "в", "на"],
+}
+SEPARATOR = {"en": " ", "es": " ", "ru": " ", "zh": "", "ja": ""}
+
+
+def _text(rng, lang, topic, n_words):
+    words = []
+    for _ in range(max(1, n_words)):
+        pool = topic if rng.random() < 0.3 else FILLER[lang]
+        words.append(pool[rng.integers(len(pool))])
+    return SEPARATOR[lang].join(words)
+
+
+def _iso(ts):
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.%f") + "Z"
+
+
+def generate_conversations(
+    n_conversations,
+    messages_per_conversation=8,
+    words_mean=40,
+    words_sigma=1.0,
+    languages=("en", "zh", "ja", "es", "ru"),
+    start=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    days=365,
+    seed=42,
+):
+    """逐条产出模拟对话
+
+    每段对话的消息数服从均值为 messages_per_conversation 的泊松分布（至少 2 条），
+    每条消息的词数服从中位数为 words_mean 的对数正态分布，长尾与真实导出接近。
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(n_conversations):
+        lang = languages[rng.integers(len(languages))]
+        topic = TOPICS[lang][rng.integers(len(TOPICS[lang]))]
+        created = start + timedelta(seconds=float(rng.uniform(0, days * 86400)))
+        n_messages = max(2, int(rng.poisson(messages_per_conversation)))
+
+        messages = []
+        ts = created
+        for i in range(n_messages):
+            n_words = int(rng.lognormal(np.log(words_mean), words_sigma))
+            messages.append(
+                {
+                    "uuid": str(uuid.UUID(int=int(rng.integers(1 << 62)))),
+                    "text": _text(rng, lang, topic, n_words),
+                    "sender": "human" if i % 2 == 0 else "assistant",
+                    "created_at": _iso(ts),
+                    "updated_at": _iso(ts),
+                }
+            )
+            ts += timedelta(seconds=float(rng.exponential(60)))
+
+        yield {
+            "uuid": str(uuid.UUID(int=int(rng.integers(1 << 62)))),
+            "name": _text(rng, lang, topic, int(rng.integers(3, 8))),
+            "created_at": _iso(created),
+            "updated_at": _iso(ts),
+            "chat_messages": messages,
+        }
+
+
+def write_conversations(path, n_conversations, **kwargs):
+    """流式写出 JSON 数组，大规模数据也不需要先在内存里拼好整个列表"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, chat in enumerate(generate_conversations(n_conversations, **kwargs)):
+            if i:
+                f.write(",\n")
+            json.dump(chat, f, ensure_ascii=False)
+        f.write("]")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成模拟的 conversations.json")
+    parser.add_argument("output")
+    parser.add_argument("-n", "--conversations", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=8, help="每段对话的平均消息数")
+    parser.add_argument("--words-mean", type=float, default=40, help="每条消息词数的中位数")
+    parser.add_argument("--words-sigma", type=float, default=1.0, help="词数对数正态分布的 sigma")
+    parser.add_argument("--languages", default="en,zh,ja,es,ru")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    write_conversations(
+        args.output,
+        args.conversations,
+        messages_per_conversation=args.messages,
+        words_mean=args.words_mean,
+        words_sigma=args.words_sigma,
+        languages=tuple(args.languages.split(",")),
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
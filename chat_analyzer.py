@@ -1,27 +1,135 @@
-from datetime import datetime
+from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
-from utils import load_chat_data, tokenize
+from profiling import profiled, stage
+from time_series import TimeSeriesRollup
+from token_counter import TokenCounter
+from utils import iter_chat_data, load_chat_data
+
+
+def message_activity(df, conversation, created_at, is_human, chars):
+    """消息级的 token 表：uuid / created_at / input_tokens / output_tokens
+
+    token 数是按整段对话拼接后统计的，这里按字符数比例把对话的输入（输出）token 分到每条
+    human（assistant）消息上，按累计比例取整，每段对话的消息之和与 df 中的值完全一致。
+    conversation 为消息所属对话在 df 中的行号，消息按对话内的时间顺序排列。
+    """
+    if len(conversation) == 0:
+        return pd.DataFrame(
+            {
+                "uuid": pd.Series(dtype="object"),
+                "created_at": pd.Series(dtype="datetime64[ns, UTC]"),
+                "input_tokens": pd.Series(dtype="float64"),
+                "output_tokens": pd.Series(dtype="float64"),
+            }
+        )
+    frame = pd.DataFrame(
+        {"conversation": conversation, "is_human": is_human, "chars": chars}
+    )
+    groups = frame.groupby(["conversation", "is_human"], sort=False)["chars"]
+    total_chars = groups.transform("sum").to_numpy()
+    position = groups.cumcount().to_numpy() + 1
+    share = np.where(
+        total_chars > 0,
+        groups.cumsum().to_numpy() / np.maximum(total_chars, 1),
+        position / groups.transform("size").to_numpy(),
+    )
+    totals = np.where(
+        is_human,
+        df["input_tokens"].to_numpy(dtype=np.float64)[conversation],
+        df["output_tokens"].to_numpy(dtype=np.float64)[conversation],
+    )
+    cumulative = pd.Series(np.round(share * totals), index=frame.index)
+    tokens = (
+        cumulative
+        - cumulative.groupby([frame["conversation"], frame["is_human"]]).shift(fill_value=0.0)
+    ).to_numpy()
+    return pd.DataFrame(
+        {
+            "uuid": df["uuid"].to_numpy()[conversation],
+            "created_at": pd.DatetimeIndex(created_at).astype("datetime64[ns, UTC]"),
+            "input_tokens": np.where(is_human, tokens, 0.0),
+            "output_tokens": np.where(is_human, 0.0, tokens),
+        }
+    )
 
 
 class ChatAnalyzer:
-    def __init__(self, chat_data):
+    # 每累积这么多条对话批量统计一次token，兼顾批处理效率和流式读取时的内存
+    token_batch_size = 1024
+
+    def __init__(self, chat_data, token_counter=None, columnar=False):
+        # chat_data 可以是对话列表，也可以是逐条产出对话的迭代器（只会遍历一次）
         self.chat_data = chat_data
-        self.df = self._prepare_data()
+        self.token_counter = token_counter or TokenCounter()
+        # 列式模式下保留消息级别的表，便于后续分析复用
+        self.messages = None
+        # 每条消息的 token 数（见 message_activity），时间序列按消息时间计入日期和小时
+        self.activity = None
+        with stage("prepare_data") as s:
+            if columnar:
+                self.df = self._prepare_data_columnar()
+            else:
+                self.df = self._prepare_data()
+            s.items = len(self.df)
+
+    @classmethod
+    def from_file(cls, file_path, token_counter=None, columnar=False):
+        """流式读取导出文件构建分析器，不会把整个文件加载进内存"""
+        return cls(
+            iter_chat_data(file_path), token_counter=token_counter, columnar=columnar
+        )
+
+    @classmethod
+    def from_dataframe(cls, df, token_counter=None, activity=None):
+        """用已经预处理好的表构建分析器，比如从断点恢复的结果"""
+        analyzer = cls.__new__(cls)
+        analyzer.chat_data = None
+        analyzer.token_counter = token_counter
+        analyzer.messages = None
+        analyzer.activity = activity
+        analyzer.df = df
+        return analyzer
+
+    def _count_tokens(self, records, texts):
+        """批量统计一批对话的输入/输出token数"""
+        with stage("count_tokens", items=len(texts)):
+            counts = self.token_counter.count_batch(texts)
+        for i, record in enumerate(records):
+            record["input_tokens"] = counts[2 * i]
+            record["output_tokens"] = counts[2 * i + 1]
+        texts.clear()
 
     def _prepare_data(self):
         """预处理聊天数据，转换为DataFrame格式"""
         records = []
+        pending_texts = []
+        activity = {"conversation": [], "created_at": [], "is_human": [], "chars": []}
         for chat in self.chat_data:
             messages = chat["chat_messages"]
             user_msg, bot_msg = [], []
 
-            # 首先按时间排序所有消息，时间相同时human排在assistant前
+            # 先解析消息时间，时间缺失或格式错误的消息跳过；没有时区的时间按UTC处理
+            timed_messages = []
+            for msg in messages:
+                try:
+                    msg_time = datetime.fromisoformat(
+                        msg["created_at"].replace("Z", "+00:00")
+                    )
+                except (ValueError, KeyError, AttributeError) as e:
+                    print(f"Error processing message: {e}")
+                    continue
+                if msg_time.tzinfo is None:
+                    msg_time = msg_time.replace(tzinfo=timezone.utc)
+                timed_messages.append((msg_time, msg))
+
+            # 按时间排序所有消息，时间相同时human排在assistant前
             sorted_messages = sorted(
-                messages,
+                timed_messages,
                 key=lambda x: (
-                    datetime.fromisoformat(x["created_at"].replace("Z", "+00:00")),
+                    x[0],
                     (
-                        0 if x["sender"] == "human" else 1
+                        0 if x[1].get("sender") == "human" else 1
                     ),  # human为0排在前面，assistant为1排在后面
                 ),
             )
@@ -30,12 +138,8 @@ class ChatAnalyzer:
             first_human_time = None
             last_assistant_time = None
 
-            for msg in sorted_messages:
+            for msg_time, msg in sorted_messages:
                 try:
-                    msg_time = datetime.fromisoformat(
-                        msg["created_at"].replace("Z", "+00:00")
-                    )
-
                     if msg["sender"] == "human":
                         if first_human_time is None:
                             first_human_time = msg_time
@@ -43,8 +147,14 @@ class ChatAnalyzer:
                     elif msg["sender"] == "assistant":
                         last_assistant_time = msg_time
                         bot_msg.append(msg["text"])
+                    else:
+                        continue
+                    activity["conversation"].append(len(records))
+                    activity["created_at"].append(msg_time)
+                    activity["is_human"].append(msg["sender"] == "human")
+                    activity["chars"].append(len(msg["text"]))
 
-                except (ValueError, KeyError) as e:
+                except KeyError as e:
                     print(f"Error processing message: {e}")
                     continue
 
@@ -53,8 +163,8 @@ class ChatAnalyzer:
             if first_human_time and last_assistant_time:
                 duration = (last_assistant_time - first_human_time).total_seconds()
 
-            input_tokens = len(tokenize(" ".join(user_msg)))
-            output_tokens = len(tokenize(" ".join(bot_msg)))
+            pending_texts.append(" ".join(user_msg))
+            pending_texts.append(" ".join(bot_msg))
 
             # 提取每次对话的基本信息
             record = {
@@ -68,13 +178,150 @@ class ChatAnalyzer:
                 ),
                 "duration": duration,
                 "dialogue_turns": len(chat["chat_messages"]) // 2 + 1,
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
+                "input_tokens": 0,
+                "output_tokens": 0,
             }
             records.append(record)
 
-        return pd.DataFrame(records)
+            if len(pending_texts) >= 2 * self.token_batch_size:
+                n = len(pending_texts) // 2
+                self._count_tokens(records[-n:], pending_texts)
 
+        if pending_texts:
+            n = len(pending_texts) // 2
+            self._count_tokens(records[-n:], pending_texts)
+        self.token_counter.save_cache()
+
+        df = pd.DataFrame(records)
+        self.activity = message_activity(
+            df,
+            np.asarray(activity["conversation"], dtype=np.int64),
+            pd.to_datetime(pd.Series(activity["created_at"], dtype="object"), utc=True),
+            np.asarray(activity["is_human"], dtype=bool),
+            np.asarray(activity["chars"], dtype=np.int64),
+        )
+        return df
+
+    def _prepare_data_columnar(self):
+        """列式预处理：把所有消息展平成一张消息表，批量解析时间并用 groupby 聚合
+
+        结果与 _prepare_data 相同，但时间解析和聚合都是向量化的，
+        适合包含几十万条消息的导出文件。
+        """
+        conversations = {
+            "uuid": [],
+            "name": [],
+            "created_at": [],
+            "updated_at": [],
+            "n_messages": [],
+        }
+        all_messages = []
+        for chat in self.chat_data:
+            messages = chat["chat_messages"]
+            conversations["uuid"].append(chat["uuid"])
+            conversations["name"].append(chat["name"])
+            conversations["created_at"].append(chat["created_at"])
+            conversations["updated_at"].append(chat["updated_at"])
+            conversations["n_messages"].append(len(messages))
+            all_messages.extend(messages)
+
+        n_chats = len(conversations["uuid"])
+        n_messages = np.asarray(conversations["n_messages"], dtype="int64")
+        messages = pd.DataFrame(
+            {
+                "conversation": np.repeat(np.arange(n_chats), n_messages),
+                "sender": pd.Series(
+                    [msg.get("sender") for msg in all_messages], dtype="object"
+                ),
+                # 与 _prepare_data 一样跳过时间缺失或格式错误的消息
+                "created_at": pd.to_datetime(
+                    pd.Series(
+                        [msg.get("created_at") for msg in all_messages], dtype="object"
+                    ),
+                    utc=True,
+                    format="ISO8601",
+                    errors="coerce",
+                ),
+                "text": pd.Series(
+                    [msg.get("text") for msg in all_messages], dtype="object"
+                ),
+            }
+        )
+        del all_messages
+        invalid = messages["created_at"].isna()
+        if invalid.any():
+            print(f"Skipped {int(invalid.sum())} messages with invalid created_at")
+            messages = messages.loc[~invalid]
+
+        # 与 _prepare_data 相同的顺序：按时间排序，时间相同时human排在assistant前
+        messages["sender_rank"] = (messages["sender"] != "human").astype("int8")
+        messages = messages.sort_values(
+            ["conversation", "created_at", "sender_rank"], kind="stable"
+        ).reset_index(drop=True)
+        self.messages = messages.drop(columns="sender_rank")
+
+        is_human = messages["sender"] == "human"
+        is_assistant = messages["sender"] == "assistant"
+        has_text = messages["text"].notna()
+        conversation_ids = pd.RangeIndex(n_chats)
+
+        first_human_time = (
+            messages.loc[is_human].groupby("conversation")["created_at"].min()
+        )
+        last_assistant_time = (
+            messages.loc[is_assistant].groupby("conversation")["created_at"].max()
+        )
+        duration = (
+            (last_assistant_time - first_human_time)
+            .dt.total_seconds()
+            .reindex(conversation_ids)
+            .fillna(0.0)
+        )
+
+        def join_texts(mask):
+            # 消息已按对话排序，直接按切片拼接，比 groupby().agg(" ".join) 快得多
+            selected = messages.loc[mask & has_text]
+            conversation = selected["conversation"].to_numpy()
+            texts = selected["text"].tolist()
+            starts = np.flatnonzero(np.diff(conversation, prepend=-1))
+            ends = np.append(starts[1:], len(texts))
+            joined = [""] * n_chats
+            for chat_id, start, end in zip(conversation[starts], starts, ends):
+                joined[chat_id] = " ".join(texts[start:end])
+            return joined
+
+        with stage("count_tokens", items=2 * n_chats):
+            input_tokens = self.token_counter.count_batch(join_texts(is_human))
+            output_tokens = self.token_counter.count_batch(join_texts(is_assistant))
+        self.token_counter.save_cache()
+
+        df = pd.DataFrame(
+            {
+                "uuid": conversations["uuid"],
+                "name": conversations["name"],
+                "start_time": pd.to_datetime(
+                    conversations["created_at"], utc=True, format="ISO8601"
+                ),
+                "end_time": pd.to_datetime(
+                    conversations["updated_at"], utc=True, format="ISO8601"
+                ),
+                "duration": duration.to_numpy(),
+                "dialogue_turns": n_messages // 2 + 1,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+            }
+        )
+        counted = messages.loc[(is_human | is_assistant) & has_text]
+        self.activity = message_activity(
+            df,
+            counted["conversation"].to_numpy(),
+            counted["created_at"],
+            (counted["sender"] == "human").to_numpy(),
+            counted["text"].str.len().to_numpy(dtype=np.int64),
+        )
+        return df
+
+    @profiled("analyze_chat_duration")
     def analyze_chat_duration(self):
         """分析对话时长统计"""
         avg_duration = self.df["duration"].mean()
@@ -94,18 +341,27 @@ class ChatAnalyzer:
             },
         }
 
-    def analyze_time_patterns(self):
-        """分析使用时间模式"""
+    @profiled("analyze_time_patterns")
+    def analyze_time_patterns(self, tz="UTC"):
+        """分析使用时间模式，小时和季节按 tz 时区的本地时间统计"""
+        local = pd.to_datetime(self.df["start_time"], utc=True).dt.tz_convert(tz)
         # 按小时统计
-        hourly_pattern = (
-            self.df.groupby(self.df["start_time"].dt.hour)["uuid"].count().to_dict()
-        )
+        hourly_pattern = self.df.groupby(local.dt.hour)["uuid"].count().to_dict()
 
-        # 按季节统计
-        self.df["season"] = self.df["start_time"].dt.month % 12 // 3 + 1
-        seasonal_pattern = self.df.groupby("season")["uuid"].count().to_dict()
+        # 按季节统计，不往 self.df 里写列，多个分析可以并发读同一张表
+        season = (local.dt.month % 12 // 3 + 1).rename("season")
+        seasonal_pattern = self.df.groupby(season)["uuid"].count().to_dict()
         return {"hourly_pattern": hourly_pattern, "seasonal_pattern": seasonal_pattern}
 
+    @profiled("analyze_time_series")
+    def analyze_time_series(self, tz="UTC", rollup=None):
+        """按 tz 时区汇总的日/周/月 token、轮次和时长序列，以及小时×星期热力图
+
+        rollup 为之前保存的汇总时只追加新增和续聊过的对话；有消息级的 activity 时 token 按消息的
+        时间计入，跨天的对话不会全部算在开始的那一天
+        """
+        return (rollup or TimeSeriesRollup(tz)).append(self.df, self.activity)
+
 
 def main():
     # 示例使用
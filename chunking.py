@@ -0,0 +1,60 @@
+"""
+Description: 长对话的分块embedding：按token窗口切分、按长度排序打包、再按对话聚合
+"""
+
+import numpy as np
+
+AGG_STRATEGIES = ("mean", "max", "first_k")
+
+
+def split_windows(texts, offset_mappings, window, stride, max_chunks=None):
+    """按token窗口把文本切成若干段
+
+    offset_mappings 为分词器返回的每个token的字符区间，切分时直接按字符偏移截取原文，
+    不经过 decode，避免改变文本。返回 (chunks, chunk_lengths, chunk_offsets)，
+    第 i 条文本的分块为 chunks[chunk_offsets[i]:chunk_offsets[i+1]]。
+    """
+    chunks, lengths = [], []
+    chunk_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    for i, (text, offsets) in enumerate(zip(texts, offset_mappings)):
+        n_tokens = len(offsets)
+        if n_tokens == 0:
+            chunks.append(text)
+            lengths.append(0)
+        else:
+            for n, start in enumerate(range(0, n_tokens, stride)):
+                if max_chunks is not None and n >= max_chunks:
+                    break
+                end = min(start + window, n_tokens)
+                chunks.append(text[offsets[start][0] : offsets[end - 1][1]])
+                lengths.append(end - start)
+                if end == n_tokens:
+                    break
+        chunk_offsets[i + 1] = len(chunks)
+    return chunks, np.asarray(lengths, dtype=np.int64), chunk_offsets
+
+
+def encode_length_sorted(chunks, lengths, encode_fn):
+    """按token数从长到短排序后编码，让同一批次里的序列长度接近、减少padding"""
+    order = np.argsort(-lengths, kind="stable")
+    encoded = encode_fn([chunks[i] for i in order])
+    embeddings = np.empty_like(encoded)
+    embeddings[order] = encoded
+    return embeddings
+
+
+def pool_chunks(chunk_embeddings, chunk_offsets, strategy="mean"):
+    """把每条文本的分块embedding聚合成一个向量并重新归一化
+
+    mean / first_k 取平均（first_k 在切分时已经只保留了前 k 段），max 逐维取最大值。
+    """
+    if strategy not in AGG_STRATEGIES:
+        raise ValueError(f"Unknown aggregation strategy '{strategy}', use one of {AGG_STRATEGIES}.")
+    starts = chunk_offsets[:-1]
+    if strategy == "max":
+        pooled = np.maximum.reduceat(chunk_embeddings, starts, axis=0)
+    else:
+        sums = np.add.reduceat(chunk_embeddings, starts, axis=0)
+        pooled = sums / np.diff(chunk_offsets)[:, None]
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return (pooled / np.maximum(norms, 1e-12)).astype(chunk_embeddings.dtype)
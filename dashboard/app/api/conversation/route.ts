@@ -4,22 +4,8 @@
  * @FilePath: /ClaudeAnnualAnalysis/dashboard-demo/app/api/conversation/route.ts
  * @Description: 
  */
-import { NextResponse } from 'next/server';
-import fs from 'fs';
-import path from 'path';
+import { serveJsonFile } from '@/app/lib/serveJson';
 
-export async function GET() {
-  try {
-    const filePath = path.join(process.cwd(), '../out/conversation.csv');
-    const fileContents = await fs.promises.readFile(filePath, 'utf8');
-    
-    return new NextResponse(fileContents, {
-      headers: {
-        'Content-Type': 'text/csv',
-      },
-    });
-  } catch (error) {
-    console.error('Error reading conversation data:', error);
-    return NextResponse.json({ error: 'Failed to load conversation data' }, { status: 500 });
-  }
+export async function GET(request: Request) {
+  return serveJsonFile(request, 'aggregates/api/top_conversations.json', 'conversation data');
 }
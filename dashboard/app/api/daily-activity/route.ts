@@ -0,0 +1,5 @@
+import { serveJsonFile } from '@/app/lib/serveJson';
+
+export async function GET(request: Request) {
+  return serveJsonFile(request, 'aggregates/api/daily_activity.json', 'daily activity');
+}
@@ -0,0 +1,22 @@
+/*
+ * @Description: 主题分布图的导出文件：meta / clusters / points / hover 分片 JSON 和密度瓦片 PNG
+ */
+import { NextResponse } from 'next/server';
+import path from 'path';
+import { serveFile } from '@/app/lib/serveJson';
+
+const CONTENT_TYPES: Record<string, string> = {
+  '.json': 'application/json; charset=utf-8',
+  '.png': 'image/png',
+};
+
+export async function GET(request: Request, { params }: { params: Promise<{ path: string[] }> }) {
+  const { path: segments } = await params;
+  const relativePath = path.posix.normalize(segments.join('/'));
+  const contentType = CONTENT_TYPES[path.extname(relativePath)];
+  // 只允许访问 scatter 目录内的 JSON 和 PNG
+  if (!contentType || relativePath.startsWith('..') || path.isAbsolute(relativePath)) {
+    return NextResponse.json({ error: 'Not found' }, { status: 404 });
+  }
+  return serveFile(request, `aggregates/scatter/${relativePath}`, 'scatter data', contentType);
+}
@@ -1,20 +1,5 @@
-import { NextResponse } from 'next/server';
+import { serveJsonFile } from '@/app/lib/serveJson';
 
-export async function GET() {
-  try {
-    // 这里应该是实际的数据源
-    const tokenStats = {
-      input_tokens: 1234567,
-      output_tokens: 2345678,
-      total_tokens: 3580245  // 实际应该是动态计算的
-    };
-
-    return NextResponse.json(tokenStats);
-  } catch (error) {
-    console.error('Error fetching token stats:', error);
-    return NextResponse.json(
-      { error: 'Failed to fetch token statistics' },
-      { status: 500 }
-    );
-  }
+export async function GET(request: Request) {
+  return serveJsonFile(request, 'aggregates/api/token_stats.json', 'token stats');
 }
@@ -13,12 +13,17 @@ import {
   Pie,
   Cell
 } from 'recharts';
-import Papa from 'papaparse';
 import { ResponsiveCalendar } from '@nivo/calendar';
 import html2canvas from 'html2canvas';
 import { format } from 'date-fns';
 import { toZonedTime } from 'date-fns-tz';
 
+interface DailyActivity {
+  from: string | null;
+  to: string | null;
+  days: { day: string; conversations: number }[];
+}
+
 interface Stats {
   totalDuration: string;
   avgDuration: string;
@@ -26,7 +31,7 @@ interface Stats {
 }
 
 const Dashboard = () => {
-  const [contributionData, setContributionData] = useState<{month: number; week: number; day: number; value: number}[]>([]);
+  const [dailyActivity, setDailyActivity] = useState<DailyActivity>({ from: null, to: null, days: [] });
   const [hourlyData, setHourlyData] = useState<{hour: string; count: number}[]>([]);
   const [topTopics, setTopTopics] = useState<{name: string; value: number}[]>([]);
   const [seasonalData, setSeasonalData] = useState<{name: string; value: number}[]>([]);
@@ -48,33 +53,9 @@ const Dashboard = () => {
     const loadData = async () => {
       try {
         setIsLoading(true);
-        // Load conversation data and generate contribution data
-        const csvResponse = await fetch('/api/conversation');
-        const csvText = await csvResponse.text();
-        const conversationData = Papa.parse(csvText, {
-          header: true,
-          dynamicTyping: true,
-          skipEmptyLines: true
-        }).data as { start_time: string }[];
-
-        // Generate contribution data
-        const contributionsMap: Record<string, number> = {};
-        conversationData.forEach(row => {
-          const date = new Date(row.start_time);
-          const key = `${date.getFullYear()}-${date.getMonth()}-${date.getDate()}`;
-          contributionsMap[key] = (contributionsMap[key] || 0) + 1;
-        });
-
-        const contributionsArray = Object.entries(contributionsMap).map(([dateStr, value]) => {
-          const [year, month, day] = dateStr.split('-').map(Number);
-          return {
-            month,
-            week: Math.floor(day / 7),
-            day: new Date(year, month, day).getDay(),
-            value: Math.min(4, value)
-          };
-        });
-        setContributionData(contributionsArray);
+        // Load precomputed daily activity for the contribution calendar
+        const dailyResponse = await fetch('/api/daily-activity');
+        setDailyActivity(await dailyResponse.json());
 
         // Load time patterns data
         const timePatternsResponse = await fetch('/api/time-patterns');
@@ -364,12 +345,12 @@ const Dashboard = () => {
 
             <div style={{ height: '200px' }}>
               <ResponsiveCalendar
-                data={contributionData.map(d => ({
-                  day: `2024-${String(d.month + 1).padStart(2, '0')}-${String(d.week * 7 + d.day + 1).padStart(2, '0')}`,
-                  value: d.value
+                data={dailyActivity.days.map(d => ({
+                  day: d.day,
+                  value: Math.min(4, d.conversations)
                 }))}
-                from="2024-01-01"
-                to="2024-12-31"
+                from={dailyActivity.from ?? "2024-01-01"}
+                to={dailyActivity.to ?? "2024-12-31"}
                 emptyColor="#f1f5f9"
                 colors={['#C7D2FE', '#818CF8', '#6366F1', '#4F46E5']}
                 margin={{ top: 20, right: 20, bottom: 20, left: 20 }}
@@ -0,0 +1,60 @@
+/*
+ * @Description: 读取 out 目录下预计算好的 JSON / PNG 并带 ETag 返回，内容不变时返回 304
+ */
+import { NextResponse } from 'next/server';
+import { createHash } from 'crypto';
+import fs from 'fs';
+import path from 'path';
+
+const OUT_DIR = path.join(process.cwd(), '../out');
+
+interface CachedFile {
+  mtimeMs: number;
+  size: number;
+  body: Buffer;
+  etag: string;
+}
+
+// 文件没有变化时复用上次读取的内容和 ETag，不重复读盘和计算哈希
+const cache = new Map<string, CachedFile>();
+
+async function readCached(filePath: string): Promise<CachedFile> {
+  const stat = await fs.promises.stat(filePath);
+  const cached = cache.get(filePath);
+  if (cached && cached.mtimeMs === stat.mtimeMs && cached.size === stat.size) {
+    return cached;
+  }
+  const body = await fs.promises.readFile(filePath);
+  const etag = `"${createHash('sha1').update(body).digest('hex')}"`;
+  const entry = { mtimeMs: stat.mtimeMs, size: stat.size, body, etag };
+  cache.set(filePath, entry);
+  return entry;
+}
+
+export async function serveFile(
+  request: Request,
+  relativePath: string,
+  label: string,
+  contentType: string,
+) {
+  try {
+    const file = await readCached(path.join(OUT_DIR, relativePath));
+    const headers = {
+      ETag: file.etag,
+      'Cache-Control': 'public, max-age=0, must-revalidate',
+    };
+    if (request.headers.get('if-none-match') === file.etag) {
+      return new NextResponse(null, { status: 304, headers });
+    }
+    return new NextResponse(file.body, {
+      headers: { ...headers, 'Content-Type': contentType },
+    });
+  } catch (error) {
+    console.error(`Error reading ${label}:`, error);
+    return NextResponse.json({ error: `Failed to load ${label}` }, { status: 500 });
+  }
+}
+
+export async function serveJsonFile(request: Request, relativePath: string, label: string) {
+  return serveFile(request, relativePath, label, 'application/json; charset=utf-8');
+}
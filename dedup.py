@@ -0,0 +1,118 @@
+"""
+Description: 重复 / 近似重复对话的检测与合并
+
+导出数据里有大量重试、分叉出来的几乎相同的对话。完全相同的文本按内容哈希合并，
+近似重复的用 faiss 索引检索余弦距离不超过 eps 的近邻，按连通分量合并。每组只保留
+一个代表（组内最早出现的文档）并记录组大小作为权重，降维和聚类只在代表上进行，
+之后再把结果展开回全部文档。
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from graph_clustering import knn_radius_graph
+from utils import text_hash
+
+
+def normalize_text(text):
+    """合并连续空白，忽略首尾空白的差异"""
+    return " ".join(text.split())
+
+
+class Duplicates:
+    """文档到重复组的映射
+
+    inverse[i] 为文档 i 所在组的编号，组按首次出现的顺序编号，
+    representatives[g] 为组 g 中最早出现的文档，weights[g] 为组大小。
+    """
+
+    def __init__(self, inverse):
+        self.inverse = np.asarray(inverse, dtype=np.int64)
+        _, self.representatives, self.weights = np.unique(
+            self.inverse, return_index=True, return_counts=True
+        )
+
+    @classmethod
+    def from_groups(cls, groups):
+        """任意编号的分组重新按首次出现的顺序编号"""
+        _, first, inverse = np.unique(groups, return_index=True, return_inverse=True)
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+        return cls(rank[inverse.ravel()])
+
+    def __len__(self):
+        return len(self.inverse)
+
+    @property
+    def n_groups(self):
+        return len(self.representatives)
+
+    @property
+    def duplicate_rate(self):
+        return 1.0 - self.n_groups / max(len(self), 1)
+
+    def expand(self, values):
+        """代表上的结果（按组编号排列）展开回每个文档"""
+        return np.asarray(values)[self.inverse]
+
+    def extend(self, n):
+        """追加 n 个不与任何已有文档重复的新文档"""
+        return Duplicates(np.concatenate([self.inverse, self.n_groups + np.arange(n)]))
+
+    def group_counts(self, docs):
+        """docs 中不同重复组的数量"""
+        return len(np.unique(self.inverse[docs]))
+
+    def indicator(self):
+        """文档 × 组 的 0/1 稀疏矩阵"""
+        n = len(self.inverse)
+        return sparse.csr_matrix(
+            (np.ones(n, dtype=np.float32), (np.arange(n), self.inverse)),
+            shape=(n, self.n_groups),
+        )
+
+    def collapse_graph(self, graph):
+        """文档间的邻接图合并为组间的邻接图（边权为 1，只保留结构，与 graph_dbscan 的用法一致）"""
+        graph = graph.tocsr()
+        # 距离为 0 的显式边也是邻居，先转成全 1 的结构矩阵再合并
+        structure = sparse.csr_matrix(
+            (np.ones(len(graph.indices), dtype=np.float32), graph.indices, graph.indptr),
+            shape=graph.shape,
+        )
+        indicator = self.indicator()
+        collapsed = (indicator.T @ structure @ indicator).tocsr()
+        collapsed.setdiag(0)
+        collapsed.eliminate_zeros()
+        collapsed.data[:] = 1.0
+        return collapsed
+
+
+def exact_duplicates(texts):
+    """按规范化后文本的内容哈希分组"""
+    first = {}
+    groups = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        groups[i] = first.setdefault(text_hash(normalize_text(text)), len(first))
+    return Duplicates(groups)
+
+
+def near_duplicates(index, embeddings, eps=0.02, k=16, exact=None):
+    """在 exact 的基础上，再合并余弦距离不超过 eps 的近似重复
+
+    用已建好的 faiss 索引检索每个文档的 k 个近邻（与 knn_graph 聚类相同），
+    超过 k 个的重复也会通过连通分量串在一起。
+    """
+    n = len(embeddings)
+    graph = knn_radius_graph(index, embeddings, k=k, eps=eps)
+    if exact is not None:
+        # 完全重复的文档连到组代表，保证同组一定合并
+        graph = graph + sparse.csr_matrix(
+            (
+                np.ones(n, dtype=np.float32),
+                (np.arange(n), exact.representatives[exact.inverse]),
+            ),
+            shape=(n, n),
+        )
+    _, components = connected_components(graph, directed=False)
+    return Duplicates.from_groups(components)
@@ -0,0 +1,178 @@
+"""
+Description: CPU 上的 embedding 执行引擎：多进程分片编码、ONNX / int8 动态量化后端、按内存预算估算 batch size
+"""
+
+import logging
+import os
+import time
+import weakref
+from contextlib import contextmanager
+
+import numpy as np
+
+from utils import available_cpus
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def load_model(model_name, device="cpu", backend="torch", onnx_file_name=None):
+    """按后端加载 SentenceTransformer
+
+    torch: 原始 fp32 模型
+    int8:  对 Linear 层做动态量化，权重 int8、激活运行时量化，只支持 CPU
+    onnx:  sentence-transformers>=3.2 的 ONNX Runtime 后端（需要 optimum[onnxruntime]），
+           onnx_file_name 可以指定模型仓库里已量化的文件，如 "onnx/model_qint8_avx512.onnx"
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', use one of {BACKENDS}.")
+
+    if backend == "onnx":
+        model_kwargs = {"file_name": onnx_file_name} if onnx_file_name else None
+        return SentenceTransformer(
+            model_name, device=device, backend="onnx", model_kwargs=model_kwargs
+        )
+
+    model = SentenceTransformer(model_name, device=device)
+    if backend == "int8":
+        if device != "cpu":
+            raise ValueError("int8 dynamic quantization only runs on cpu.")
+        import torch
+
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return model
+
+
+def _model_config(model):
+    """读取 transformer 的结构参数，拿不到时按 all-MiniLM-L6-v2 估算"""
+    try:
+        config = model[0].auto_model.config
+    except (AttributeError, IndexError, KeyError, TypeError):
+        config = None
+    hidden = getattr(config, "hidden_size", 384)
+    return {
+        "hidden_size": hidden,
+        "num_attention_heads": getattr(config, "num_attention_heads", 12),
+        "intermediate_size": getattr(config, "intermediate_size", 4 * hidden),
+    }
+
+
+def auto_batch_size(model, max_seq_length, memory_budget_mb, num_workers=1, max_batch_size=1024):
+    """按内存预算估算每个进程能用的 batch size
+
+    推理不保存梯度，峰值内存主要是单层的激活：hidden 维的若干中间结果、FFN 的
+    intermediate 维输出和 heads×seq×seq 的注意力矩阵（分数和 softmax 各一份），均为 float32。
+    结果向下取 2 的幂，便于不同机器之间复现。
+    """
+    config = _model_config(model)
+    seq = max_seq_length
+    per_text = 4 * seq * (
+        4 * config["hidden_size"]
+        + config["intermediate_size"]
+        + 2 * config["num_attention_heads"] * seq
+    )
+    budget = memory_budget_mb * 1024 * 1024 / max(1, num_workers)
+    batch_size = int(min(max_batch_size, max(1, budget // per_text)))
+    return 1 << (batch_size.bit_length() - 1)
+
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+@contextmanager
+def _worker_threads(num_threads):
+    """子进程在 import torch / numpy 时读取线程数，启动进程池前临时设置，避免线程数超订
+
+    只在启动进程池的这段时间设置，主进程的 UMAP、PCA、faiss 等仍使用全部核心。
+    """
+    previous = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    for name, value in previous.items():
+        if value is None:
+            os.environ[name] = str(num_threads)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+
+
+class EmbeddingEngine:
+    def __init__(self, model, batch_size=None, num_workers=1, memory_budget_mb=1024, chunk_size=None):
+        self.model = model
+        self.num_workers = num_workers or available_cpus()
+        if batch_size is None:
+            batch_size = auto_batch_size(
+                model, model.max_seq_length, memory_budget_mb, self.num_workers
+            )
+            logging.info(f"auto embedding batch size: {batch_size}")
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.stats = {"texts": 0, "seconds": 0.0, "texts_per_sec": 0.0}
+        # 多进程池在第一次需要时启动，之后一直复用，close() 或进程退出时停止
+        self._pool = None
+        self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """停止多进程池；之后再编码大批文本时会重新启动"""
+        if self._finalizer is not None:
+            self._finalizer()
+        self._pool = None
+        self._finalizer = None
+
+    def encode(self, texts, show_progress_bar=True):
+        """编码并归一化；文本足够多时按进程分片，否则在当前进程编码"""
+        texts = list(texts)
+        start = time.perf_counter()
+        if self.num_workers > 1 and len(texts) >= self.batch_size * self.num_workers:
+            embeddings = self._encode_multi_process(texts)
+        else:
+            embeddings = self.model.encode(
+                texts,
+                batch_size=self.batch_size,
+                show_progress_bar=show_progress_bar,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+        elapsed = time.perf_counter() - start
+
+        self.stats["texts"] += len(texts)
+        self.stats["seconds"] += elapsed
+        self.stats["texts_per_sec"] = self.stats["texts"] / max(self.stats["seconds"], 1e-9)
+        logging.info(
+            f"embedded {len(texts)} texts in {elapsed:.2f}s "
+            f"({len(texts) / max(elapsed, 1e-9):.1f} texts/sec)"
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _start_pool(self):
+        # 每个子进程分到的线程数，总和不超过可用CPU
+        threads = max(1, available_cpus() // self.num_workers)
+        with _worker_threads(threads):
+            self._pool = self.model.start_multi_process_pool(["cpu"] * self.num_workers)
+        self._finalizer = weakref.finalize(self, self.model.stop_multi_process_pool, self._pool)
+
+    def _encode_multi_process(self, texts):
+        if self._pool is None:
+            self._start_pool()
+        # 默认每块 batch_size×4 条，块越小负载越均衡，但进程间传输次数越多
+        chunk_size = self.chunk_size or self.batch_size * 4
+        try:
+            embeddings = self.model.encode_multi_process(
+                texts, self._pool, batch_size=self.batch_size, chunk_size=chunk_size
+            )
+        except BaseException:
+            # 子进程可能还在处理被中断的批次，结果会混进下一次编码，直接停掉重启
+            self.close()
+            raise
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
@@ -0,0 +1,151 @@
+"""
+Description: 按内容寻址的持久化向量缓存
+
+每个 (模型名, max_seq_length, ...) 组合对应一个子目录：
+    vectors.f32  追加写入的 float32 向量，按 np.memmap 只读映射，不复制到内存
+    keys.bin     与向量逐行对应的 16 字节文本哈希
+    meta.json    模型信息和向量维度
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from utils import text_digest
+
+KEY_DTYPE = np.dtype([("hi", ">u8"), ("lo", ">u8")])
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class EmbeddingStore:
+    def __init__(self, folder, model_name, max_seq_length, **extra):
+        self.model_name = model_name
+        self.max_seq_length = max_seq_length
+        self.extra = extra
+
+        namespace = json.dumps(
+            {"model": model_name, "max_seq_length": max_seq_length, **extra},
+            sort_keys=True,
+        )
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        digest = hashlib.blake2b(namespace.encode("utf-8"), digest_size=6).hexdigest()
+        self.folder = os.path.join(folder, f"{slug}-{max_seq_length}-{digest}")
+        self.vectors_path = os.path.join(self.folder, "vectors.f32")
+        self.keys_path = os.path.join(self.folder, "keys.bin")
+        self.meta_path = os.path.join(self.folder, "meta.json")
+
+        self.dim = None
+        self.vectors = None
+        self._keys = np.empty(0, dtype=KEY_DTYPE)
+        self._order = np.empty(0, dtype=np.int64)
+        self._sorted_keys = self._keys
+        self._open()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _open(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r") as f:
+            self.dim = json.load(f)["dim"]
+
+        # 以较短的一方为准：写入中断时可能只写了向量没写key，缺失的文件按 0 条处理
+        n_keys = _file_size(self.keys_path) // KEY_DTYPE.itemsize
+        n_vectors = _file_size(self.vectors_path) // (4 * self.dim)
+        n = min(n_keys, n_vectors)
+        if n == 0:
+            return
+
+        self.vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim)
+        )
+        self._keys = np.memmap(self.keys_path, dtype=KEY_DTYPE, mode="r", shape=(n,))
+        self._order = np.argsort(self._keys, kind="stable")
+        self._sorted_keys = self._keys[self._order]
+
+    @staticmethod
+    def make_keys(texts):
+        return np.frombuffer(
+            b"".join(text_digest(text) for text in texts), dtype=KEY_DTYPE
+        )
+
+    def lookup(self, keys):
+        """返回每个key在缓存中的行号，未命中为 -1"""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._keys) == 0 or len(keys) == 0:
+            return rows
+        pos = np.searchsorted(self._sorted_keys, keys)
+        pos = np.minimum(pos, len(self._sorted_keys) - 1)
+        hit = self._sorted_keys[pos] == keys
+        rows[hit] = self._order[pos[hit]]
+        return rows
+
+    def add(self, keys, vectors):
+        """追加新的向量，已存在的key会被跳过"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        keys, first = np.unique(keys, return_index=True)
+        vectors = vectors[first]
+        new = self.lookup(keys) < 0
+        keys, vectors = keys[new], vectors[new]
+        if len(keys) == 0:
+            return
+
+        write_meta = self.dim is None
+        if write_meta:
+            self.dim = vectors.shape[1]
+            os.makedirs(self.folder, exist_ok=True)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dim {vectors.shape[1]} does not match cached dim {self.dim}."
+            )
+
+        # 先写向量再写key，中断时多出来的向量会在下次打开时被忽略
+        n = len(self)
+        self.vectors = None
+        with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+            f.seek(n * 4 * self.dim)
+            f.write(vectors.tobytes())
+            f.truncate()
+        with open(self.keys_path, "r+b" if os.path.exists(self.keys_path) else "wb") as f:
+            f.seek(n * KEY_DTYPE.itemsize)
+            f.write(np.ascontiguousarray(keys).tobytes())
+            f.truncate()
+        # meta 最后写入：没有 meta 的目录视为空缓存，下次写入时从头覆盖
+        if write_meta:
+            self._write_meta()
+        self._open()
+
+    def _write_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "model": self.model_name,
+                    "max_seq_length": self.max_seq_length,
+                    **self.extra,
+                    "dim": self.dim,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.meta_path)
+
+    def get_or_compute(self, texts, compute_fn):
+        """命中的直接从缓存读取，未命中的交给 compute_fn 批量计算后写回缓存"""
+        if len(texts) == 0:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        keys = self.make_keys(texts)
+        rows = self.lookup(keys)
+        missing = np.flatnonzero(rows < 0)
+        if len(missing) > 0:
+            missing_keys, first = np.unique(keys[missing], return_index=True)
+            vectors = compute_fn([texts[missing[i]] for i in first])
+            self.add(missing_keys, vectors)
+            rows = self.lookup(keys)
+        return np.asarray(self.vectors[rows])
@@ -0,0 +1,228 @@
+"""
+Description: 基于稀疏近邻图的聚类，内存为 O(N·k)，不需要 N×N 的距离矩阵
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from utils import available_cpus
+
+
+def cosine_distances(distances, metric_type):
+    """把 faiss 返回的距离换算成归一化向量之间的余弦距离"""
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        return 1.0 - distances
+    # METRIC_L2 返回欧氏距离的平方，对单位向量等于 2 - 2cos
+    return distances / 2.0
+
+
+def knn_radius_graph(index, embeddings, k=30, eps=0.3, batch_size=16384):
+    """用已有的 faiss 索引构建稀疏近邻图
+
+    每个点只保留 k 个近邻中余弦距离不超过 eps 的边，边权为余弦距离。
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n = embeddings.shape[0]
+    k = min(k, n)
+    rows, cols, data = [], [], []
+    for start in range(0, n, batch_size):
+        dist, neighbours = index.search(embeddings[start : start + batch_size], k)
+        dist = cosine_distances(dist, index.metric_type)
+        keep = (neighbours >= 0) & (dist <= eps)
+        rows.append(np.nonzero(keep)[0] + start)
+        cols.append(neighbours[keep])
+        data.append(np.maximum(dist[keep], 0.0))
+
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int64)
+    data = np.concatenate(data) if data else np.empty(0, dtype=np.float32)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+
+
+def graph_dbscan(graph, min_samples, sample_weight=None):
+    """在稀疏邻域图上执行 DBSCAN
+
+    graph 中存在的边（含0距离的显式边）即视为“在 eps 邻域内”。与 sklearn 一致，
+    邻域包含点自身；邻域内（加权）点数不少于 min_samples 的点为核心点，核心点按连通分量成簇，
+    非核心点归入任一相邻核心点所在的簇，其余为噪声(-1)。
+    """
+    n = graph.shape[0]
+    # 只需要结构（距离为0的重复点也算邻居）：对称化并加入自环
+    graph = graph.tocsr()
+    structure = sparse.csr_matrix(
+        (np.ones(len(graph.indices), dtype=bool), graph.indices, graph.indptr),
+        shape=(n, n),
+    )
+    structure = (
+        structure + structure.T + sparse.identity(n, dtype=bool, format="csr")
+    ).tocsr()
+
+    if sample_weight is None:
+        neighbourhood = np.diff(structure.indptr)
+    else:
+        neighbourhood = structure @ np.asarray(sample_weight, dtype=np.float64)
+    core = neighbourhood >= min_samples
+
+    labels = np.full(n, -1, dtype=np.int64)
+    core_ids = np.flatnonzero(core)
+    if len(core_ids) == 0:
+        return labels
+
+    _, components = connected_components(
+        structure[core_ids][:, core_ids], directed=False
+    )
+    labels[core_ids] = components
+
+    # 边界点：取第一个相邻核心点的簇
+    border_ids = np.flatnonzero(~core)
+    border_to_core = structure[border_ids][:, core_ids].tocsr()
+    has_core = np.diff(border_to_core.indptr) > 0
+    first_core = border_to_core.indices[border_to_core.indptr[:-1][has_core]]
+    labels[border_ids[has_core]] = components[first_core]
+    return labels
+
+
+def radius_neighbors(x, eps, n_jobs=None):
+    """欧氏距离不超过 eps 的全部近邻（含自身），每行按距离升序
+
+    返回 (indptr, indices, distances)，即 CSR 格式的近邻图。邻域检索与 sklearn DBSCAN 相同
+    （低维投影上用 kd 树），边数随 eps 增长。
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    nn = NearestNeighbors(radius=eps, n_jobs=n_jobs).fit(x)
+    distances, indices = nn.radius_neighbors(x, return_distance=True, sort_results=True)
+    counts = np.fromiter((len(row) for row in indices), dtype=np.int64, count=len(indices))
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    return indptr, np.concatenate(indices), np.concatenate(distances)
+
+
+def _silhouette(x, labels, sample):
+    from sklearn.metrics import silhouette_score
+
+    clustered = sample[labels[sample] != -1]
+    n_labels = len(np.unique(labels[clustered]))
+    if n_labels < 2 or n_labels >= len(clustered):
+        return float("nan")
+    return float(silhouette_score(x[clustered], labels[clustered]))
+
+
+def dbscan_sweep(
+    x,
+    eps_values,
+    min_samples_values,
+    sample_weight=None,
+    n_jobs=None,
+    silhouette_sample=None,
+    seed=42,
+):
+    """在同一张近邻图上评估一组 DBSCAN 参数 (eps, min_samples)，结果与 sklearn DBSCAN 一致
+
+    近邻只按最大的 eps 检索一次。对每个 min_samples，点 i 的核心距离 c(i) 为邻域（加权）点数
+    达到 min_samples 时的距离，点 i 在 eps 下是核心点当且仅当 c(i) <= eps；核心点之间的边
+    在 eps 下存在当且仅当互达距离 max(d, c(i), c(j)) <= eps。因此每条边按互达距离分到对应的 eps，
+    按 eps 从小到大在上一层的连通分量上合并新加入的边，所有 eps 合计只遍历一次近邻图。
+    簇数为核心点数减去累计的合并次数，噪声比例由排序后的可达距离二分得到，不需要逐个 eps 生成标签。
+    不同 min_samples 在线程池里并行。
+
+    返回按 (eps, min_samples) 排序的结果列表，每项包含簇数和（加权）噪声比例。silhouette_sample
+    不为 None 时再在固定抽样的 silhouette_sample 个非噪声点上计算 silhouette（簇数不足 2 时为 nan），
+    这需要为每组参数生成完整标签，耗时明显增加。
+    """
+    x = np.asarray(x)
+    n = len(x)
+    n_jobs = n_jobs or available_cpus()
+    eps_values = sorted(set(float(eps) for eps in eps_values))
+    min_samples_values = sorted(set(min_samples_values))
+    weights = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    total_weight = weights.sum()
+
+    indptr, cols, dists = radius_neighbors(x, max(eps_values), n_jobs=n_jobs)
+    cols = cols.astype(np.int32)
+    counts = np.diff(indptr)
+    rows = np.repeat(np.arange(n, dtype=np.int32), counts)
+    starts = indptr[:-1]
+    # 全部近邻按行拼接后的累计权重；每行内按距离升序（自身距离为 0，排在最前）
+    cumulative = np.cumsum(weights[cols])
+    row_base = np.concatenate([[0.0], cumulative])[starts]
+    # 连通分量只需要每条无向边的一个方向
+    upper = np.flatnonzero(cols > rows)
+    upper_rows, upper_cols, upper_dists = rows[upper], cols[upper], dists[upper]
+
+    sample = None
+    if silhouette_sample is not None:
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, silhouette_sample), replace=False))
+
+    def evaluate(min_samples):
+        # 核心距离：行内累计权重首次达到 min_samples 时的距离，最大 eps 内达不到的为 inf
+        position = np.searchsorted(cumulative, row_base + min_samples, side="left")
+        reached = position < indptr[1:]
+        core_dist = np.full(n, np.inf)
+        core_dist[reached] = dists[position[reached]]
+        n_core = np.searchsorted(np.sort(core_dist), eps_values, side="right")
+
+        # reach(i) 为点 i 被聚类（自身是核心点或与某个核心点相邻）的最小 eps
+        via = np.maximum(dists, core_dist[cols])
+        reach = np.minimum.reduceat(via, starts)
+        order = np.argsort(reach, kind="stable")
+        clustered_weight = np.concatenate([[0.0], np.cumsum(weights[order])])
+        clustered_weight = clustered_weight[np.searchsorted(reach[order], eps_values, side="right")]
+
+        nearest = None
+        if sample is not None:
+            # 边界点归入距离最近的可达核心邻居所在的簇
+            hits = np.flatnonzero(via == np.repeat(reach, counts))
+            first = np.concatenate([[True], rows[hits[1:]] != rows[hits[:-1]]])
+            nearest = cols[hits[first]]
+        del via
+
+        # 互达距离不超过 eps_values[t] 的边在第 t 个 eps 时加入，每条边只处理一次
+        mutual = np.maximum(upper_dists, np.maximum(core_dist[upper_rows], core_dist[upper_cols]))
+        edges = np.flatnonzero(mutual <= eps_values[-1])
+        mutual = mutual[edges]
+        bucket = np.zeros(len(edges), dtype=np.int16)
+        for eps in eps_values[:-1]:
+            bucket += mutual > eps
+        edges = edges[np.argsort(bucket, kind="stable")]
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(bucket, minlength=len(eps_values)))])
+
+        components = np.arange(n)
+        merges = 0
+        results = []
+        for t, eps in enumerate(eps_values):
+            new = edges[bounds[t] : bounds[t + 1]]
+            # 在上一个 eps 的连通分量上合并新加入的边，已在同一分量内的边跳过
+            a, b = components[upper_rows[new]], components[upper_cols[new]]
+            differ = a != b
+            if differ.any():
+                graph = sparse.csr_matrix(
+                    (np.ones(int(differ.sum()), dtype=bool), (a[differ], b[differ])), shape=(n, n)
+                )
+                n_components, merged = connected_components(graph, directed=False)
+                merges += n - n_components
+                components = merged[components]
+            result = {
+                "eps": eps,
+                "min_samples": min_samples,
+                # 每次合并减少一个分量；非核心点都是孤立点，不计入簇数
+                "n_clusters": int(n_core[t]) - merges,
+                "noise_fraction": float(1 - clustered_weight[t] / total_weight),
+            }
+            if sample is not None:
+                core = core_dist <= eps
+                labels = np.full(n, -1, dtype=np.int64)
+                labels[core] = components[core]
+                border = ~core & (reach <= eps)
+                labels[border] = components[nearest[border]]
+                result["silhouette"] = _silhouette(x, labels, sample)
+            results.append(result)
+        return results
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        results = [r for rs in executor.map(evaluate, min_samples_values) for r in rs]
+    return sorted(results, key=lambda r: (r["eps"], r["min_samples"]))
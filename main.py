@@ -2,60 +2,331 @@
 Author: ByronVon
 Date: 2025-01-03 21:55:00
 FilePath: /ClaudeAnnualAnalysis/main.py
-Description: 
+Description:
 """
 
 from dotenv import load_dotenv
+import argparse
+import logging
 import os
+import threading
+from collections import Counter
 from rich import print
 
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-
 load_dotenv()
 
+# 这里只导入统计路径需要的轻量模块，faiss / sentence_transformers / umap 等在用到的阶段里再导入
+from aggregates import (
+    write_activity_aggregates,
+    write_cluster_aggregates,
+    write_time_series,
+)
 from chat_analyzer import ChatAnalyzer
-from text_clustering import ClusterClassifier
-from utils import load_chat_data, save_result
+from pipeline import Incomplete, Pipeline
+from profiling import configure
+from time_series import TimeSeriesRollup
+from token_counter import TokenCounter
+from utils import available_cpus, iter_chat_data, save_result
 
+DATA_PATH = "./data/conversations.json"
+OUT_DIR = "./out"
+CHECKPOINT_DIR = "./cache/pipeline"
 
-def main():
+# 影响结果的参数会进入对应阶段的指纹，修改后只有该阶段及其下游会重新执行
+CLASSIFIER_PARAMS = {
+    "embed_model_name": "all-MiniLM-L6-v2",
+    "embed_max_seq_length": 512,
+    "index_type": "flat",
+    "umap_components": 2,
+    "umap_metric": "cosine",
+    "umap_pca_components": 50,
+    "umap_landmarks": 50000,
+    "dbscan_eps": 0.3,
+    "dbscan_min_samples": 3,
+    "cluster_method": "dbscan",
+    "dedup_method": "near",
+    "dedup_eps": 0.02,
+    "summary_model": os.getenv("openai_model_name"),
+    "summary_n_examples": 10,
+}
 
-    if not os.path.exists("./out"):
-        os.makedirs("./out", exist_ok=True)
 
-    chat_data = load_chat_data("./data/conversations.json")
+def _params(prefixes):
+    return {k: v for k, v in CLASSIFIER_PARAMS.items() if k.startswith(prefixes)}
 
-    analyzer = ChatAnalyzer(chat_data)
 
-    analyzer.df.to_csv("./out/conversation.csv", index=False)
+def _conversation_texts(df):
+    """用对话标题作为聚类文本"""
+    return df["name"].fillna("").astype(str).tolist()
 
-    classifier = ClusterClassifier(
-        embed_device="cpu",
-        embed_batch_size=4,
-        summary_create=True,
-        summary_n_examples=10,
-        dbscan_eps=0.3,
-        dbscan_min_samples=3,
-        summary_model_token=os.getenv("openai_api_key"),
-        summary_model_base=os.getenv("openai_api_base"),
-        summary_model=os.getenv("openai_model_name"),
-    )
+
+def _write_index(index, path):
+    import faiss
+
+    faiss.write_index(index, path)
+
+
+def _read_index(path):
+    import faiss
+
+    return faiss.read_index(path)
+
+
+def build_pipeline(
+    data_path=DATA_PATH,
+    out_dir=OUT_DIR,
+    checkpoint_dir=CHECKPOINT_DIR,
+    time_series_dir=None,
+    token_counter=None,
+    tz="UTC",
+):
+    # 时间序列汇总默认跟随断点目录，不同的导出用不同的断点目录就不会合并到同一份汇总里
+    if time_series_dir is None:
+        time_series_dir = os.path.join(checkpoint_dir, "time_series")
+    pipeline = Pipeline(checkpoint_dir)
+    lock = threading.Lock()
+    state = {}
+
+    # token 数按文本内容哈希缓存在断点目录，重新预处理时只统计新增的文本
+    if token_counter is None:
+        token_counter = TokenCounter(cache_path=os.path.join(checkpoint_dir, "token_counts.json"))
+        pipeline.on_close(token_counter.close)
+
+    def get_classifier():
+        # 模型只在确实需要 embedding / 聚类 / 摘要时加载
+        with lock:
+            if "classifier" not in state:
+                from text_clustering import ClusterClassifier
+
+                # 每个子进程单线程编码，进程数等于可用CPU数；batch size 按内存预算自动估算
+                state["classifier"] = ClusterClassifier(
+                    **CLASSIFIER_PARAMS,
+                    embed_device="cpu",
+                    embed_batch_size=None,
+                    embed_num_workers=available_cpus(),
+                    embed_memory_budget_mb=2048,
+                    embed_cache_dir="./cache/embeddings",
+                    summary_create=True,
+                    summary_cache_path="./cache/summaries.json",
+                    summary_model_token=os.getenv("openai_api_key"),
+                    summary_model_base=os.getenv("openai_api_base"),
+                )
+            return state["classifier"]
+
+    @pipeline.on_close
+    def close_classifier():
+        with lock:
+            classifier = state.pop("classifier", None)
+        if classifier is not None:
+            classifier.close()
+
+    # 流式读取，不做断点；只有 parse 需要重新执行时才会真正读取文件
+    @pipeline.stage("load", files=[data_path], checkpoint=False)
+    def load():
+        return iter_chat_data(data_path)
+
+    # 一次遍历得到对话级的表和消息级的 token 表，两者一起写断点，再拆成两个阶段供下游使用
+    @pipeline.stage("parse", deps=["load"], files=[data_path])
+    def parse(chat_data):
+        analyzer = ChatAnalyzer(chat_data, token_counter=token_counter)
+        return analyzer.df, analyzer.activity
+
+    @pipeline.stage("prepare", deps=["parse"], checkpoint=False)
+    def prepare(parsed):
+        return parsed[0]
+
+    @pipeline.stage("activity", deps=["parse"], checkpoint=False)
+    def activity(parsed):
+        return parsed[1]
 
     # 1. 对话时长分析
-    duration_stats = analyzer.analyze_chat_duration()
+    @pipeline.stage("duration_stats", deps=["prepare"])
+    def duration_stats(df):
+        return ChatAnalyzer.from_dataframe(df).analyze_chat_duration()
 
     # 2. 时间模式分析
-    time_patterns = analyzer.analyze_time_patterns()
+    @pipeline.stage("time_patterns", deps=["prepare"], params={"tz": tz})
+    def time_patterns(df):
+        return ChatAnalyzer.from_dataframe(df).analyze_time_patterns(tz)
 
-    # 对结果按频率排序
-    sorted_clusters = sorted(
-        [(k, v) for k, v in summaries.items() if k != -1],  # 排除噪声点(-1)
-        key=lambda x: x[1]["nums"],
-        reverse=True,
+    # 汇总保存在 time_series_dir，新的导出只追加新增和续聊过的对话；token 按消息的时间计入
+    @pipeline.stage("time_series", deps=["prepare", "activity"], params={"tz": tz})
+    def time_series(df, messages):
+        rollup = TimeSeriesRollup.load(time_series_dir, tz)
+        rollup = ChatAnalyzer.from_dataframe(df, activity=messages).analyze_time_series(tz, rollup)
+        rollup.save(time_series_dir)
+        return rollup.to_dict()
+
+    # 3. 主题聚类
+    @pipeline.stage("embed", deps=["prepare"], params=_params("embed_"))
+    def embed(df):
+        return get_classifier().embed(_conversation_texts(df))
+
+    @pipeline.stage(
+        "index",
+        deps=["embed"],
+        params=_params("index_"),
+        dump=_write_index,
+        load=_read_index,
+    )
+    def index(embeddings):
+        return get_classifier().build_faiss_index(embeddings)
+
+    # 重复和近似重复的对话合并成带权重的代表，降维和聚类只处理代表
+    @pipeline.stage("dedup", deps=["prepare", "embed", "index"], params=_params("dedup_"))
+    def dedup(df, embeddings, faiss_index):
+        return get_classifier().find_duplicates(
+            _conversation_texts(df), embeddings, faiss_index
+        )
+
+    # 先用 PCA 降维，不超过 umap_landmarks 条时在全部点上拟合，超过时在 landmark 上拟合
+    @pipeline.stage("project", deps=["embed", "index", "dedup"], params=_params("umap_"))
+    def project(embeddings, faiss_index, duplicates):
+        if duplicates is None:
+            return get_classifier().project(embeddings, faiss_index)
+        projections, mapper = get_classifier().project(
+            embeddings[duplicates.representatives]
+        )
+        return duplicates.expand(projections), mapper
+
+    # knn_graph 在原始 embedding 上用 faiss 索引建图，因此也依赖 embed 和 index
+    @pipeline.stage(
+        "cluster",
+        deps=["embed", "index", "project", "dedup"],
+        params=_params(("dbscan_", "cluster_")),
+    )
+    def cluster(embeddings, faiss_index, projection, duplicates):
+        projections, _ = projection
+        classifier = get_classifier()
+        classifier.embeddings = embeddings
+        classifier.faiss_index = faiss_index
+        if duplicates is None:
+            return classifier.cluster(classifier.cluster_space(embeddings, projections))
+        classifier.duplicates = duplicates
+        representatives = duplicates.representatives
+        labels = classifier.cluster(
+            classifier.cluster_space(embeddings[representatives], projections[representatives]),
+            sample_weight=duplicates.weights,
+        )
+        return duplicates.expand(labels)
+
+    # 已完成的摘要写在 summary_cache_path 里；有簇请求失败时结果不写断点，重跑只会请求剩下的簇
+    @pipeline.stage(
+        "summarize",
+        deps=["prepare", "embed", "index", "dedup", "project", "cluster"],
+        params=_params("summary_"),
+    )
+    def summarize(df, embeddings, faiss_index, duplicates, projection, labels):
+        classifier = get_classifier()
+        classifier.duplicates = duplicates
+        classifier.texts = _conversation_texts(df)
+        classifier.embeddings = embeddings
+        classifier.faiss_index = faiss_index
+        classifier.projections, classifier.umap_mapper = projection
+        classifier.cluster_labels = labels
+        classifier._build_cluster_index()
+        summaries = classifier.summarize(classifier.texts, labels)
+        if classifier.summary_failures:
+            return Incomplete(
+                summaries, f"{len(classifier.summary_failures)} cluster summaries failed"
+            )
+        return summaries
+
+    # 保存结果，用于可视化展示
+    @pipeline.stage(
+        "export_stats",
+        deps=["prepare", "duration_stats", "time_patterns", "time_series"],
+        checkpoint=False,
+    )
+    def export_stats(df, duration, patterns, series):
+        os.makedirs(out_dir, exist_ok=True)
+        df.to_csv(os.path.join(out_dir, "conversation.csv"), index=False)
+        save_result(os.path.join(out_dir, "duration_stats.json"), duration)
+        save_result(os.path.join(out_dir, "time_patterns.json"), patterns)
+        # 看板接口直接读取的预计算聚合
+        write_activity_aggregates(os.path.join(out_dir, "aggregates"), df, tz=tz)
+        write_time_series(os.path.join(out_dir, "aggregates"), series)
+        return out_dir
+
+    @pipeline.stage(
+        "export_clusters",
+        deps=["prepare", "project", "cluster", "summarize"],
+        checkpoint=False,
+    )
+    def export_clusters(df, projection, labels, summaries):
+        from rendering import export_scatter
+
+        os.makedirs(out_dir, exist_ok=True)
+        save_result(os.path.join(out_dir, "cluster_summaries.json"), summaries)
+        write_cluster_aggregates(os.path.join(out_dir, "aggregates"), summaries)
+        # 主题分布图：密度瓦片 + 有上限的点样本，大小与对话数量无关
+        projections, _ = projection
+        export_scatter(
+            os.path.join(out_dir, "aggregates", "scatter"),
+            projections,
+            labels,
+            _conversation_texts(df),
+            summaries,
+        )
+        return out_dir
+
+    return pipeline
+
+
+# 每个子命令需要的目标阶段，上游阶段按依赖自动执行或从断点读取
+COMMANDS = {
+    "stats": ["duration_stats", "time_patterns", "export_stats"],
+    "cluster": ["cluster"],
+    "summarize": ["summarize"],
+    "export": [
+        "duration_stats",
+        "time_patterns",
+        "summarize",
+        "export_stats",
+        "export_clusters",
+    ],
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Claude 对话记录年度分析")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="export",
+        choices=list(COMMANDS),
+        help="stats: 时长和时间统计；cluster: 主题聚类；summarize: 聚类并生成摘要；"
+        "export: 执行全部阶段并导出结果（默认）",
+    )
+    parser.add_argument("--data", default=DATA_PATH, help="Claude 导出的 conversations.json")
+    parser.add_argument("--out", default=OUT_DIR, help="结果输出目录")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="阶段断点目录")
+    parser.add_argument(
+        "--time-series-dir",
+        default=None,
+        help="跨导出累积的时间序列汇总目录，默认为断点目录下的 time_series",
+    )
+    parser.add_argument(
+        "--tz",
+        default=os.getenv("timezone", "UTC"),
+        help="时间统计使用的时区，如 Asia/Shanghai",
+    )
+    parser.add_argument(
+        "--force", action="append", default=[], metavar="STAGE", help="忽略断点重新执行的阶段，可重复指定"
+    )
+    parser.add_argument(
+        "--profile-dir", default=os.getenv("profile_dir"), help="写出 trace 和指标的目录"
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        default=os.getenv("profile_cprofile") == "1",
+        help="对热点函数开启 cProfile",
     )
+    return parser.parse_args(argv)
 
-    # 输出分析结果
+
+def print_stats(duration_stats, time_patterns):
     print("=== Chat Analysis Results ===")
     print(f"\nAverage chat duration: {duration_stats['average_duration']}")
     print(f"Total chat duration: {duration_stats['total_duration']}")
@@ -65,16 +336,53 @@ def main():
     print(f"\nHourly Chat Distribution:\n{time_patterns['hourly_pattern']}")
     print(f"\nSeasonal Chat Distribution:\n{time_patterns['seasonal_pattern']}")
 
+
+def print_clusters(summaries):
+    # 对结果按频率排序
+    sorted_clusters = sorted(
+        [(k, v) for k, v in summaries.items() if k != -1],  # 排除噪声点(-1)
+        key=lambda x: x[1]["nums"],
+        reverse=True,
+    )
+
     # 打印排序后的聚类结果
     print("\n=== Topic Clusters (Sorted by Frequency) ===")
     for cluster_id, cluster_info in sorted_clusters:
         print(f"\nCluster {cluster_id} ({cluster_info['nums']} conversations):")
         print(cluster_info["cluster"])
 
-    # 保存结果，用于可视化展示
-    save_result("./out/cluster_summaries.json", summaries)
-    save_result("./out/duration_stats.json", duration_stats)
-    save_result("./out/time_patterns.json", time_patterns)
+
+def main(argv=None, token_counter=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    # 指定 profile_dir 时记录各阶段的耗时和内存，结束后写出 trace 和指标
+    if args.profile_dir:
+        profiler = configure(cprofile=args.cprofile)
+
+    pipeline = build_pipeline(
+        args.data,
+        args.out,
+        args.checkpoint_dir,
+        args.time_series_dir,
+        token_counter=token_counter,
+        tz=args.tz,
+    )
+    try:
+        results = pipeline.run(COMMANDS[args.command], force=args.force)
+    finally:
+        pipeline.close()
+
+    if "duration_stats" in results:
+        print_stats(results["duration_stats"], results["time_patterns"])
+    if "summarize" in results:
+        print_clusters(results["summarize"])
+    elif "cluster" in results:
+        print("\n=== Cluster Sizes ===")
+        for label, size in sorted(Counter(results["cluster"].tolist()).items()):
+            print(f"Cluster {label}: {size} items" if label != -1 else f"Noise points: {size}")
+
+    if args.profile_dir:
+        profiler.write(args.profile_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+"""
+Description: 数组形式的聚类成员关系（类似CSR）：按类别排序的文档id + 每个类别的偏移量
+"""
+
+import numpy as np
+
+from artifacts import load_array, save_array
+
+
+class ClusterMembership:
+    def __init__(self, label_ids, offsets, doc_ids, centers=None):
+        self.label_ids = label_ids
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.centers = centers
+
+    @classmethod
+    def from_labels(cls, labels, points=None):
+        """按类别做一次稳定排序得到成员关系，给定 points 时同时计算任意维度的簇中心"""
+        labels = np.asarray(labels)
+        doc_ids = np.argsort(labels, kind="stable")
+        label_ids, counts = np.unique(labels, return_counts=True)
+        offsets = np.zeros(len(label_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        membership = cls(label_ids, offsets, doc_ids)
+        if points is not None:
+            membership.centers = membership.compute_centers(points)
+        return membership
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def compute_centers(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        if len(self.label_ids) == 0:
+            return np.empty((0, points.shape[1]))
+        sums = np.add.reduceat(points[self.doc_ids], self.offsets[:-1], axis=0)
+        return sums / self.sizes[:, None]
+
+    def docs(self, label):
+        i = np.searchsorted(self.label_ids, label)
+        if i == len(self.label_ids) or self.label_ids[i] != label:
+            return self.doc_ids[:0]
+        return self.doc_ids[self.offsets[i] : self.offsets[i + 1]]
+
+    def label2docs(self):
+        """{类别: 文档id数组视图}，不复制数据"""
+        return {
+            int(label): self.doc_ids[self.offsets[i] : self.offsets[i + 1]]
+            for i, label in enumerate(self.label_ids)
+        }
+
+    def center_map(self):
+        return {int(label): tuple(self.centers[i]) for i, label in enumerate(self.label_ids)}
+
+    def mean_distance_to_center(self, points, labels):
+        """每个类别内的点到簇中心的平均欧氏距离"""
+        index = np.searchsorted(self.label_ids, labels)
+        distances = np.linalg.norm(np.asarray(points) - self.centers[index], axis=1)
+        return np.bincount(index, weights=distances, minlength=len(self.label_ids)) / self.sizes
+
+    def save(self, folder):
+        save_array(folder, "label_ids", self.label_ids)
+        save_array(folder, "label_offsets", self.offsets)
+        save_array(folder, "label_doc_ids", self.doc_ids)
+        save_array(folder, "cluster_centers", self.centers)
+
+    @classmethod
+    def load(cls, folder):
+        return cls(
+            load_array(folder, "label_ids"),
+            load_array(folder, "label_offsets"),
+            load_array(folder, "label_doc_ids"),
+            load_array(folder, "cluster_centers"),
+        )
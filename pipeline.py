@@ -0,0 +1,224 @@
+"""
+Description: 带指纹和断点的阶段DAG
+
+每个阶段的指纹由阶段名、版本、参数、输入文件状态和上游阶段的指纹共同决定，
+执行完成后把结果写到 checkpoint_dir/<阶段名>-<指纹>.pkl。重新运行时指纹不变的阶段
+直接读取断点，只有参数或上游发生变化（或上次中途失败、结果不完整）的阶段才会重新执行；
+只被已缓存阶段依赖的上游阶段不会执行也不会读取。互不依赖的阶段在线程池里并发运行。
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from profiling import stage as profile_stage
+
+
+class Incomplete:
+    """阶段返回 Incomplete(result) 表示结果可用但不完整（比如部分摘要请求失败）
+
+    结果照常传给下游，但不写断点，依赖它的阶段也不写断点，下次运行时重新执行。
+    """
+
+    def __init__(self, result, reason=""):
+        self.result = result
+        self.reason = reason
+
+
+def _dump_pickle(obj, path):
+    with open(path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def file_fingerprint(path):
+    """用路径、大小和修改时间代表文件内容，避免每次运行都完整读取大文件做哈希"""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+class Stage:
+    def __init__(self, name, fn, deps, params, files, version, checkpoint, dump, load):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.files = tuple(files)
+        self.version = version
+        self.checkpoint = checkpoint
+        self.dump = dump or _dump_pickle
+        self.load = load or _load_pickle
+
+
+class Pipeline:
+    def __init__(self, checkpoint_dir, max_workers=4):
+        self.checkpoint_dir = checkpoint_dir
+        self.max_workers = max_workers
+        self.stages = {}
+        self._fingerprints = {}
+        self._incomplete = set()
+        self._cleanups = []
+
+    def stage(
+        self,
+        name,
+        deps=(),
+        params=None,
+        files=(),
+        version=1,
+        checkpoint=True,
+        dump=None,
+        load=None,
+    ):
+        """注册阶段的装饰器，被装饰函数按 deps 的顺序接收上游阶段的结果
+
+        checkpoint=False 的阶段每次都重新执行（适合读取流式输入或写出最终结果）；
+        dump(obj, path) / load(path) 用于不能 pickle 的结果，比如 faiss 索引。
+        """
+
+        def decorator(fn):
+            for dep in deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'.")
+            self.stages[name] = Stage(
+                name, fn, deps, params, files, version, checkpoint, dump, load
+            )
+            self._fingerprints.clear()
+            return fn
+
+        return decorator
+
+    def on_close(self, fn):
+        """注册 close() 时调用的清理函数，如停止模型的多进程池"""
+        self._cleanups.append(fn)
+        return fn
+
+    def close(self):
+        while self._cleanups:
+            self._cleanups.pop()()
+
+    def fingerprint(self, name):
+        if name not in self._fingerprints:
+            stage = self.stages[name]
+            payload = json.dumps(
+                {
+                    "name": name,
+                    "version": stage.version,
+                    "params": stage.params,
+                    "files": [file_fingerprint(path) for path in stage.files],
+                    "deps": [self.fingerprint(dep) for dep in stage.deps],
+                },
+                sort_keys=True,
+                default=repr,
+            )
+            self._fingerprints[name] = hashlib.sha256(payload.encode()).hexdigest()[:16]
+        return self._fingerprints[name]
+
+    def checkpoint_path(self, name):
+        return os.path.join(self.checkpoint_dir, f"{name}-{self.fingerprint(name)}.pkl")
+
+    def _plan(self, targets, force):
+        """返回需要执行和需要读取断点的阶段集合"""
+        to_run, to_load = set(), set()
+
+        def visit(name):
+            if name in to_run or name in to_load:
+                return
+            stage = self.stages[name]
+            cached = (
+                stage.checkpoint
+                and name not in force
+                and os.path.exists(self.checkpoint_path(name))
+            )
+            if cached:
+                to_load.add(name)
+                return
+            to_run.add(name)
+            for dep in stage.deps:
+                visit(dep)
+
+        for name in targets:
+            visit(name)
+        return to_run, to_load
+
+    def _descendants(self, names):
+        """names 以及所有直接或间接依赖它们的阶段"""
+        closure = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages.values():
+                if stage.name not in closure and closure.intersection(stage.deps):
+                    closure.add(stage.name)
+                    changed = True
+        return closure
+
+    def _execute(self, name, results):
+        stage = self.stages[name]
+        start = time.perf_counter()
+        with profile_stage(name):
+            result = stage.fn(*[results[dep] for dep in stage.deps])
+        if isinstance(result, Incomplete):
+            logging.warning(f"stage {name} incomplete, not checkpointed: {result.reason}")
+            self._incomplete.add(name)
+            result = result.result
+        elif self._incomplete.intersection(stage.deps):
+            self._incomplete.add(name)
+        if stage.checkpoint and name not in self._incomplete:
+            path = self.checkpoint_path(name)
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            stage.dump(result, tmp_path)
+            os.replace(tmp_path, path)
+            # 清理同一阶段旧指纹的断点
+            for old in glob.glob(os.path.join(self.checkpoint_dir, f"{name}-*.pkl")):
+                if old != path:
+                    os.remove(old)
+        logging.info(f"stage {name} finished in {time.perf_counter() - start:.2f}s")
+        return result
+
+    def _restore(self, name):
+        logging.info(f"stage {name} restored from checkpoint")
+        return self.stages[name].load(self.checkpoint_path(name))
+
+    def run(self, targets=None, force=()):
+        """执行到 targets（默认全部阶段），返回 {阶段名: 结果}
+
+        force 中的阶段忽略断点重新执行，它的下游阶段因为输入变化也会重新执行。
+        """
+        targets = list(targets or self.stages)
+        force = self._descendants(force)
+        self._incomplete = set()
+        to_run, to_load = self._plan(targets, force)
+
+        results = {}
+        pending = set(to_run) | set(to_load)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while pending or running:
+                    for name in sorted(pending):
+                        if name in to_load:
+                            running[executor.submit(self._restore, name)] = name
+                            pending.discard(name)
+                        elif all(dep in results for dep in self.stages[name].deps):
+                            running[executor.submit(self._execute, name, results)] = name
+                            pending.discard(name)
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+        return {name: results[name] for name in targets}
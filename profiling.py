@@ -0,0 +1,252 @@
+"""
+Description: 分阶段的耗时/内存统计
+
+    from profiling import stage, profiled
+
+    with stage("embed", items=len(texts)):
+        ...
+
+    @profiled("umap")
+    def project(...):
+        ...
+
+默认关闭，关闭时 stage() 返回共享的空上下文、profiled 只多一次属性判断，开销可以忽略。
+开启后记录每个阶段的墙钟时间、CPU时间、结束时的RSS和峰值RSS、处理条数，
+可以导出 Chrome trace（chrome://tracing 或 Perfetto 打开）和 Prometheus 文本格式。
+cprofile=True 时被 profiled 装饰的热点函数会在 cProfile 下运行，结果写成 pstats 文件；
+py-spy 是外部采样器，直接 `py-spy record --pid <pid>` 即可，不需要代码配合。
+"""
+
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """当前常驻内存（字节），拿不到 /proc 时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss():
+    """进程启动以来的峰值常驻内存（字节）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class _NullStage:
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name, items):
+        self.profiler = profiler
+        self.name = name
+        # 处理条数在进入阶段前不一定知道，可以在 with 块里再赋值
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        # 进程CPU时间，包含线程池里的工作线程；并发运行的阶段会互相计入
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler._record(
+            {
+                "name": self.name,
+                "start": self.start,
+                "seconds": end - self.start,
+                "cpu_seconds": time.process_time() - self.cpu_start,
+                "rss_bytes": current_rss(),
+                "peak_rss_bytes": peak_rss(),
+                "items": self.items,
+                "tid": threading.get_ident(),
+            }
+        )
+        return False
+
+
+class Profiler:
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.records = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._cprofile = None
+        self._cprofile_depth = 0
+        self._cprofile_owner = None
+
+    def stage(self, name, items=None):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, items)
+
+    def _record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def run_profiled(self, fn, *args, **kwargs):
+        """在 cProfile 下执行热点函数，嵌套调用只在最外层开关
+
+        同一时刻只能有一个 cProfile 生效，其他线程里并发的调用直接执行、不计入 pstats。
+        """
+        tid = threading.get_ident()
+        with self._lock:
+            if self._cprofile_owner not in (None, tid):
+                owner = False
+            else:
+                owner = True
+                self._cprofile_owner = tid
+                if self._cprofile is None:
+                    self._cprofile = cProfile.Profile()
+                self._cprofile_depth += 1
+                if self._cprofile_depth == 1:
+                    self._cprofile.enable()
+        if not owner:
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._cprofile_depth -= 1
+                if self._cprofile_depth == 0:
+                    self._cprofile.disable()
+                    self._cprofile_owner = None
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+        self._origin = time.perf_counter()
+        self._cprofile = None
+
+    def summary(self):
+        """按阶段名汇总：调用次数、总耗时、总CPU时间、总条数、最大峰值RSS"""
+        totals = defaultdict(
+            lambda: {"calls": 0, "seconds": 0.0, "cpu_seconds": 0.0, "items": 0, "peak_rss_bytes": 0}
+        )
+        for record in self.records:
+            total = totals[record["name"]]
+            total["calls"] += 1
+            total["seconds"] += record["seconds"]
+            total["cpu_seconds"] += record["cpu_seconds"]
+            total["items"] += record["items"] or 0
+            total["peak_rss_bytes"] = max(total["peak_rss_bytes"], record["peak_rss_bytes"])
+        return dict(totals)
+
+    def chrome_trace(self):
+        """Chrome trace event 格式，每个阶段一个完整事件（ph=X），时间单位为微秒"""
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            args = {
+                "cpu_seconds": record["cpu_seconds"],
+                "rss_bytes": record["rss_bytes"],
+                "peak_rss_bytes": record["peak_rss_bytes"],
+            }
+            if record["items"] is not None:
+                args["items"] = record["items"]
+            events.append(
+                {
+                    "name": record["name"],
+                    "cat": "stage",
+                    "ph": "X",
+                    "ts": (record["start"] - self._origin) * 1e6,
+                    "dur": record["seconds"] * 1e6,
+                    "pid": pid,
+                    "tid": record["tid"],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def prometheus_text(self, prefix="claude_analysis"):
+        metrics = [
+            ("stage_calls_total", "counter", "Number of times the stage ran", "calls"),
+            ("stage_seconds_total", "counter", "Wall time spent in the stage", "seconds"),
+            ("stage_cpu_seconds_total", "counter", "CPU time spent in the stage", "cpu_seconds"),
+            ("stage_items_total", "counter", "Items processed by the stage", "items"),
+            ("stage_peak_rss_bytes", "gauge", "Peak RSS observed at the end of the stage", "peak_rss_bytes"),
+        ]
+        summary = self.summary()
+        lines = []
+        for metric, kind, help_text, field in metrics:
+            name = f"{prefix}_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage_name, total in summary.items():
+                label = stage_name.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{name}{{stage="{label}"}} {total[field]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, folder):
+        """把 trace.json、metrics.prom 以及（如果有）profile.pstats 写到目录下"""
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "trace.json"), "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+        with open(os.path.join(folder, "metrics.prom"), "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(folder, "profile.pstats"))
+
+
+# 进程内共享的默认实例
+profiler = Profiler()
+
+
+def configure(enabled=True, cprofile=False):
+    profiler.enabled = enabled
+    profiler.cprofile = cprofile
+    profiler.reset()
+    return profiler
+
+
+def stage(name, items=None):
+    return profiler.stage(name, items)
+
+
+def profiled(name=None, items=None):
+    """把函数调用记为一个阶段；开启 cprofile 时同时在 cProfile 下运行
+
+    items 是接收同样参数、返回处理条数的函数，如 lambda self, texts: len(texts)
+    """
+
+    def decorator(fn):
+        stage_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            n = items(*args, **kwargs) if items is not None else None
+            with profiler.stage(stage_name, n):
+                if profiler.cprofile:
+                    return profiler.run_profiled(fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,375 @@
+"""
+Description: 大规模 UMAP 降维：PCA 预降维、分层抽样的 landmark 上拟合、其余点分批并行 transform，
+以及相对完整拟合的质量评估（trustworthiness / 近邻保持率）
+
+UMAP 拟合的时间和内存随点数超线性增长，而 transform 是逐点独立的：只在有代表性的
+landmark 上 fit，其余点投影到已有的布局上，耗时随 N 线性增长，并且可以分批、多进程执行。
+"""
+
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+
+from graph_clustering import cosine_distances
+
+# 可以直接用 faiss 计算近邻的度量，其余度量交给 umap 自己的 NN-descent
+FAISS_METRICS = ("cosine", "euclidean")
+
+
+class PCAReducer:
+    """在样本上拟合的 PCA，transform 分批进行，不需要一次载入全部数据的协方差"""
+
+    def __init__(self, n_components, fit_size=50000, batch_size=65536, seed=42):
+        self.n_components = n_components
+        self.fit_size = fit_size
+        self.batch_size = batch_size
+        self.seed = seed
+        self.mean_ = None
+        self.components_ = None
+        self.explained_variance_ratio_ = None
+
+    def fit(self, x):
+        n = len(x)
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(n, min(n, self.fit_size), replace=False))
+        data = np.asarray(x[sample], dtype=np.float64)
+        self.mean_ = data.mean(axis=0)
+        _, s, vt = np.linalg.svd(data - self.mean_, full_matrices=False)
+        n_components = min(self.n_components, vt.shape[0])
+        self.components_ = vt[:n_components].astype(np.float32)
+        variance = s**2
+        self.explained_variance_ratio_ = variance[:n_components] / max(variance.sum(), 1e-12)
+        return self
+
+    def transform(self, x):
+        mean = self.mean_.astype(np.float32)
+        out = np.empty((len(x), len(self.components_)), dtype=np.float32)
+        for start in range(0, len(x), self.batch_size):
+            batch = np.asarray(x[start : start + self.batch_size], dtype=np.float32)
+            out[start : start + len(batch)] = (batch - mean) @ self.components_.T
+        return out
+
+    def fit_transform(self, x):
+        return self.fit(x).transform(x)
+
+
+def stratified_sample(x, n_samples, n_strata=None, seed=42):
+    """按 k-means 粗分区分层抽样，返回排好序的下标
+
+    每层按大小等比例分配名额，且至少 1 个，小簇在 landmark 中不会整体缺失。
+    """
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    n = len(x)
+    if n_samples >= n:
+        return np.arange(n)
+    n_strata = int(min(n_strata or max(1, np.sqrt(n_samples)), n_samples))
+
+    kmeans = faiss.Kmeans(x.shape[1], n_strata, niter=10, seed=seed)
+    kmeans.train(x)
+    _, strata = kmeans.index.search(x, 1)
+    strata = strata[:, 0]
+
+    sizes = np.bincount(strata, minlength=n_strata)
+    quota = np.floor(sizes * n_samples / n).astype(np.int64)
+    quota = np.minimum(np.maximum(quota, sizes > 0), sizes)
+    # 取整剩下的名额按余数从大到小补给还有剩余点的层
+    remainder = n_samples - quota.sum()
+    if remainder > 0:
+        fraction = sizes * n_samples / n - quota
+        fraction[quota >= sizes] = -1
+        for stratum in np.argsort(-fraction, kind="stable")[:remainder]:
+            quota[stratum] += 1
+
+    rng = np.random.default_rng(seed)
+    order = np.argsort(strata, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    picked = [
+        rng.choice(order[bounds[s] : bounds[s + 1]], quota[s], replace=False)
+        for s in range(n_strata)
+        if quota[s] > 0
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def faiss_knn(index, queries, k, batch_size=16384):
+    """用 faiss 索引检索 k 近邻，返回 (下标, 余弦距离)，供 umap 的 precomputed_knn 使用"""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    dists = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), batch_size):
+        dist, neighbours = index.search(queries[start : start + batch_size], k)
+        indices[start : start + len(dist)] = neighbours
+        dists[start : start + len(dist)] = np.maximum(
+            cosine_distances(dist, index.metric_type), 0.0
+        )
+    return indices, dists
+
+
+def _exact_knn(x, k, metric):
+    """在 landmark 上精确计算 k 近邻，cosine 返回余弦距离，euclidean 返回欧氏距离"""
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    if metric == "cosine":
+        x = x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+        index = faiss.IndexFlatIP(x.shape[1])
+        index.add(x)
+        return faiss_knn(index, x, k)
+    index = faiss.IndexFlatL2(x.shape[1])
+    index.add(x)
+    dist, neighbours = index.search(x, k)
+    return neighbours, np.sqrt(np.maximum(dist, 0.0))
+
+
+def knn_search_index(x, knn_indices, knn_dists, metric, random_state=42):
+    """以已有的近邻图初始化 NN-descent 索引
+
+    umap 使用 precomputed_knn 时没有自己的检索索引，transform 新数据需要它；
+    用现成的近邻图初始化、不再迭代，构建开销很小。
+    """
+    from pynndescent import NNDescent
+
+    index = NNDescent(
+        np.ascontiguousarray(x, dtype=np.float32),
+        metric=metric,
+        n_neighbors=knn_indices.shape[1],
+        init_graph=knn_indices.astype(np.int32),
+        init_dist=knn_dists.astype(np.float32),
+        n_iters=0,
+        random_state=random_state,
+    )
+    # 传入 init_graph 时 NNDescent 不建随机投影树，查询从随机点出发，近邻图不连通（簇之间
+    # 没有边）时会困在错误的簇里；打开 tree_init，首次查询时先建一棵小的检索树作为起点
+    index.tree_init = True
+    return index
+
+
+def fit_umap(mapper, x, knn=None):
+    """拟合 umap；knn=(下标, 距离) 时跳过 umap 内部的近邻计算"""
+    if knn is not None:
+        knn_indices, knn_dists = knn
+        mapper.precomputed_knn = (
+            knn_indices,
+            knn_dists,
+            knn_search_index(x, knn_indices, knn_dists, mapper.metric),
+        )
+    return mapper.fit_transform(x)
+
+
+_worker_mapper = None
+
+
+def _init_worker(mapper):
+    global _worker_mapper
+    _worker_mapper = mapper
+
+
+def _transform_worker(batch):
+    return _worker_mapper.transform(batch)
+
+
+class LandmarkProjector:
+    """PCA + landmark 上拟合的 umap，transform 分批、多进程执行
+
+    与 umap 的 mapper 一样提供 transform，可以直接作为 ClusterClassifier.umap_mapper 保存和增量更新。
+    n_jobs > 1 时的进程池在第一次 transform 时启动并一直复用，close() 停止。
+    """
+
+    def __init__(
+        self,
+        mapper,
+        pca_components=None,
+        n_landmarks=None,
+        n_strata=None,
+        batch_size=16384,
+        n_jobs=1,
+        seed=42,
+    ):
+        self.mapper = mapper
+        self.pca = PCAReducer(pca_components, seed=seed) if pca_components else None
+        self.n_landmarks = n_landmarks
+        self.n_strata = n_strata
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.landmarks_ = None
+        self.timings_ = {}
+        self._pool = None
+
+    def __getstate__(self):
+        # 进程池不能 pickle，保存和传给子进程时去掉
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        return state
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _reduce(self, x):
+        return self.pca.transform(x) if self.pca is not None else np.asarray(x, dtype=np.float32)
+
+    def fit_transform(self, embeddings, knn=None):
+        """knn 为全部点在原始空间的 (下标, 距离)，只在不降维、不抽样时可以直接复用"""
+        timings = {}
+        start = time.perf_counter()
+        if self.pca is not None:
+            reduced = self.pca.fit_transform(embeddings)
+            logging.info(
+                f"pca {embeddings.shape[1]} -> {reduced.shape[1]} dims, "
+                f"explained variance {self.pca.explained_variance_ratio_.sum():.3f}"
+            )
+        else:
+            reduced = np.asarray(embeddings, dtype=np.float32)
+        timings["pca"] = time.perf_counter() - start
+
+        n = len(reduced)
+        start = time.perf_counter()
+        if self.n_landmarks is not None and self.n_landmarks < n:
+            self.landmarks_ = stratified_sample(
+                reduced, self.n_landmarks, self.n_strata, seed=self.seed
+            )
+        else:
+            self.landmarks_ = np.arange(n)
+        timings["sample"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        landmark_data = reduced[self.landmarks_]
+        sampled = len(self.landmarks_) < n
+        if sampled or self.pca is not None:
+            # 原始空间的近邻图不对应 landmark / 降维后的数据；landmark 数量有限，直接精确计算
+            knn = None
+            if self.mapper.metric in FAISS_METRICS:
+                knn = _exact_knn(landmark_data, self.mapper.n_neighbors, self.mapper.metric)
+        logging.info(f"fitting umap on {len(self.landmarks_)}/{n} points...")
+        landmark_projections = fit_umap(self.mapper, landmark_data, knn)
+        timings["fit"] = time.perf_counter() - start
+
+        projections = np.empty((n, landmark_projections.shape[1]), dtype=np.float32)
+        projections[self.landmarks_] = landmark_projections
+        start = time.perf_counter()
+        if sampled:
+            rest = np.ones(n, dtype=bool)
+            rest[self.landmarks_] = False
+            projections[rest] = self._transform_reduced(reduced[rest])
+        timings["transform"] = time.perf_counter() - start
+
+        self.timings_ = timings
+        logging.info(
+            "umap timings: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())
+        )
+        return projections
+
+    def transform(self, embeddings):
+        return self._transform_reduced(self._reduce(embeddings))
+
+    def _transform_reduced(self, x):
+        batches = [x[start : start + self.batch_size] for start in range(0, len(x), self.batch_size)]
+        if not batches:
+            return np.empty((0, self.mapper.n_components), dtype=np.float32)
+        if self.n_jobs > 1 and len(batches) > 1:
+            results = list(self._get_pool().map(_transform_worker, batches))
+        else:
+            results = [self.mapper.transform(batch) for batch in batches]
+        return np.vstack(results).astype(np.float32)
+
+    def _get_pool(self):
+        # numba 的并行层在多线程里同时调用不安全，这里用进程池；mapper 只在初始化时传给每个进程一次。
+        # 父进程里已有 numba / torch / OpenMP 的线程，fork 有死锁风险
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.n_jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.mapper,),
+            )
+        return self._pool
+
+
+def _knn(index, queries, k):
+    # 查询点本身在索引中，多取一个再去掉自身
+    _, neighbours = index.search(np.ascontiguousarray(queries, dtype=np.float32), k + 1)
+    return neighbours
+
+
+def neighbour_preservation(index, x, projections, sample, k):
+    """x 中的 k 近邻（由 index 检索）在投影空间中仍是 k 近邻的比例"""
+    projections = np.ascontiguousarray(projections, dtype=np.float32)
+    projected_index = faiss.IndexFlatL2(projections.shape[1])
+    projected_index.add(projections)
+    original = _knn(index, x[sample], k)
+    projected = _knn(projected_index, projections[sample], k)
+
+    overlap = []
+    for i, doc in enumerate(sample):
+        a = original[i][(original[i] != doc) & (original[i] >= 0)][:k]
+        b = projected[i][projected[i] != doc][:k]
+        overlap.append(len(np.intersect1d(a, b)) / k)
+    return float(np.mean(overlap))
+
+
+def _sample(n, n_samples, seed):
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n, min(n_samples, n), replace=False))
+
+
+def projection_quality(embeddings, projections, k=10, n_samples=1000, index=None, seed=42):
+    """在随机抽取的点上评估降维质量
+
+    neighbour_preservation: 原始空间 k 近邻在投影空间中仍是 k 近邻的比例，
+        原始空间的近邻用 index 检索，可以直接传入已建好的 faiss 索引；
+    trustworthiness: sklearn 的 trustworthiness，在抽样点之间按余弦距离计算。
+    """
+    from sklearn.manifold import trustworthiness
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n = len(embeddings)
+    k = min(k, n - 1)
+    sample = _sample(n, n_samples, seed)
+    if index is None:
+        index = faiss.IndexFlatIP(embeddings.shape[1])
+        index.add(embeddings)
+
+    # trustworthiness 要求 n_neighbors < n_samples / 2
+    sample_k = min(k, len(sample) // 2 - 1)
+    return {
+        "k": k,
+        "n_samples": len(sample),
+        "neighbour_preservation": neighbour_preservation(
+            index, embeddings, projections, sample, k
+        ),
+        "trustworthiness": float(
+            trustworthiness(
+                embeddings[sample], projections[sample], n_neighbors=sample_k, metric="cosine"
+            )
+        )
+        if sample_k >= 1
+        else float("nan"),
+    }
+
+
+def compare_projections(embeddings, projections, reference, k=10, n_samples=1000, index=None, seed=42):
+    """对比 landmark 投影与完整拟合的投影 reference
+
+    除了两者各自的质量，agreement 为 reference 中的 k 近邻在 landmark 投影中仍是 k 近邻的比例。
+    """
+    reference = np.ascontiguousarray(reference, dtype=np.float32)
+    reference_index = faiss.IndexFlatL2(reference.shape[1])
+    reference_index.add(reference)
+    k_ = min(k, len(reference) - 1)
+    return {
+        "landmark": projection_quality(embeddings, projections, k, n_samples, index, seed),
+        "full": projection_quality(embeddings, reference, k, n_samples, index, seed),
+        "agreement": neighbour_preservation(
+            reference_index, reference, projections, _sample(len(reference), n_samples, seed), k_
+        ),
+    }
@@ -0,0 +1,241 @@
+"""
+Description: 大规模二维投影的渲染：按簇分箱的密度图、分层细节（LOD）点样本、瓦片 / PNG 导出
+
+点数很多时不再逐点绘制：先把点按网格分箱，得到每个格子里各簇的点数（稀疏矩阵，内存 O(非空格子)），
+再按簇颜色加权混合、按对数密度设置透明度渲染成图片。交互和悬停只使用固定上限的点样本，
+悬停文本按样本顺序分片写出，看板在需要时再按 id 加载。渲染耗时和输出大小只取决于分辨率和样本上限。
+
+导出目录结构：
+    meta.json              坐标范围、瓦片大小和层级
+    overview.png           整体密度图
+    tiles/<z>/<x>/<y>.png  第 z 层共 2^z × 2^z 块瓦片，y 从上往下编号，空白瓦片不写出
+    clusters.json          各簇的颜色、中心和主题
+    points.json            LOD 样本的 id、坐标和类别
+    hover/<k>.json         第 k 片样本（points 中下标 k*shard_size 起）的悬停文本，{id: 文本}
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+# 与 matplotlib tab20 一致的配色，噪声点为浅灰
+PALETTE = [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+    "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+    "#aec7e8", "#ffbb78", "#98df8a", "#ff9896", "#c5b0d5",
+    "#c49c94", "#f7b6d2", "#c7c7c7", "#dbdb8d", "#9edae5",
+]  # fmt: skip
+NOISE_COLOR = "#d0d0d0"
+
+
+def hex_to_rgb(color):
+    return [int(color[i : i + 2], 16) for i in (1, 3, 5)]
+
+
+def label_color(label):
+    return NOISE_COLOR if label == -1 else PALETTE[label % len(PALETTE)]
+
+
+def data_extent(projections, padding=0.02):
+    """(xmin, xmax, ymin, ymax)，四周留出 padding 比例的边距，宽高为 0 时补成 1"""
+    lo = projections.min(axis=0).astype(np.float64)
+    hi = projections.max(axis=0).astype(np.float64)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    lo, hi = lo - padding * span, hi + padding * span
+    return float(lo[0]), float(hi[0]), float(lo[1]), float(hi[1])
+
+
+def bin_points(projections, extent, bins):
+    """每个点所在格子的编号 row * bins + col，第 0 行在最上方（y 最大），范围外的点归入边缘格子"""
+    xmin, xmax, ymin, ymax = extent
+    col = np.floor((projections[:, 0] - xmin) / (xmax - xmin) * bins).astype(np.int64)
+    row = np.floor((ymax - projections[:, 1]) / (ymax - ymin) * bins).astype(np.int64)
+    return np.clip(row, 0, bins - 1) * bins + np.clip(col, 0, bins - 1)
+
+
+def cluster_histograms(projections, labels, extent, bins=512):
+    """按簇统计的二维直方图，返回 (CSR 矩阵[格子, 簇], 簇标签)"""
+    label_ids, label_index = np.unique(np.asarray(labels), return_inverse=True)
+    cells = bin_points(projections, extent, bins)
+    hist = sparse.csr_matrix(
+        (np.ones(len(cells), dtype=np.float32), (cells, label_index.ravel())),
+        shape=(bins * bins, len(label_ids)),
+    )
+    return hist, label_ids
+
+
+def render_density(hist, label_ids, bins, min_alpha=0.2):
+    """直方图渲染成 RGBA 图片（uint8, bins×bins×4）
+
+    颜色为格子内各簇颜色按点数加权的平均，透明度与 log(1+点数) 成正比，空格子完全透明。
+    """
+    colors = np.array([hex_to_rgb(label_color(label)) for label in label_ids.tolist()], dtype=np.float32)
+    counts = np.asarray(hist.sum(axis=1)).ravel()
+    filled = np.flatnonzero(counts)
+
+    image = np.zeros((bins * bins, 4), dtype=np.uint8)
+    if len(filled):
+        rgb = (hist[filled] @ colors) / counts[filled, None]
+        alpha = min_alpha + (1 - min_alpha) * np.log1p(counts[filled]) / np.log1p(counts.max())
+        image[filled, :3] = np.clip(rgb, 0, 255).astype(np.uint8)
+        image[filled, 3] = np.clip(alpha * 255, 0, 255).astype(np.uint8)
+    return image.reshape(bins, bins, 4)
+
+
+def lod_sample(projections, max_points=20000, extent=None, grid=128, seed=42):
+    """分层细节样本：每个格子最多保留 cap 个点，cap 取使样本数不超过 max_points 的最大值
+
+    稀疏区域的点全部保留，稠密区域被稀释，缩小后的样本仍覆盖所有区域。返回排好序的下标。
+    """
+    n = len(projections)
+    if n <= max_points:
+        return np.arange(n)
+    extent = extent or data_extent(projections)
+    cells = bin_points(projections, extent, grid)
+
+    # 随机打乱后按格子稳定排序，得到每个点在格子内的随机名次
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(n)
+    by_cell = order[np.argsort(cells[order], kind="stable")]
+    counts = np.bincount(cells, minlength=grid * grid)
+    starts = np.cumsum(counts) - counts
+    rank = np.empty(n, dtype=np.int64)
+    rank[by_cell] = np.arange(n) - np.repeat(starts, counts)
+
+    nonzero = counts[counts > 0]
+    lo, hi = 0, int(nonzero.max())
+    while lo < hi:
+        cap = (lo + hi + 1) // 2
+        if np.minimum(nonzero, cap).sum() <= max_points:
+            lo = cap
+        else:
+            hi = cap - 1
+    keep = rank < lo
+    # 剩余名额从名次恰好为 cap 的点中随机补足
+    extra = max_points - int(keep.sum())
+    if extra > 0:
+        candidates = np.flatnonzero(rank == lo)
+        keep[rng.choice(candidates, min(extra, len(candidates)), replace=False)] = True
+    return np.flatnonzero(keep)
+
+
+def save_png(path, image):
+    from PIL import Image
+
+    Image.fromarray(image, "RGBA").save(path, optimize=True)
+
+
+def write_tiles(folder, projections, labels, extent, tile_size=256, levels=3):
+    """按层写出 PNG 瓦片，第 z 层的分辨率为 tile_size * 2^z，返回写出的瓦片数"""
+    # 清掉上次导出的瓦片，数据变化后已经空白的瓦片不会残留
+    shutil.rmtree(os.path.join(folder, "tiles"), ignore_errors=True)
+    written = 0
+    for z in range(levels + 1):
+        bins = tile_size * 2**z
+        hist, label_ids = cluster_histograms(projections, labels, extent, bins)
+        image = render_density(hist, label_ids, bins)
+        for y in range(2**z):
+            for x in range(2**z):
+                tile = image[y * tile_size : (y + 1) * tile_size, x * tile_size : (x + 1) * tile_size]
+                if not tile[:, :, 3].any():
+                    continue
+                tile_dir = os.path.join(folder, "tiles", str(z), str(x))
+                os.makedirs(tile_dir, exist_ok=True)
+                save_png(os.path.join(tile_dir, f"{y}.png"), tile)
+                written += 1
+    return written
+
+
+def _summary_text(summary):
+    return summary["cluster"] if isinstance(summary, dict) else str(summary)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def export_scatter(
+    folder,
+    projections,
+    labels,
+    texts,
+    summaries=None,
+    overview_bins=1024,
+    tile_size=256,
+    levels=3,
+    max_points=20000,
+    shard_size=1000,
+    hover_chars=256,
+):
+    """写出看板使用的散点图数据，目录结构见模块说明"""
+    projections = np.asarray(projections, dtype=np.float32)
+    labels = np.asarray(labels)
+    # 与瓦片一样先清掉上次导出的悬停分片，样本变少后多出的分片不会残留
+    shutil.rmtree(os.path.join(folder, "hover"), ignore_errors=True)
+    os.makedirs(os.path.join(folder, "hover"))
+    # 从 JSON 读回的摘要键是字符串
+    summaries = {int(k): v for k, v in (summaries or {}).items()}
+    extent = data_extent(projections)
+
+    hist, label_ids = cluster_histograms(projections, labels, extent, overview_bins)
+    save_png(os.path.join(folder, "overview.png"), render_density(hist, label_ids, overview_bins))
+    n_tiles = write_tiles(folder, projections, labels, extent, tile_size, levels)
+
+    sizes = np.asarray(hist.sum(axis=0)).ravel()
+    label_index = np.searchsorted(label_ids, labels)
+    centers = np.stack(
+        [np.bincount(label_index, weights=projections[:, d]) / sizes for d in range(2)], axis=1
+    )
+    clusters = []
+    for i, label in enumerate(label_ids.tolist()):
+        center = centers[i]
+        summary = summaries.get(label)
+        clusters.append(
+            {
+                "label": label,
+                "color": label_color(label),
+                "nums": int(sizes[i]),
+                "x": float(center[0]),
+                "y": float(center[1]),
+                "topic": _summary_text(summary) if summary is not None and label != -1 else None,
+            }
+        )
+    _write_json(os.path.join(folder, "clusters.json"), clusters)
+
+    sample = lod_sample(projections, max_points, extent)
+    _write_json(
+        os.path.join(folder, "points.json"),
+        {
+            "id": sample.tolist(),
+            "x": np.round(projections[sample, 0], 4).tolist(),
+            "y": np.round(projections[sample, 1], 4).tolist(),
+            "label": labels[sample].tolist(),
+            "shard_size": shard_size,
+        },
+    )
+    for k, start in enumerate(range(0, len(sample), shard_size)):
+        ids = sample[start : start + shard_size].tolist()
+        _write_json(
+            os.path.join(folder, "hover", f"{k}.json"),
+            {str(i): texts[i][:hover_chars] for i in ids},
+        )
+
+    _write_json(
+        os.path.join(folder, "meta.json"),
+        {
+            "extent": extent,
+            "n_points": len(projections),
+            "n_sampled": len(sample),
+            "overview_bins": overview_bins,
+            "tile_size": tile_size,
+            "levels": levels,
+            "n_tiles": n_tiles,
+        },
+    )
+    return folder
@@ -0,0 +1,380 @@
+"""
+Description: 基于已保存模型目录的本地语义检索 / 主题归类服务
+
+启动时加载一次模型目录和 embedding 模型并预热，之后常驻内存。并发请求进入同一个队列，
+后台线程把排队中的请求合并成一批（最多 max_batch_size 条），每批只调用一次 embedding 和
+一次 faiss 检索，再把结果分发回各个请求。上一批计算期间到达的请求自然进入下一批，
+低负载时单个请求不需要等待；max_wait_ms > 0 时额外等待更多请求凑批。
+
+接口：
+    GET  /health   {"status": "ok", "n_docs": ..., "batches": ..., "mean_batch_size": ...}
+    POST /search   {"query": "...", "top_k": 10} 或 {"queries": [...], "top_k": 10}
+                   返回查询的推断类别、主题和最相近的 top_k 个对话（含类别和主题）
+
+用法：
+    python serve.py --model out/model --port 8765
+"""
+
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from graph_clustering import cosine_distances
+from vector_index import knn_vote
+
+
+class MicroBatcher:
+    """把并发提交的请求合并成批，在一个后台线程里调用 fn(items) -> results"""
+
+    def __init__(self, fn, max_batch_size=64, max_wait_ms=0.0):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # 先取走已经排队的请求，队列空了再等到 deadline
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def _topic(summary):
+    if summary is None:
+        return None
+    return summary["cluster"] if isinstance(summary, dict) else str(summary)
+
+
+class SearchService:
+    """在已有的 faiss 索引上做语义检索和 kNN 归类
+
+    embed 为 texts -> 归一化 embedding 的函数；duplicates 不为空时，同一重复组只返回最相近的一条。
+    """
+
+    def __init__(
+        self,
+        embed,
+        index,
+        texts,
+        cluster_labels,
+        summaries=None,
+        duplicates=None,
+        vote_k=10,
+        max_top_k=100,
+        max_text_chars=512,
+        max_batch_size=64,
+        max_wait_ms=0.0,
+    ):
+        self.embed = embed
+        self.index = index
+        self.texts = texts
+        self.cluster_labels = np.asarray(cluster_labels)
+        self.summaries = summaries or {}
+        self.duplicates = duplicates
+        self.vote_k = vote_k
+        self.max_top_k = max_top_k
+        self.max_text_chars = max_text_chars
+        self.batcher = MicroBatcher(self._search_batch, max_batch_size, max_wait_ms)
+
+    @classmethod
+    def from_classifier(cls, classifier, **kwargs):
+        def embed(texts):
+            # 查询都很短，跳过 embedding 缓存，也不打印进度条
+            if classifier.embed_agg_strategy is None:
+                return classifier.embed_engine.encode(texts, show_progress_bar=False)
+            return classifier._encode(texts)
+
+        return cls(
+            embed,
+            classifier.faiss_index,
+            classifier.texts,
+            classifier.cluster_labels,
+            summaries=classifier.cluster_summaries,
+            duplicates=classifier.duplicates,
+            **kwargs,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.batcher.close()
+
+    def warmup(self, n=3):
+        """先跑几次完整的检索，排除首次调用模型和索引的额外耗时"""
+        for _ in range(n):
+            self.search("warmup")
+
+    def search(self, query, top_k=10):
+        return self.batcher.submit((query, top_k)).result()
+
+    def search_many(self, queries, top_k=10):
+        futures = [self.batcher.submit((query, top_k)) for query in queries]
+        return [future.result() for future in futures]
+
+    @property
+    def stats(self):
+        return {
+            "n_docs": len(self.texts),
+            "batches": self.batcher.batches,
+            "mean_batch_size": self.batcher.items / max(self.batcher.batches, 1),
+        }
+
+    def _search_batch(self, requests):
+        queries = [query for query, _ in requests]
+        top_ks = [min(max(int(top_k), 1), self.max_top_k) for _, top_k in requests]
+        k = max(max(top_ks), self.vote_k)
+        # 重复组会占用近邻名额，多取一些再去重
+        fetch = k if self.duplicates is None else 4 * k
+        fetch = min(fetch, self.index.ntotal)
+
+        embeddings = np.ascontiguousarray(self.embed(queries), dtype=np.float32)
+        dist, neighbours = self.index.search(embeddings, fetch)
+        dist = cosine_distances(dist, self.index.metric_type)
+
+        valid = neighbours[:, : self.vote_k] >= 0
+        votes = self.cluster_labels[np.where(valid, neighbours[:, : self.vote_k], 0)]
+        labels, confidence = knn_vote(votes, valid=valid)
+        return [
+            self._response(labels[i], confidence[i], neighbours[i], dist[i], top_ks[i])
+            for i in range(len(requests))
+        ]
+
+    def _response(self, label, confidence, neighbours, dist, top_k):
+        results, groups = [], set()
+        for doc, distance in zip(neighbours.tolist(), dist.tolist()):
+            if doc < 0 or len(results) == top_k:
+                break
+            if self.duplicates is not None:
+                group = int(self.duplicates.inverse[doc])
+                if group in groups:
+                    continue
+                groups.add(group)
+            doc_label = int(self.cluster_labels[doc])
+            results.append(
+                {
+                    "id": doc,
+                    "text": self.texts[doc][: self.max_text_chars],
+                    "distance": round(float(distance), 6),
+                    "label": doc_label,
+                    "topic": _topic(self.summaries.get(doc_label)),
+                }
+            )
+        label = int(label)
+        return {
+            "label": label,
+            "topic": _topic(self.summaries.get(label)),
+            "confidence": float(confidence),
+            "results": results,
+        }
+
+
+# 查询必须与建库时用同样的方式编码，这些参数从模型目录的 meta.json 恢复
+SAVED_PARAMS = (
+    "embed_model_name",
+    "embed_max_seq_length",
+    "embed_agg_strategy",
+    "embed_chunk_overlap",
+    "embed_first_k",
+    "embed_backend",
+    "embed_onnx_file_name",
+    "index_type",
+    "index_metric",
+    "index_nprobe",
+    "index_ef_search",
+)
+
+
+def load_classifier(folder, embed_device="cpu", embed_backend=None, embed_model=None):
+    """加载模型目录，embedding 和索引参数取自目录中的 meta.json
+
+    embed_backend 不为 None 时覆盖保存的后端（如用 int8 / onnx 加速同一个模型）；
+    embed_model 为已加载的模型时不再按名称加载
+    """
+    from artifacts import read_meta
+    from text_clustering import ClusterClassifier
+
+    meta = read_meta(folder) or {}
+    params = {key: meta[key] for key in SAVED_PARAMS if key in meta}
+    if embed_backend is not None:
+        params["embed_backend"] = embed_backend
+    classifier = ClusterClassifier(
+        embed_device=embed_device,
+        embed_model=embed_model,
+        summary_create=False,
+        **params,
+    )
+    classifier.load(folder)
+    return classifier
+
+
+def load_service(folder, embed_device="cpu", embed_backend=None, embed_model=None, **kwargs):
+    classifier = load_classifier(
+        folder, embed_device=embed_device, embed_backend=embed_backend, embed_model=embed_model
+    )
+    return SearchService.from_classifier(classifier, **kwargs)
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, data):
+            body = json.dumps(data, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, {"error": "not found"})
+            self._send(200, {"status": "ok", **service.stats})
+
+        def do_POST(self):
+            if self.path != "/search":
+                return self._send(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                top_k = int(body.get("top_k", 10))
+                if "queries" in body:
+                    queries = body["queries"]
+                elif "query" in body:
+                    queries = [body["query"]]
+                else:
+                    raise ValueError("missing 'query' or 'queries'")
+                if not all(isinstance(query, str) for query in queries):
+                    raise ValueError("queries must be strings")
+            except (ValueError, TypeError, AttributeError) as e:
+                return self._send(400, {"error": str(e)})
+
+            try:
+                results = service.search_many(queries, top_k)
+            except Exception as e:
+                logging.exception("search failed")
+                return self._send(500, {"error": str(e)})
+            self._send(200, {"results": results} if "queries" in body else results[0])
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认的 listen backlog 只有 5，并发连接多时会被丢弃并在 1 秒后重传
+    request_queue_size = 128
+
+
+def make_server(service, host="127.0.0.1", port=8765):
+    return _Server((host, port), make_handler(service))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="语义检索 / 主题归类服务")
+    parser.add_argument("--model", required=True, help="ClusterClassifier.save 保存的模型目录")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--embed-device", default="cpu")
+    parser.add_argument(
+        "--embed-backend", default=None, help="torch / int8 / onnx，默认使用模型目录保存的后端"
+    )
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument(
+        "--max-wait-ms", type=float, default=0.0, help="凑批时额外等待的毫秒数，0 表示只合并已排队的请求"
+    )
+    parser.add_argument("--vote-k", type=int, default=10, help="推断查询类别时投票的近邻数")
+    parser.add_argument(
+        "--stub-embed-ms",
+        type=float,
+        default=None,
+        help="压测用：不加载 embedding 模型，改用每次调用固定耗时的 StubEmbedder",
+    )
+    args = parser.parse_args(argv)
+
+    embed_model = None
+    if args.stub_embed_ms is not None:
+        from benchmarks.stub_embedder import StubEmbedder
+
+        embed_model = StubEmbedder(call_ms=args.stub_embed_ms)
+
+    service = load_service(
+        args.model,
+        embed_device=args.embed_device,
+        embed_backend=args.embed_backend,
+        embed_model=embed_model,
+        vote_k=args.vote_k,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    service.warmup()
+    # 每个批次的 embedding 日志太多，只保留警告
+    logging.getLogger().setLevel(logging.WARNING)
+
+    server = make_server(service, args.host, args.port)
+    print(f"serving {service.stats['n_docs']} conversations on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
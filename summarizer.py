@@ -0,0 +1,309 @@
+"""
+Description: 并发的聚类摘要生成，基于 AsyncOpenAI，带并发上限、速率限制、超时和指数退避重试
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+import openai
+from openai import AsyncOpenAI
+
+SYSTEM_PROMPT = "You are a helpful assistant that summarizes text clusters."
+
+# 这些错误通常是暂时性的，值得重试；其余 4xx 错误直接放弃
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    """按分钟计的请求数/token数令牌桶，None 表示不限制"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60,
+            )
+
+    async def acquire(self, tokens=0):
+        async with self._lock:
+            # 单个请求超过桶容量时按容量计，避免永远等不到
+            if self.tokens_per_minute:
+                tokens = min(tokens, self.tokens_per_minute)
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.requests_per_minute and self._requests < 1:
+                    wait = (1 - self._requests) * 60 / self.requests_per_minute
+                if self.tokens_per_minute and self._tokens < tokens:
+                    wait = max(
+                        wait, (tokens - self._tokens) * 60 / self.tokens_per_minute
+                    )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+
+
+class ClusterSummarizer:
+    def __init__(
+        self,
+        model,
+        base_url=None,
+        api_key=None,
+        concurrency=8,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries=3,
+        timeout=60,
+        backoff_base=1.0,
+        backoff_max=30.0,
+        temperature=0.7,
+        max_tokens=128,
+    ):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    def summarize(self, prompts, on_result=None):
+        """prompts: {label: user prompt}，返回 {label: 摘要}，失败的 label 为 None
+
+        on_result(label, summary) 在每个请求完成时调用，便于及时写入缓存
+        """
+        coroutine = self.asummarize(prompts, on_result=on_result)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # 已经处在事件循环中（例如 notebook），放到独立线程里运行
+        result = {}
+
+        def runner():
+            result.update(asyncio.run(coroutine))
+
+        thread = threading.Thread(target=runner)
+        thread.start()
+        thread.join()
+        return result
+
+    async def asummarize(self, prompts, on_result=None):
+        client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=self.timeout,
+            max_retries=0,  # 重试由这里统一处理
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+
+        async def run(label, prompt):
+            async with semaphore:
+                summary = await self._request(client, limiter, label, prompt)
+            if on_result is not None:
+                on_result(label, summary)
+            return label, summary
+
+        try:
+            results = await asyncio.gather(
+                *(run(label, prompt) for label, prompt in prompts.items())
+            )
+        finally:
+            await client.close()
+        return dict(results)
+
+    async def _request(self, client, limiter, label, prompt):
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+        # 粗略估算token数用于限速：约4个字符一个token，再加上输出上限
+        estimated_tokens = (len(SYSTEM_PROMPT) + len(prompt)) // 4 + self.max_tokens
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire(estimated_tokens)
+            try:
+                response = await asyncio.wait_for(
+                    client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        max_tokens=self.max_tokens,
+                    ),
+                    timeout=self.timeout,
+                )
+                return response.choices[0].message.content
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    logging.error(f"Error summarizing cluster {label}: {str(e)}")
+                    return None
+                delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logging.warning(
+                    f"Retrying cluster {label} in {delay:.1f}s ({type(e).__name__})"
+                )
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logging.error(f"Error summarizing cluster {label}: {str(e)}")
+                return None
+
+
+class SummaryCache:
+    """聚类摘要的磁盘缓存
+
+    精确命中：key 由 (模型, 指令, 示例文本哈希) 决定，提示词完全一致时直接复用。
+    近似命中：同一模型和指令下，与某个已摘要簇的成员 Jaccard 重合度
+    不低于 reuse_threshold 时复用它的摘要。
+
+    每个条目只保存成员哈希中最小的 max_members 个（bottom-k 草图），重合度由草图估计，
+    成员不超过 max_members 时是精确值。条目超过 max_entries 时，保存前淘汰最久未用的条目。
+    """
+
+    def __init__(self, path, reuse_threshold=0.8, max_entries=5000, max_members=256):
+        self.path = path
+        self.reuse_threshold = reuse_threshold
+        self.max_entries = max_entries
+        self.max_members = max_members
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+        # 成员哈希 -> 包含该成员的缓存条目，用于快速计算重合度
+        self._member_index = defaultdict(set)
+        for key, entry in self.entries.items():
+            entry["members"] = self._sketch(entry["members"])
+            for member in entry["members"]:
+                self._member_index[member].add(key)
+        # 每次运行的代数，命中或写入时记在条目的 used 上，用于淘汰最久未用的条目
+        self._generation = max((e.get("used", 0) for e in self.entries.values()), default=0) + 1
+        self._dirty = False
+
+    @staticmethod
+    def scope(model, instruction):
+        return hashlib.blake2b(
+            f"{model}\0{instruction}".encode("utf-8"), digest_size=8
+        ).hexdigest()
+
+    @staticmethod
+    def make_key(scope, example_hashes):
+        payload = "\0".join([scope, *example_hashes])
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _sketch(self, members):
+        return sorted(set(members))[: self.max_members]
+
+    def _similarity(self, a, b):
+        """两个 bottom-k 草图估计的 Jaccard 重合度"""
+        both = set(a) & set(b)
+        union = sorted(set(a) | set(b))[: self.max_members]
+        return sum(member in both for member in union) / len(union)
+
+    def _touch(self, key):
+        if self.entries[key].get("used") != self._generation:
+            self.entries[key]["used"] = self._generation
+            self._dirty = True
+
+    def get(self, key, scope, members):
+        """返回可复用的摘要，没有则返回 None"""
+        if key in self.entries:
+            self._touch(key)
+            return self.entries[key]["summary"]
+
+        sketch = self._sketch(members)
+        candidates = set()
+        for member in sketch:
+            candidates.update(self._member_index.get(member, ()))
+
+        best_key, best_score = None, 0.0
+        for entry_key in candidates:
+            entry = self.entries[entry_key]
+            if entry["scope"] != scope:
+                continue
+            score = self._similarity(sketch, entry["members"])
+            if score > best_score:
+                best_key, best_score = entry_key, score
+        if best_key is not None and best_score >= self.reuse_threshold:
+            self._touch(best_key)
+            return self.entries[best_key]["summary"]
+        return None
+
+    def put(self, key, scope, members, summary):
+        self._remove(key)
+        self.entries[key] = {
+            "scope": scope,
+            "summary": summary,
+            "members": self._sketch(members),
+            "used": self._generation,
+        }
+        for member in self.entries[key]["members"]:
+            self._member_index[member].add(key)
+        self._dirty = True
+
+    def _remove(self, key):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            for member in old["members"]:
+                self._member_index[member].discard(key)
+
+    def prune(self):
+        """只保留最近使用的 max_entries 个条目"""
+        if len(self.entries) <= self.max_entries:
+            return
+        order = sorted(self.entries, key=lambda key: self.entries[key].get("used", 0))
+        for key in order[: len(self.entries) - self.max_entries]:
+            self._remove(key)
+        self._dirty = True
+
+    def save(self):
+        self.prune()
+        if not self._dirty:
+            return
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
@@ -9,7 +9,7 @@ from collections import defaultdict
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import DBSCAN
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.neighbors import NearestNeighbors
 
 def fast_topic_clustering(texts, eps=0.3, min_samples=2):
     """
@@ -33,20 +33,20 @@ def fast_topic_clustering(texts, eps=0.3, min_samples=2):
     )
     tfidf_matrix = vectorizer.fit_transform(processed_texts)
     
-    # 3. 计算余弦相似度矩阵
-    similarity_matrix = cosine_similarity(tfidf_matrix)
+    # 3. 只计算eps邻域内的余弦距离，得到稀疏距离图（不构建N×N的稠密矩阵）
+    distance_graph = NearestNeighbors(
+        radius=eps,
+        metric='cosine',
+    ).fit(tfidf_matrix).radius_neighbors_graph(tfidf_matrix, mode='distance')
     
-    # 4. 将相似度转换为距离，确保没有负值
-    distance_matrix = np.clip(1 - similarity_matrix, 0, 2)  # 限制在[0,2]范围内
-    
-    # 5. 使用DBSCAN进行聚类
+    # 4. 使用DBSCAN在稀疏距离图上聚类
     clustering = DBSCAN(
         eps=eps,
         min_samples=min_samples,
         metric='precomputed'
-    ).fit(distance_matrix)
+    ).fit(distance_graph)
     
-    # 6. 统计主题
+    # 5. 统计主题
     labels = clustering.labels_
     print(f"Cluster labels: {labels}")  # Debug print
     topics = defaultdict(int)
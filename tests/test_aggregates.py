@@ -0,0 +1,66 @@
+import json
+
+import pandas as pd
+
+from aggregates import (
+    cluster_sizes,
+    daily_rollup,
+    hourly_rollup,
+    write_activity_aggregates,
+    write_cluster_aggregates,
+)
+
+
+def make_df():
+    return pd.DataFrame(
+        {
+            "uuid": ["a", "b", "c"],
+            "name": ["first", "second", "third"],
+            "start_time": pd.to_datetime(
+                ["2024-03-01T23:30:00Z", "2024-03-02T01:00:00Z", "2024-03-02T10:00:00Z"], utc=True
+            ),
+            "duration": [60.0, 120.0, 30.0],
+            "dialogue_turns": [2, 3, 1],
+            "input_tokens": [10, 20, 30],
+            "output_tokens": [1, 2, 3],
+        }
+    )
+
+
+def test_rollups_respect_timezone():
+    df = make_df()
+    utc = daily_rollup(df)
+    assert utc["day"].tolist() == ["2024-03-01", "2024-03-02"]
+    assert utc["conversations"].tolist() == [1, 2]
+
+    shanghai = daily_rollup(df, tz="Asia/Shanghai")
+    assert shanghai["day"].tolist() == ["2024-03-02"]
+    assert shanghai["total_tokens"].tolist() == [66]
+
+    hourly = hourly_rollup(df)
+    assert len(hourly) == 24
+    assert hourly.loc[23, "conversations"] == 1
+
+
+def test_write_aggregates(tmp_path):
+    write_activity_aggregates(tmp_path, make_df(), top_n=2)
+    write_cluster_aggregates(
+        tmp_path, {-1: "None", 0: {"cluster": "x", "nums": 2}, 1: {"cluster": "y", "nums": 5}}
+    )
+
+    api = tmp_path / "api"
+    assert json.loads((api / "token_stats.json").read_text()) == {
+        "input_tokens": 60,
+        "output_tokens": 6,
+        "total_tokens": 66,
+    }
+    daily = json.loads((api / "daily_activity.json").read_text())
+    assert (daily["from"], daily["to"]) == ("2024-03-01", "2024-03-02")
+    top = json.loads((api / "top_conversations.json").read_text())
+    assert [row["uuid"] for row in top] == ["c", "b"]
+    assert [row["topic"] for row in json.loads((api / "clusters.json").read_text())] == ["y", "x"]
+    assert pd.read_parquet(tmp_path / "daily.parquet")["conversations"].sum() == 3
+
+
+def test_cluster_sizes_skips_noise():
+    assert cluster_sizes({"-1": "None", "3": {"cluster": "t", "nums": 4}})["label"].tolist() == [3]
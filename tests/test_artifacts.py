@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from artifacts import (
+    FORMAT_VERSION,
+    TextStore,
+    load_array,
+    read_meta,
+    save_array,
+    write_meta,
+    write_texts,
+)
+
+
+def test_text_store_roundtrip(tmp_path):
+    texts = ["hello", "", "你好，世界", "emoji 🙂", "last"]
+    write_texts(str(tmp_path), texts)
+    store = TextStore(str(tmp_path))
+
+    assert len(store) == len(texts)
+    assert list(store) == texts
+    assert store[2] == "你好，世界"
+    assert store[-1] == "last"
+    assert store[1:3] == texts[1:3]
+    assert store[np.int64(3)] == texts[3]
+    with pytest.raises(IndexError):
+        store[len(texts)]
+
+
+def test_text_store_empty(tmp_path):
+    write_texts(str(tmp_path), [])
+    assert list(TextStore(str(tmp_path))) == []
+
+
+def test_meta_version_check(tmp_path):
+    assert read_meta(str(tmp_path)) is None
+    write_meta(str(tmp_path), n_docs=3)
+    assert read_meta(str(tmp_path)) == {"format_version": FORMAT_VERSION, "n_docs": 3}
+
+    write_meta(str(tmp_path))
+    (tmp_path / "meta.json").write_text('{"format_version": 99}')
+    with pytest.raises(ValueError):
+        read_meta(str(tmp_path))
+
+
+def test_save_over_loaded_folder_roundtrip(tmp_path):
+    folder = str(tmp_path)
+    embeddings = np.random.default_rng(0).normal(size=(300, 4)).astype(np.float32)
+    texts = [f"conversation {i} " * (i % 7) for i in range(300)]
+    save_array(folder, "embeddings", embeddings)
+    write_texts(folder, texts)
+
+    # 加载（只读映射）后原地保存两次，文件不能被截断
+    for _ in range(2):
+        loaded, store = load_array(folder, "embeddings"), TextStore(folder)
+        save_array(folder, "embeddings", loaded)
+        write_texts(folder, store)
+        assert np.array_equal(load_array(folder, "embeddings"), embeddings)
+        assert list(TextStore(folder)) == texts
+    assert not list(tmp_path.glob("*.tmp"))
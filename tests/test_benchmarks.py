@@ -0,0 +1,42 @@
+import numpy as np
+import tiktoken
+
+from benchmarks.run_benchmark import scaling_exponents
+from benchmarks.stub_embedder import StubEmbedder
+from benchmarks.synthetic_data import write_conversations
+from chat_analyzer import ChatAnalyzer
+from token_counter import TokenCounter
+
+BYTE_ENCODING = tiktoken.Encoding(
+    "bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+def test_synthetic_export_is_readable(tmp_path):
+    path = write_conversations(tmp_path / "conversations.json", 50, seed=1)
+    analyzer = ChatAnalyzer.from_file(str(path), TokenCounter(encoding=BYTE_ENCODING))
+    assert len(analyzer.df) == 50
+    assert (analyzer.df["input_tokens"] > 0).all()
+    assert (analyzer.df["duration"] >= 0).all()
+
+
+def test_scaling_exponents():
+    results = [
+        {"n_conversations": 100, "stages": {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}}},
+        {"n_conversations": 200, "stages": {"a": {"seconds": 2.0}, "b": {"seconds": 4.0}}},
+    ]
+    (row,) = scaling_exponents(results)
+    assert abs(row["exponents"]["a"] - 1) < 1e-9
+    assert abs(row["exponents"]["b"] - 2) < 1e-9
+
+
+def test_stub_embedder_is_deterministic():
+    model = StubEmbedder(call_ms=0, per_text_ms=0, dim=8)
+    first = model.encode(["a", "b", "a"], normalize_embeddings=True)
+    assert first.shape == (3, 8)
+    np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1, rtol=1e-6)
+    np.testing.assert_array_equal(first[0], first[2])
+    np.testing.assert_array_equal(model.encode(["b"], normalize_embeddings=True)[0], first[1])
@@ -0,0 +1,89 @@
+import random
+
+import pandas as pd
+import tiktoken
+
+from chat_analyzer import ChatAnalyzer
+from token_counter import TokenCounter
+
+BYTE_ENCODING = tiktoken.Encoding(
+    "bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+def _timestamp(rng, day):
+    fraction = "" if rng.random() < 0.2 else f".{rng.randrange(10**6):06d}"
+    return f"2024-03-{day:02d}T{rng.randrange(24):02d}:{rng.randrange(2):02d}:00{fraction}Z"
+
+
+def _make_chats(n=200, seed=0):
+    rng = random.Random(seed)
+    chats = []
+    for i in range(n):
+        day = rng.randrange(1, 28)
+        messages = []
+        for j in range(rng.randrange(0, 7)):
+            msg = {
+                "sender": rng.choice(["human", "assistant", "human", "assistant", "system"]),
+                "created_at": _timestamp(rng, day),
+                "text": f"message {i}-{j} " * rng.randrange(1, 5),
+            }
+            if rng.random() < 0.05:
+                del msg["text"]
+            messages.append(msg)
+        chats.append(
+            {
+                "uuid": f"uuid-{i}",
+                "name": f"chat {i}",
+                "created_at": _timestamp(rng, day),
+                "updated_at": _timestamp(rng, day),
+                "chat_messages": messages,
+            }
+        )
+    return chats
+
+
+def test_columnar_matches_records():
+    chats = _make_chats()
+    expected = ChatAnalyzer(chats, TokenCounter(encoding=BYTE_ENCODING)).df
+    analyzer = ChatAnalyzer(chats, TokenCounter(encoding=BYTE_ENCODING), columnar=True)
+
+    pd.testing.assert_frame_equal(analyzer.df, expected)
+    assert len(analyzer.messages) == sum(len(c["chat_messages"]) for c in chats)
+
+
+def test_message_activity_splits_conversation_tokens():
+    chats = _make_chats()
+    analyzer = ChatAnalyzer(chats, TokenCounter(encoding=BYTE_ENCODING))
+    columnar = ChatAnalyzer(chats, TokenCounter(encoding=BYTE_ENCODING), columnar=True)
+    pd.testing.assert_frame_equal(columnar.activity, analyzer.activity)
+
+    # 分到消息上的 token 都是整数，按对话求和与对话级的统计一致
+    activity = analyzer.activity
+    assert (activity[["input_tokens", "output_tokens"]] % 1 == 0).all().all()
+    totals = activity.groupby("uuid")[["input_tokens", "output_tokens"]].sum()
+    df = analyzer.df.set_index("uuid")
+    has_messages = df.index.isin(totals.index)
+    assert (df.loc[~has_messages, ["input_tokens", "output_tokens"]] == 0).all().all()
+    pd.testing.assert_frame_equal(
+        totals.reindex(df.index[has_messages]),
+        df.loc[has_messages, ["input_tokens", "output_tokens"]].astype("float64"),
+    )
+
+
+def test_invalid_message_timestamps_are_skipped():
+    chats = _make_chats(50, seed=1)
+    chats[0]["chat_messages"].append({"sender": "human", "created_at": "not a date", "text": "lost"})
+    chats[1]["chat_messages"].append({"sender": "assistant", "text": "no time"})
+    chats[2]["chat_messages"].append(
+        {"sender": "human", "created_at": "2024-03-05T10:00:00", "text": "naive time"}
+    )
+    expected = ChatAnalyzer(chats, TokenCounter(encoding=BYTE_ENCODING))
+    analyzer = ChatAnalyzer(chats, TokenCounter(encoding=BYTE_ENCODING), columnar=True)
+
+    pd.testing.assert_frame_equal(analyzer.df, expected.df)
+    pd.testing.assert_frame_equal(analyzer.activity, expected.activity)
+    assert len(analyzer.messages) == sum(len(c["chat_messages"]) for c in chats) - 2
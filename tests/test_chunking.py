@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from chunking import encode_length_sorted, pool_chunks, split_windows
+
+
+def char_offsets(text):
+    return [(i, i + 1) for i in range(len(text))]
+
+
+def test_split_windows_with_overlap():
+    texts = ["abcdefghij", "", "xy"]
+    chunks, lengths, offsets = split_windows(
+        texts, [char_offsets(t) for t in texts], window=4, stride=3
+    )
+    assert chunks == ["abcd", "defg", "ghij", "", "xy"]
+    assert lengths.tolist() == [4, 4, 4, 0, 2]
+    assert offsets.tolist() == [0, 3, 4, 5]
+
+
+def test_split_windows_max_chunks():
+    chunks, _, offsets = split_windows(
+        ["abcdefghij"], [char_offsets("abcdefghij")], window=2, stride=2, max_chunks=2
+    )
+    assert chunks == ["ab", "cd"]
+    assert offsets.tolist() == [0, 2]
+
+
+def test_encode_length_sorted_restores_order():
+    seen = []
+
+    def encode(chunks):
+        seen.extend(chunks)
+        return np.array([[len(c)] for c in chunks], dtype=np.float32)
+
+    chunks = ["a", "abc", "ab"]
+    out = encode_length_sorted(chunks, np.array([1, 3, 2]), encode)
+    assert seen == ["abc", "ab", "a"]
+    assert out[:, 0].tolist() == [1, 3, 2]
+
+
+@pytest.mark.parametrize("strategy", ["mean", "max", "first_k"])
+def test_pool_chunks(strategy):
+    chunk_embeddings = np.array([[1, 0], [0, 1], [3, 4]], dtype=np.float32)
+    pooled = pool_chunks(chunk_embeddings, np.array([0, 2, 3]), strategy)
+    assert np.allclose(np.linalg.norm(pooled, axis=1), 1)
+    assert np.allclose(pooled[0], [np.sqrt(0.5), np.sqrt(0.5)])
+    assert np.allclose(pooled[1], [0.6, 0.8])
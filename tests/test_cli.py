@@ -0,0 +1,94 @@
+import json
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+from benchmarks.synthetic_data import write_conversations
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = [
+    "faiss",
+    "matplotlib",
+    "numba",
+    "openai",
+    "plotly",
+    "sentence_transformers",
+    "sklearn",
+    "torch",
+    "umap",
+]
+
+# 在独立进程里运行，避免被其他测试已经导入的模块干扰
+STATS_SCRIPT = textwrap.dedent(
+    """
+    import json, sys, time
+
+    start = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - start
+
+    import tiktoken
+    from token_counter import TokenCounter
+
+    encoding = tiktoken.Encoding(
+        "bytes",
+        pat_str=r"\\S+|\\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+    main.main(
+        ["stats", "--data", sys.argv[1], "--out", sys.argv[2], "--checkpoint-dir", sys.argv[3]],
+        token_counter=TokenCounter(encoding=encoding),
+    )
+    print(json.dumps({"import_seconds": import_seconds, "modules": sorted(sys.modules)}))
+    """
+)
+
+
+def test_stats_command_skips_heavy_imports(tmp_path):
+    data = write_conversations(tmp_path / "conversations.json", 50)
+    out = subprocess.run(
+        [sys.executable, "-c", STATS_SCRIPT, str(data), str(tmp_path / "out"), str(tmp_path / "cache")],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    report = json.loads(out.stdout.strip().splitlines()[-1])
+    loaded = {name.split(".")[0] for name in report["modules"]}
+
+    assert loaded.isdisjoint(HEAVY_MODULES)
+    assert len(report["modules"]) < 1000
+    assert report["import_seconds"] < 2
+    assert (tmp_path / "out" / "duration_stats.json").exists()
+    assert (tmp_path / "out" / "time_patterns.json").exists()
+    # 时间序列汇总写在断点目录下，不会落到仓库里
+    assert (tmp_path / "cache" / "time_series" / "meta.json").exists()
+    assert not (ROOT / "cache").exists()
+
+
+def test_default_token_counter_caches_under_checkpoint_dir(tmp_path, monkeypatch):
+    import tiktoken
+
+    import main
+    from token_counter import TokenCounter
+
+    encoding = tiktoken.Encoding(
+        "bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
+
+    class ByteTokenCounter(TokenCounter):
+        def __init__(self, **kwargs):
+            super().__init__(encoding=encoding, **kwargs)
+
+    monkeypatch.setattr(main, "TokenCounter", ByteTokenCounter)
+    data = write_conversations(tmp_path / "conversations.json", 20)
+    args = ["--data", str(data), "--out", str(tmp_path / "out"), "--checkpoint-dir", str(tmp_path / "cache")]
+    main.main(["stats", *args])
+
+    cache = json.loads((tmp_path / "cache" / "token_counts.json").read_text())
+    assert cache["encoding"] == "bytes" and cache["counts"]
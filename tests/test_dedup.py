@@ -0,0 +1,59 @@
+import faiss
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+from dedup import Duplicates, exact_duplicates, near_duplicates
+from graph_clustering import graph_dbscan, knn_radius_graph
+
+
+def test_exact_duplicates_ignore_whitespace():
+    texts = ["hello world", "other", "hello  world\n", "other", "third"]
+    duplicates = exact_duplicates(texts)
+    assert duplicates.inverse.tolist() == [0, 1, 0, 1, 2]
+    assert duplicates.representatives.tolist() == [0, 1, 4]
+    assert duplicates.weights.tolist() == [2, 2, 1]
+    assert duplicates.expand(["a", "b", "c"]).tolist() == ["a", "b", "a", "b", "c"]
+    assert duplicates.extend(2).inverse.tolist() == [0, 1, 0, 1, 2, 3, 4]
+
+
+def test_near_duplicates_merge_close_embeddings_and_many_exact_copies():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(50, 16)).astype(np.float32)
+    # 第 0 条有 40 份完全重复，超过检索的 k
+    x = np.vstack([base, np.repeat(base[:1], 40, axis=0), base[:5] + 1e-3])
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(16)
+    index.add(x)
+    texts = [f"text {i}" for i in range(50)] + ["text 0"] * 40 + [f"retry {i}" for i in range(5)]
+
+    duplicates = near_duplicates(index, x, eps=0.01, k=8, exact=exact_duplicates(texts))
+    assert duplicates.n_groups == 50
+    assert np.array_equal(duplicates.representatives, np.arange(50))
+    assert duplicates.weights[0] == 42
+    assert np.array_equal(duplicates.inverse[90:], np.arange(5))
+
+
+def test_weighted_representatives_match_dbscan_on_all_points():
+    rng = np.random.default_rng(1)
+    points = rng.normal(size=(300, 2)).astype(np.float32)
+    copies = rng.integers(0, 300, 600)
+    x = np.vstack([points, points[copies]])
+    duplicates = Duplicates.from_groups(np.concatenate([np.arange(300), copies]))
+
+    expected = DBSCAN(eps=0.3, min_samples=6).fit(x).labels_
+    labels = DBSCAN(eps=0.3, min_samples=6).fit(
+        x[duplicates.representatives], sample_weight=duplicates.weights
+    ).labels_
+    assert np.array_equal(duplicates.expand(labels), expected)
+
+
+def test_collapsed_graph_keeps_weighted_core_points():
+    x = np.array([[1, 0], [1, 0], [1, 0], [0.999, 0.04], [0, 1]], dtype=np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(2)
+    index.add(x)
+    duplicates = Duplicates([0, 0, 0, 1, 2])
+    graph = duplicates.collapse_graph(knn_radius_graph(index, x, k=5, eps=0.01))
+    assert graph.shape == (3, 3)
+    labels = graph_dbscan(graph, min_samples=4, sample_weight=duplicates.weights)
+    assert labels.tolist() == [0, 0, -1]
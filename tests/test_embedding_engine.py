@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_engine import THREAD_ENV_VARS, EmbeddingEngine, auto_batch_size, load_model
+
+
+class FakeModel:
+    max_seq_length = 128
+
+    def __init__(self):
+        self.pools = []
+
+    def encode(self, texts, batch_size, **kwargs):
+        vectors = np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    # 多进程接口只记录池的启动和停止，在当前进程编码
+    def start_multi_process_pool(self, devices):
+        pool = {
+            "devices": devices,
+            "stopped": False,
+            "threads": {name: os.environ.get(name) for name in THREAD_ENV_VARS},
+        }
+        self.pools.append(pool)
+        return pool
+
+    def encode_multi_process(self, texts, pool, batch_size, chunk_size=None):
+        assert not pool["stopped"]
+        return self.encode(texts, batch_size) * 2
+
+    def stop_multi_process_pool(self, pool):
+        pool["stopped"] = True
+
+
+def test_auto_batch_size_scales_with_budget():
+    model = FakeModel()
+    small = auto_batch_size(model, 256, memory_budget_mb=64)
+    large = auto_batch_size(model, 256, memory_budget_mb=1024)
+    assert small < large
+    assert large & (large - 1) == 0
+    # 多进程时预算按进程平分
+    assert auto_batch_size(model, 256, 1024, num_workers=4) == large // 4
+    assert auto_batch_size(model, 8192, memory_budget_mb=1) == 1
+
+
+def test_engine_records_throughput():
+    engine = EmbeddingEngine(FakeModel(), batch_size=None, memory_budget_mb=256)
+    embeddings = engine.encode(["a", "bb", "ccc"], show_progress_bar=False)
+    assert embeddings.shape == (3, 2)
+    assert engine.stats["texts"] == 3
+    assert engine.stats["texts_per_sec"] > 0
+
+
+def test_multi_process_pool_is_reused_until_close(monkeypatch):
+    for name in THREAD_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+    model = FakeModel()
+    with EmbeddingEngine(model, batch_size=2, num_workers=2) as engine:
+        for _ in range(3):
+            embeddings = engine.encode(["a", "bb", "ccc", "dddd"], show_progress_bar=False)
+            np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, rtol=1e-6)
+        assert len(model.pools) == 1 and not model.pools[0]["stopped"]
+        # 只有子进程限制线程数，主进程的环境不变
+        assert all(model.pools[0]["threads"].values())
+        assert not any(os.environ.get(name) for name in THREAD_ENV_VARS)
+        # 文本少时在当前进程编码，不影响进程池
+        engine.encode(["a"], show_progress_bar=False)
+    assert model.pools[0]["stopped"]
+
+    engine.encode(["a", "bb", "ccc", "dddd"], show_progress_bar=False)
+    assert len(model.pools) == 2
+    engine.close()
+    assert model.pools[1]["stopped"]
+
+
+TEXTS = ["how to debug a memory leak", "python asyncio tutorial", "best pasta recipe"]
+
+
+def _reference():
+    pytest.importorskip("sentence_transformers")
+    return EmbeddingEngine(load_model("all-MiniLM-L6-v2"), batch_size=8).encode(
+        TEXTS, show_progress_bar=False
+    )
+
+
+def test_int8_backend_matches_torch():
+    reference = _reference()
+    model = load_model("all-MiniLM-L6-v2", backend="int8")
+    embeddings = EmbeddingEngine(model, batch_size=8).encode(TEXTS, show_progress_bar=False)
+    assert embeddings.shape == reference.shape
+    assert (np.sum(embeddings * reference, axis=1) > 0.95).all()
+
+
+def test_onnx_backend_matches_torch():
+    reference = _reference()
+    pytest.importorskip("optimum.onnxruntime")
+    model = load_model("all-MiniLM-L6-v2", backend="onnx")
+    embeddings = EmbeddingEngine(model, batch_size=8).encode(TEXTS, show_progress_bar=False)
+    assert (np.sum(embeddings * reference, axis=1) > 0.99).all()
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+
+def fake_encode(calls):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.stack([np.full(4, len(t), dtype=np.float32) for t in texts])
+
+    return encode
+
+
+def test_get_or_compute_only_encodes_misses(tmp_path):
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "all-MiniLM-L6-v2", 512)
+    first = store.get_or_compute(["a", "bb", "a"], fake_encode(calls))
+    assert calls == [["a", "bb"]]
+    assert first[:, 0].tolist() == [1, 2, 1]
+
+    # 重新打开：已缓存的文本不再编码，向量通过 memmap 读取
+    store = EmbeddingStore(str(tmp_path), "all-MiniLM-L6-v2", 512)
+    assert isinstance(store.vectors, np.memmap)
+    second = store.get_or_compute(["bb", "ccc", "a"], fake_encode(calls))
+    assert calls[-1] == ["ccc"]
+    assert second[:, 0].tolist() == [2, 3, 1]
+    assert len(store) == 3
+
+
+def test_namespaces_are_separate(tmp_path):
+    calls = []
+    EmbeddingStore(str(tmp_path), "model", 512).get_or_compute(["a"], fake_encode(calls))
+    EmbeddingStore(str(tmp_path), "model", 256).get_or_compute(["a"], fake_encode(calls))
+    assert len(calls) == 2
+
+
+def test_ignores_vectors_without_keys(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model", 512)
+    store.get_or_compute(["a", "bb"], fake_encode([]))
+    # 模拟写完向量、还没写key时中断
+    with open(store.vectors_path, "ab") as f:
+        f.write(np.ones(4, dtype=np.float32).tobytes())
+
+    store = EmbeddingStore(str(tmp_path), "model", 512)
+    assert len(store) == 2
+    out = store.get_or_compute(["ccc"], fake_encode([]))
+    assert out[:, 0].tolist() == [3]
+
+
+def test_recovers_from_interrupted_first_write(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model", 512)
+    store.get_or_compute(["a", "bb"], fake_encode([]))
+    # 模拟旧版本先写 meta、还没写数据文件时中断
+    os.remove(store.keys_path)
+    os.remove(store.vectors_path)
+    store = EmbeddingStore(str(tmp_path), "model", 512)
+    assert len(store) == 0
+
+    # 只写了向量和 key、还没写 meta 时中断：视为空缓存，重新写入
+    os.remove(store.meta_path)
+    store = EmbeddingStore(str(tmp_path), "model", 512)
+    calls = []
+    out = store.get_or_compute(["ccc", "a"], fake_encode(calls))
+    assert calls == [["a", "ccc"]]
+    assert out[:, 0].tolist() == [3, 1]
+    assert len(EmbeddingStore(str(tmp_path), "model", 512)) == 2
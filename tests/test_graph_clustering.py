@@ -0,0 +1,51 @@
+import faiss
+import numpy as np
+from sklearn.cluster import DBSCAN
+from sklearn.datasets import make_blobs
+from sklearn.metrics import adjusted_rand_score
+
+from graph_clustering import dbscan_sweep, graph_dbscan, knn_radius_graph
+
+
+def test_graph_dbscan_matches_sklearn_on_cosine_distances():
+    x, _ = make_blobs(1500, n_features=8, centers=5, cluster_std=0.3, random_state=0)
+    x = (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+    index = faiss.IndexFlatIP(x.shape[1])
+    index.add(x)
+
+    eps, min_samples = 0.02, 5
+    expected = DBSCAN(eps=eps, min_samples=min_samples, metric="cosine").fit(x).labels_
+    labels = graph_dbscan(knn_radius_graph(index, x, k=len(x), eps=eps), min_samples)
+
+    assert np.array_equal(labels == -1, expected == -1)
+    assert adjusted_rand_score(expected, labels) > 0.99
+
+
+def test_graph_dbscan_keeps_exact_duplicates_connected():
+    x = np.tile(np.eye(4, dtype=np.float32), (3, 1))
+    index = faiss.IndexFlatIP(4)
+    index.add(x)
+    labels = graph_dbscan(knn_radius_graph(index, x, k=5, eps=0.01), min_samples=3)
+    assert len(set(labels.tolist())) == 4
+    assert labels[0] == labels[4] == labels[8]
+
+
+def test_dbscan_sweep_matches_sklearn_for_each_setting():
+    x, _ = make_blobs(2000, n_features=2, centers=6, cluster_std=0.6, random_state=0)
+    weights = np.random.default_rng(0).integers(1, 4, len(x))
+    results = dbscan_sweep(x, [0.4, 0.1, 0.2], [5, 20], sample_weight=weights, n_jobs=2)
+
+    assert [(r["eps"], r["min_samples"]) for r in results] == [
+        (eps, m) for eps in (0.1, 0.2, 0.4) for m in (5, 20)
+    ]
+    for r in results:
+        expected = DBSCAN(eps=r["eps"], min_samples=r["min_samples"]).fit(x, sample_weight=weights)
+        labels = expected.labels_
+        assert r["n_clusters"] == labels.max() + 1
+        assert np.isclose(r["noise_fraction"], weights[labels == -1].sum() / weights.sum())
+    assert "silhouette" not in results[0]
+
+    # silhouette 只在指定抽样数时计算
+    scored = dbscan_sweep(x, [0.1, 0.4], [5], sample_weight=weights, silhouette_sample=500)
+    assert [r["n_clusters"] for r in scored] == [results[0]["n_clusters"], results[-2]["n_clusters"]]
+    assert scored[-1]["silhouette"] > 0.5
@@ -0,0 +1,31 @@
+import numpy as np
+
+from membership import ClusterMembership
+
+
+def test_membership_matches_python_bookkeeping():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(-1, 6, size=1000)
+    points = rng.normal(size=(1000, 3))
+
+    membership = ClusterMembership.from_labels(labels, points)
+    label2docs = membership.label2docs()
+
+    for label in set(labels.tolist()):
+        docs = [i for i, value in enumerate(labels) if value == label]
+        assert label2docs[label].tolist() == docs
+        assert membership.docs(label).tolist() == docs
+        assert np.allclose(membership.center_map()[label], points[docs].mean(axis=0))
+    assert membership.docs(42).tolist() == []
+    assert membership.sizes.sum() == len(labels)
+
+
+def test_membership_save_load(tmp_path):
+    labels = np.array([2, 0, 2, -1, 0])
+    membership = ClusterMembership.from_labels(labels, np.arange(10.0).reshape(5, 2))
+    membership.save(str(tmp_path))
+
+    loaded = ClusterMembership.load(str(tmp_path))
+    assert loaded.label2docs().keys() == membership.label2docs().keys()
+    assert loaded.docs(2).tolist() == [0, 2]
+    assert np.allclose(loaded.centers, membership.centers)
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from pipeline import Incomplete, Pipeline
+
+
+def build(tmp_path, calls, scale=2, fail=None):
+    pipeline = Pipeline(str(tmp_path))
+
+    @pipeline.stage("source", checkpoint=False)
+    def source():
+        calls.append("source")
+        return [1, 2, 3]
+
+    @pipeline.stage("double", deps=["source"], params={"scale": scale})
+    def double(xs):
+        calls.append("double")
+        return [x * scale for x in xs]
+
+    @pipeline.stage("total", deps=["double"])
+    def total(xs):
+        calls.append("total")
+        if fail is not None and fail.pop():
+            raise RuntimeError("boom")
+        return sum(xs)
+
+    @pipeline.stage("count", deps=["source"])
+    def count(xs):
+        calls.append("count")
+        return len(xs)
+
+    return pipeline
+
+
+def test_rerun_uses_checkpoints(tmp_path):
+    calls = []
+    assert build(tmp_path, calls).run(["total", "count"]) == {"total": 12, "count": 3}
+    assert sorted(calls) == ["count", "double", "source", "total"]
+
+    calls.clear()
+    assert build(tmp_path, calls).run(["total", "count"]) == {"total": 12, "count": 3}
+    assert calls == []
+
+
+def test_param_change_invalidates_downstream_only(tmp_path):
+    build(tmp_path, []).run(["total", "count"])
+    calls = []
+    assert build(tmp_path, calls, scale=3).run(["total", "count"])["total"] == 18
+    assert sorted(calls) == ["double", "source", "total"]
+
+
+def test_resume_after_failure(tmp_path):
+    calls = []
+    with pytest.raises(RuntimeError):
+        build(tmp_path, calls, fail=[True]).run(["total"])
+    calls.clear()
+    assert build(tmp_path, calls, fail=[False]).run(["total"]) == {"total": 12}
+    assert calls == ["total"]
+
+
+def test_force_reruns_stage_and_descendants(tmp_path):
+    build(tmp_path, []).run(["total", "count"])
+    calls = []
+    build(tmp_path, calls).run(["total", "count"], force=["double"])
+    assert sorted(calls) == ["double", "source", "total"]
+
+
+def test_independent_stages_run_concurrently(tmp_path):
+    pipeline = Pipeline(str(tmp_path), max_workers=2)
+
+    @pipeline.stage("a", checkpoint=False)
+    def a():
+        time.sleep(0.3)
+
+    @pipeline.stage("b", checkpoint=False)
+    def b():
+        time.sleep(0.3)
+
+    start = time.perf_counter()
+    pipeline.run()
+    assert time.perf_counter() - start < 0.5
+
+
+def test_incomplete_result_is_not_checkpointed(tmp_path):
+    def build_partial(calls, complete):
+        pipeline = Pipeline(str(tmp_path))
+
+        @pipeline.stage("summaries")
+        def summaries():
+            calls.append("summaries")
+            result = {0: "topic", 1: "topic" if complete else "Cluster 1"}
+            return result if complete else Incomplete(result, "1 failed")
+
+        @pipeline.stage("report", deps=["summaries"])
+        def report(result):
+            calls.append("report")
+            return sorted(result.values())
+
+        return pipeline
+
+    calls = []
+    assert build_partial(calls, False).run(["report"]) == {"report": ["Cluster 1", "topic"]}
+    # 不完整的结果及其下游都不写断点，重跑时重新执行
+    calls.clear()
+    assert build_partial(calls, True).run(["report"]) == {"report": ["topic", "topic"]}
+    assert calls == ["summaries", "report"]
+    calls.clear()
+    build_partial(calls, True).run(["report"])
+    assert calls == []
+
+
+def test_close_runs_cleanups_once(tmp_path):
+    calls = []
+    pipeline = build(tmp_path, calls)
+    pipeline.on_close(lambda: calls.append("first"))
+    pipeline.on_close(lambda: calls.append("second"))
+    pipeline.run(["total"])
+    calls.clear()
+    # 后注册的先清理，重复 close 不会再次调用
+    pipeline.close()
+    pipeline.close()
+    assert calls == ["second", "first"]
@@ -0,0 +1,49 @@
+import time
+
+from profiling import Profiler, configure, profiled, profiler, stage
+
+
+def test_disabled_profiler_records_nothing():
+    p = Profiler()
+    with p.stage("noop") as s:
+        s.items = 3
+    assert p.records == []
+
+
+def test_stage_records_and_exports():
+    p = Profiler(enabled=True)
+    with p.stage("load", items=10):
+        time.sleep(0.01)
+    with p.stage("load") as s:
+        s.items = 5
+
+    summary = p.summary()["load"]
+    assert summary["calls"] == 2
+    assert summary["items"] == 15
+    assert summary["seconds"] >= 0.01
+    assert summary["peak_rss_bytes"] > 0
+
+    events = p.chrome_trace()["traceEvents"]
+    assert [e["ph"] for e in events] == ["X", "X"]
+    assert events[0]["dur"] >= 10_000
+
+    text = p.prometheus_text()
+    assert '# TYPE claude_analysis_stage_seconds_total counter' in text
+    assert 'claude_analysis_stage_items_total{stage="load"} 15' in text
+
+
+def test_profiled_decorator_with_cprofile(tmp_path):
+    @profiled("hot", items=lambda xs: len(xs))
+    def hot(xs):
+        with stage("inner"):
+            return sum(xs)
+
+    configure(enabled=True, cprofile=True)
+    try:
+        assert hot([1, 2, 3]) == 6
+        profiler.write(tmp_path)
+        assert [r["name"] for r in profiler.records] == ["inner", "hot"]
+        assert profiler.records[1]["items"] == 3
+    finally:
+        configure(enabled=False)
+    assert {p.name for p in tmp_path.iterdir()} == {"trace.json", "metrics.prom", "profile.pstats"}
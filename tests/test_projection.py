@@ -0,0 +1,160 @@
+import faiss
+import numpy as np
+from sklearn.datasets import make_blobs
+
+from projection import (
+    LandmarkProjector,
+    PCAReducer,
+    faiss_knn,
+    projection_quality,
+    stratified_sample,
+)
+
+
+def _blobs(n, n_features=32, centers=6, seed=0):
+    x, y = make_blobs(n, n_features=n_features, centers=centers, cluster_std=1.0, random_state=seed)
+    x = (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+    return x, y
+
+
+def test_pca_reducer_matches_full_svd_on_small_data():
+    x, _ = _blobs(500)
+    reduced = PCAReducer(5, batch_size=64).fit_transform(x)
+    centered = x - x.mean(axis=0)
+    _, _, vt = np.linalg.svd(centered, full_matrices=False)
+    expected = centered @ vt[:5].T
+    # 主成分的符号不唯一
+    assert np.allclose(np.abs(reduced), np.abs(expected), atol=1e-4)
+
+
+def test_stratified_sample_covers_small_strata():
+    big = np.random.default_rng(0).normal(size=(2000, 8)).astype(np.float32)
+    small = np.full((5, 8), 50.0, dtype=np.float32)
+    x = np.vstack([big, small])
+    ids = stratified_sample(x, 100, n_strata=10)
+    assert len(ids) >= 100
+    assert np.all(np.diff(ids) > 0)
+    assert np.any(ids >= len(big))
+
+
+def test_faiss_knn_returns_cosine_distances():
+    x, _ = _blobs(300)
+    index = faiss.IndexFlatIP(x.shape[1])
+    index.add(x)
+    indices, dists = faiss_knn(index, x, 5, batch_size=64)
+    assert np.array_equal(indices[:, 0], np.arange(len(x)))
+    expected = 1.0 - np.sum(x[:, None, :] * x[indices], axis=2)
+    assert np.allclose(dists, np.maximum(expected, 0.0), atol=1e-5)
+
+
+def test_projection_quality_is_perfect_for_identity():
+    x, _ = _blobs(400, n_features=2)
+    report = projection_quality(x, x, k=5, n_samples=200)
+    assert report["neighbour_preservation"] > 0.9
+    assert report["trustworthiness"] > 0.99
+
+
+def test_landmark_projector_transforms_remaining_points():
+    from umap import UMAP
+
+    x, y = _blobs(1200)
+    mapper = UMAP(n_components=2, metric="cosine", n_neighbors=10, random_state=42)
+    projector = LandmarkProjector(mapper, pca_components=8, n_landmarks=300, batch_size=256)
+    projections = projector.fit_transform(x)
+
+    assert projections.shape == (1200, 2)
+    assert len(projector.landmarks_) >= 300
+    assert np.allclose(projections[projector.landmarks_], mapper.embedding_)
+    assert projection_quality(x, projections, k=10, n_samples=300)["trustworthiness"] > 0.8
+    # 同一簇的点投影后仍然聚在一起
+    centers = np.array([projections[y == c].mean(axis=0) for c in range(6)])
+    own = np.linalg.norm(projections - centers[y], axis=1).mean()
+    spread = np.linalg.norm(centers[:, None] - centers[None], axis=2).mean()
+    assert own < spread
+    assert projector.transform(x[:10]).shape == (10, 2)
+
+
+class _UnusedModel:
+    """投影测试只用已有的 embedding，不会调用模型"""
+
+    max_seq_length = 128
+
+
+def _classifier(**kwargs):
+    from text_clustering import ClusterClassifier
+
+    return ClusterClassifier(
+        embed_model=_UnusedModel(), summary_create=False, umap_n_jobs=1, **kwargs
+    )
+
+
+def test_project_reuses_flat_index_and_mapper_transforms(caplog):
+    x, y = _blobs(600)
+    clf = _classifier()
+    clf.faiss_index = faiss.IndexFlatIP(x.shape[1])
+    clf.faiss_index.add(x)
+
+    with caplog.at_level("INFO"):
+        projections, mapper = clf.project(x)
+    assert "reusing faiss index" in caplog.text
+    assert projections.shape == (600, 2)
+
+    # 用预先计算的近邻图拟合后，mapper 仍能投影新的点，且与拟合时的投影落在同一簇附近
+    transformed = mapper.transform(x[:30])
+    assert transformed.shape == (30, 2)
+    centers = np.array([projections[y == c].mean(axis=0) for c in range(6)])
+
+    def nearest_center(points):
+        return np.linalg.norm(points[:, None] - centers[None], axis=2).argmin(axis=1)
+
+    assert (nearest_center(transformed) == nearest_center(projections[:30])).mean() > 0.9
+
+
+def test_evaluate_projection_against_full_fit():
+    x, _ = _blobs(600)
+    clf = _classifier(umap_landmarks=200, umap_pca_components=8)
+    clf.embeddings = x
+    clf.faiss_index = faiss.IndexFlatIP(x.shape[1])
+    clf.faiss_index.add(x)
+    clf.projections, clf.umap_mapper = clf.project(x)
+
+    report = clf.evaluate_projection(k=5, n_samples=200, full_fit=True)
+    assert set(report) == {"landmark", "full", "agreement"}
+    assert report["full"]["trustworthiness"] > 0.8
+    assert report["landmark"]["trustworthiness"] > 0.8
+    assert 0 < report["agreement"] <= 1
+    # 完整拟合只用于对比，不改变当前的设置和投影
+    assert clf.umap_landmarks == 200
+    assert clf.projections.shape == (600, 2)
+
+
+def test_project_applies_pca_without_landmarks():
+    from projection import LandmarkProjector
+
+    x, _ = _blobs(400)
+    clf = _classifier(umap_pca_components=8, umap_landmarks=1000)
+    projections, mapper = clf.project(x)
+    # 点数没有超过 landmark 数也按设置先降维，在全部点上拟合
+    assert isinstance(mapper, LandmarkProjector)
+    assert mapper.pca.components_.shape[0] == 8
+    assert len(mapper.landmarks_) == 400
+    assert projections.shape == (400, 2)
+
+
+def test_landmark_projector_reuses_transform_pool():
+    import pickle
+
+    from umap import UMAP
+
+    x, _ = _blobs(600)
+    mapper = UMAP(n_components=2, metric="cosine", n_neighbors=10, random_state=42)
+    with LandmarkProjector(mapper, n_landmarks=200, batch_size=100, n_jobs=2) as projector:
+        projector.fit_transform(x)
+        pool = projector._pool
+        assert pool is not None
+        expected = np.vstack([mapper.transform(x[:100]), mapper.transform(x[100:200])])
+        assert np.allclose(projector.transform(x[:200]), expected, atol=1e-4)
+        assert projector._pool is pool
+        # 进程池不随 mapper 一起保存
+        assert pickle.loads(pickle.dumps(projector))._pool is None
+    assert projector._pool is None
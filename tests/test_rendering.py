@@ -0,0 +1,97 @@
+import json
+import os
+
+import numpy as np
+
+from rendering import (
+    cluster_histograms,
+    data_extent,
+    export_scatter,
+    hex_to_rgb,
+    label_color,
+    lod_sample,
+    render_density,
+)
+
+
+def _points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(-1, 4, n)
+    centers = np.array([[0, 0], [5, 5], [-5, 5], [5, -5], [-5, -5]], dtype=np.float32)
+    projections = centers[labels + 1] + rng.normal(scale=0.5, size=(n, 2)).astype(np.float32)
+    return projections, labels
+
+
+def test_histograms_and_density_image():
+    projections, labels = _points(5000)
+    extent = data_extent(projections)
+    hist, label_ids = cluster_histograms(projections, labels, extent, bins=64)
+    assert hist.shape == (64 * 64, 5)
+    assert hist.sum() == len(projections)
+    assert np.array_equal(np.asarray(hist.sum(axis=0)).ravel(), np.bincount(labels + 1))
+
+    image = render_density(hist, label_ids, 64)
+    assert image.shape == (64, 64, 4)
+    counts = np.asarray(hist.sum(axis=1)).ravel().reshape(64, 64)
+    assert np.array_equal(image[:, :, 3] > 0, counts > 0)
+    # 只含一个簇的格子颜色等于该簇的颜色
+    pure = np.flatnonzero((hist > 0).sum(axis=1).A.ravel() == 1)[0]
+    label = label_ids[hist[pure].nonzero()[1][0]]
+    assert image.reshape(-1, 4)[pure, :3].tolist() == hex_to_rgb(label_color(label))
+
+
+def test_lod_sample_keeps_sparse_regions():
+    projections, _ = _points(20000)
+    outliers = np.array([[40, 40], [-40, -40]], dtype=np.float32)
+    projections = np.vstack([projections, outliers])
+    sample = lod_sample(projections, max_points=1000)
+    assert len(sample) == 1000
+    assert np.all(np.diff(sample) > 0)
+    assert {20000, 20001} <= set(sample.tolist())
+    assert np.array_equal(lod_sample(projections[:500], max_points=1000), np.arange(500))
+
+
+def test_export_size_does_not_grow_with_points(tmp_path):
+    sizes = {}
+    for n in (3000, 30000):
+        projections, labels = _points(n, seed=n)
+        texts = [f"conversation {i}" for i in range(n)]
+        folder = tmp_path / str(n)
+        export_scatter(
+            str(folder),
+            projections,
+            labels,
+            texts,
+            summaries={0: {"cluster": "topic a", "nums": 1}},
+            overview_bins=128,
+            tile_size=64,
+            levels=1,
+            max_points=500,
+            shard_size=200,
+        )
+        points = json.loads((folder / "points.json").read_text())
+        assert len(points["id"]) == 500
+        hover = json.loads((folder / "hover" / "0.json").read_text())
+        assert hover[str(points["id"][0])] == texts[points["id"][0]]
+        clusters = json.loads((folder / "clusters.json").read_text())
+        assert sum(c["nums"] for c in clusters) == n
+        assert [c["topic"] for c in clusters if c["label"] == 0] == ["topic a"]
+        assert os.path.exists(folder / "overview.png")
+        sizes[n] = sorted(os.path.relpath(os.path.join(d, f), folder) for d, _, fs in os.walk(folder) for f in fs)
+    assert sizes[3000] == sizes[30000]
+
+
+def test_export_replaces_stale_hover_shards_and_reads_string_keys(tmp_path):
+    projections, labels = _points(3000, seed=1)
+    texts = [f"conversation {i}" for i in range(3000)]
+    export_scatter(str(tmp_path), projections, labels, texts, max_points=1000, shard_size=200, levels=0)
+    assert len(os.listdir(tmp_path / "hover")) == 5
+
+    # 再次导出到同一目录：样本变少，摘要来自 cluster_summaries.json（键为字符串）
+    summaries = json.loads(json.dumps({0: {"cluster": "topic a", "nums": 1}}))
+    export_scatter(
+        str(tmp_path), projections, labels, texts, summaries=summaries, max_points=300, shard_size=200, levels=0
+    )
+    assert sorted(os.listdir(tmp_path / "hover")) == ["0.json", "1.json"]
+    clusters = json.loads((tmp_path / "clusters.json").read_text())
+    assert [c["topic"] for c in clusters if c["label"] == 0] == ["topic a"]
@@ -0,0 +1,95 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import faiss
+import numpy as np
+
+from dedup import Duplicates
+from serve import SearchService, make_server
+
+
+def _service(n=200, duplicates=None, **kwargs):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(n, 16)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(16)
+    index.add(embeddings)
+    texts = [f"doc {i}" for i in range(n)]
+    labels = np.arange(n) % 4
+    calls = []
+
+    def embed(queries):
+        calls.append(len(queries))
+        return embeddings[[int(q.split()[1]) for q in queries]]
+
+    summaries = {0: {"cluster": "topic zero", "nums": n // 4}}
+    service = SearchService(
+        embed, index, texts, labels, summaries=summaries, duplicates=duplicates, vote_k=1, **kwargs
+    )
+    return service, calls
+
+
+def test_concurrent_requests_share_batches():
+    service, calls = _service(max_batch_size=16, max_wait_ms=50)
+    results = [None] * 40
+
+    def query(i):
+        results[i] = service.search(f"doc {i}", top_k=3)
+
+    with service:
+        threads = [threading.Thread(target=query, args=(i,)) for i in range(40)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    assert sum(calls) == 40
+    assert len(calls) < 40 and max(calls) <= 16
+    for i, result in enumerate(results):
+        assert result["results"][0]["id"] == i
+        assert result["results"][0]["distance"] < 1e-5
+        assert len(result["results"]) == 3
+        assert result["label"] == i % 4
+    assert results[0]["topic"] == "topic zero"
+    assert results[1]["topic"] is None
+
+
+def test_duplicates_are_returned_once():
+    groups = np.arange(200)
+    groups[100:] = groups[:100]
+    service, _ = _service(duplicates=Duplicates.from_groups(groups))
+    with service:
+        ids = [r["id"] for r in service.search("doc 5", top_k=10)["results"]]
+    assert len(ids) == 10
+    assert len({i % 100 for i in ids}) == 10
+
+
+def test_http_search():
+    service, _ = _service()
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def post(body):
+        request = urllib.request.Request(f"{url}/search", data=json.dumps(body).encode())
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        assert post({"query": "doc 7", "top_k": 2})["results"][0]["id"] == 7
+        batch = post({"queries": ["doc 1", "doc 2"], "top_k": 1})["results"]
+        assert [r["results"][0]["id"] for r in batch] == [1, 2]
+        with urllib.request.urlopen(f"{url}/health") as response:
+            assert json.loads(response.read())["n_docs"] == 200
+        try:
+            post({"top_k": 1})
+            raise AssertionError("expected HTTP 400")
+        except urllib.error.HTTPError as e:
+            assert e.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
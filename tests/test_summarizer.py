@@ -0,0 +1,160 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from summarizer import ClusterSummarizer, RateLimiter, SummaryCache
+
+
+class StubState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.calls = {}
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = body["messages"][-1]["content"]
+            with state.lock:
+                state.active += 1
+                state.max_active = max(state.max_active, state.active)
+                state.calls[prompt] = state.calls.get(prompt, 0) + 1
+                attempt = state.calls[prompt]
+            time.sleep(0.05)
+            with state.lock:
+                state.active -= 1
+
+            if "bad request" in prompt:
+                return self._reply(400, {"error": {"message": "bad request"}})
+            if "flaky" in prompt and attempt == 1:
+                return self._reply(500, {"error": {"message": "try again"}})
+            self._reply(
+                200,
+                {
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": f"summary of {prompt}"},
+                        }
+                    ],
+                },
+            )
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+@pytest.fixture
+def stub_server():
+    state = StubState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1", state
+    server.shutdown()
+
+
+def test_concurrent_summaries_with_retry_and_fallback(stub_server):
+    base_url, state = stub_server
+    summarizer = ClusterSummarizer(
+        model="stub",
+        base_url=base_url,
+        api_key="test",
+        concurrency=4,
+        max_retries=2,
+        backoff_base=0.01,
+    )
+    prompts = {label: f"cluster {label}" for label in range(12)}
+    prompts[12] = "flaky cluster"
+    prompts[13] = "bad request"
+
+    summaries = summarizer.summarize(prompts)
+
+    for label in range(12):
+        assert summaries[label] == f"summary of cluster {label}"
+    assert summaries[12] == "summary of flaky cluster"
+    assert state.calls["flaky cluster"] == 2
+    assert summaries[13] is None
+    assert state.calls["bad request"] == 1
+    assert 1 < state.max_active <= 4
+
+
+def test_rate_limiter_throttles_after_burst():
+    limiter = RateLimiter(requests_per_minute=120)
+
+    async def acquire_all():
+        for _ in range(123):
+            await limiter.acquire()
+
+    start = time.monotonic()
+    asyncio.run(acquire_all())
+    # 桶容量120，之后每秒补充2个请求
+    assert 1.2 < time.monotonic() - start < 3
+
+
+def test_summary_cache_exact_and_overlap_reuse(tmp_path):
+    path = str(tmp_path / "summaries.json")
+    scope = SummaryCache.scope("model", "instruction")
+    members = [f"doc{i}" for i in range(10)]
+
+    cache = SummaryCache(path, reuse_threshold=0.8)
+    key = SummaryCache.make_key(scope, members[:3])
+    cache.put(key, scope, members, "topic A")
+    cache.save()
+
+    cache = SummaryCache(path, reuse_threshold=0.8)
+    assert cache.get(key, scope, []) == "topic A"
+    other_key = SummaryCache.make_key(scope, members[1:4])
+    # 9/10 的成员相同 -> 复用
+    assert cache.get(other_key, scope, members[:9]) == "topic A"
+    # 重合度不足，或模型/指令不同时不复用
+    assert cache.get(other_key, scope, members[:5] + ["x", "y"]) is None
+    other_scope = SummaryCache.scope("model", "another instruction")
+    assert cache.get(other_key, other_scope, members) is None
+
+
+def test_summary_cache_is_bounded(tmp_path):
+    path = str(tmp_path / "summaries.json")
+    scope = SummaryCache.scope("model", "instruction")
+    members = [f"doc{i:04d}" for i in range(1000)]
+
+    cache = SummaryCache(path, max_entries=2, max_members=64)
+    for i in range(3):
+        cache.put(f"key{i}", scope, members[i * 300 : i * 300 + 400], f"topic {i}")
+    cache.save()
+
+    cache = SummaryCache(path, max_entries=2, max_members=64)
+    # 超出 max_entries 时淘汰最早的条目，每个条目最多保存 max_members 个成员
+    assert sorted(cache.entries) == ["key1", "key2"]
+    assert all(len(entry["members"]) == 64 for entry in cache.entries.values())
+    # 重合度由草图估计，成员大部分相同时仍然复用
+    assert cache.get("other", scope, members[300:690]) == "topic 1"
+
+    # 被使用过的条目在下一次运行中保留
+    cache.save()
+    cache = SummaryCache(path, max_entries=2, max_members=64)
+    cache.put("key3", scope, members[:10], "topic 3")
+    cache.save()
+    assert sorted(SummaryCache(path).entries) == ["key1", "key3"]
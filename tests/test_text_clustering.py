@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+
+import text_clustering
+from text_clustering import ClusterClassifier
+
+CENTERS = np.eye(16, dtype=np.float32)[:3] * 4
+
+
+class FakeModel:
+    """按文本前缀 a / b / c 落在三个分开的簇里，编号决定簇内的扰动"""
+
+    max_seq_length = 128
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        vectors = []
+        for text in texts:
+            topic, i = text.split()
+            rng = np.random.default_rng(int(i))
+            vectors.append(CENTERS["abc".index(topic)] + rng.normal(scale=0.3, size=16))
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, 16)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def texts(topic, start, n):
+    return [f"{topic} {i}" for i in range(start, start + n)]
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    monkeypatch.setattr(text_clustering, "load_model", lambda *args, **kwargs: FakeModel())
+    clf = ClusterClassifier(
+        embed_num_workers=1,
+        summary_create=False,
+        dbscan_eps=1.0,
+        dbscan_min_samples=5,
+        dbscan_n_jobs=1,
+        umap_n_jobs=1,
+    )
+    clf.fit(texts("a", 0, 80) + texts("b", 0, 80) + texts("c", 0, 80))
+    return clf
+
+
+def _label_of(clf, topic):
+    labels = np.asarray(clf.cluster_labels)[:240].reshape(3, 80)
+    return int(np.bincount(labels["abc".index(topic)][labels["abc".index(topic)] >= 0]).argmax())
+
+
+def test_update_appends_index_projections_and_labels(classifier):
+    label_a = _label_of(classifier, "a")
+    labels, refit = classifier.update(texts("a", 1000, 20), drift_threshold=10.0)
+
+    assert not refit
+    assert (labels == label_a).mean() > 0.9
+    assert classifier.faiss_index.ntotal == 260
+    assert classifier.projections.shape == (260, 2)
+    assert classifier.embeddings.shape == (260, 16)
+    assert len(classifier.texts) == len(classifier.cluster_labels) == 260
+    np.testing.assert_array_equal(classifier.cluster_labels[-20:], labels)
+    # 新对话可以作为近邻被检索到
+    _, neighbours = classifier.faiss_index.search(classifier.embeddings[-1:], 1)
+    assert neighbours[0, 0] == 259
+
+
+def test_update_marks_far_points_as_noise(classifier):
+    # 投影后离已有点的距离都大于 eps 时视为噪声
+    classifier.dbscan_eps = 1e-6
+    labels, refit = classifier.update(texts("b", 1000, 10), noise_threshold=1.0)
+    assert not refit
+    assert (labels == -1).all()
+
+    labels, refit = classifier.update(texts("b", 2000, 10), noise_threshold=0.3)
+    assert refit
+    assert len(labels) == 10
+    assert len(classifier.cluster_labels) == classifier.faiss_index.ntotal == 260
+
+
+def test_update_refits_when_clusters_drift(classifier):
+    labels, refit = classifier.update(texts("c", 1000, 10), drift_threshold=10.0)
+    assert not refit
+
+    # 簇中心有任何偏移都超过阈值 0，触发重新 fit
+    labels, refit = classifier.update(texts("c", 2000, 10), drift_threshold=0.0)
+    assert refit
+    assert len(labels) == 10
+    assert len(classifier.cluster_labels) == classifier.projections.shape[0] == 260
+    assert classifier.faiss_index.ntotal == 260
+
+
+def test_update_after_load(classifier, tmp_path):
+    classifier.save(tmp_path)
+    label_a = _label_of(classifier, "a")
+
+    loaded = ClusterClassifier(embed_num_workers=1, summary_create=False, dbscan_eps=1.0)
+    loaded.load(tmp_path)
+    # mapper 推迟到 update 时才读取，检索服务加载时不反序列化
+    assert loaded._umap_mapper is None
+    untouched = ClusterClassifier(embed_num_workers=1, summary_create=False)
+    untouched.load(tmp_path)
+    untouched.save(tmp_path / "copy")
+    assert untouched._umap_mapper is None
+    assert (tmp_path / "copy" / "umap_mapper.pkl").exists()
+
+    labels, refit = loaded.update(texts("a", 1000, 20), drift_threshold=10.0)
+    assert loaded._umap_mapper is not None
+    assert not refit
+    assert (labels == label_a).mean() > 0.9
+    assert loaded.faiss_index.ntotal == len(loaded.texts) == 260
+
+    # 更新后的模型可以保存回同一目录再读取
+    loaded.save(tmp_path)
+    reloaded = ClusterClassifier(embed_num_workers=1, summary_create=False)
+    reloaded.load(tmp_path)
+    assert reloaded.faiss_index.ntotal == len(reloaded.cluster_labels) == 260
+    assert reloaded.texts[259] == "a 1019"
+
+
+def test_load_classifier_restores_query_encoder(classifier, tmp_path, monkeypatch):
+    from serve import load_classifier
+
+    classifier.embed_agg_strategy = "mean"
+    classifier.embed_first_k = 3
+    classifier.embed_backend = "int8"
+    classifier.save(tmp_path)
+
+    backends = []
+
+    def load_model(name, device="cpu", backend="torch", onnx_file_name=None):
+        backends.append(backend)
+        return FakeModel()
+
+    monkeypatch.setattr(text_clustering, "load_model", load_model)
+    loaded = load_classifier(tmp_path)
+    assert loaded.embed_agg_strategy == "mean"
+    assert loaded.embed_first_k == 3
+    assert backends == ["int8"]
+    # 显式指定的后端覆盖保存的后端
+    assert load_classifier(tmp_path, embed_backend="torch").embed_backend == "torch"
+    assert backends == ["int8", "torch"]
+
+
+def test_knn_graph_clusters_the_vectors_passed_in(caplog):
+    x = FakeModel().encode(texts("a", 0, 40) + texts("b", 0, 40))
+    clf = ClusterClassifier(
+        embed_model=FakeModel(),
+        summary_create=False,
+        cluster_method="knn_graph",
+        cluster_graph_k=10,
+        cluster_graph_eps=0.5,
+        dbscan_min_samples=5,
+    )
+    clf.embeddings = x
+    clf.faiss_index = clf.build_faiss_index(x)
+    assert clf.cluster_space(x, None) is x
+
+    full = clf.cluster(x)
+    assert len(set(full[:40])) == len(set(full[40:])) == 1 and full[0] != full[40]
+    # 只传入一部分向量（如重复组的代表）时在这些向量上建图，而不是 self.embeddings
+    subset = np.r_[0:10, 40:50]
+    weights = np.full(len(subset), 4)
+    labels = clf.cluster(x[subset], sample_weight=weights)
+    assert len(labels) == 20
+    assert len(set(labels[:10])) == len(set(labels[10:])) == 1 and labels[0] != labels[10]
+
+    clf.cluster_method = "hdbscan"
+    assert clf.cluster_space(x, "projections") == "projections"
+    with caplog.at_level("WARNING"):
+        clf.cluster(x, sample_weight=np.ones(len(x)))
+    assert "does not support sample weights" in caplog.text
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_series import TimeSeriesRollup
+
+
+def make_df(rows):
+    return pd.DataFrame(
+        rows, columns=["uuid", "start_time", "input_tokens", "output_tokens", "dialogue_turns", "duration"]
+    ).assign(
+        start_time=lambda df: pd.to_datetime(df["start_time"], utc=True),
+        end_time=lambda df: df["start_time"] + pd.to_timedelta(df["duration"], unit="s"),
+    )
+
+
+HISTORY = make_df(
+    [
+        ("a", "2024-03-04T23:30:00Z", 10, 5, 2, 60.0),  # 周一，上海时间已是周二
+        ("b", "2024-03-05T02:00:00Z", 20, 5, 3, 30.0),
+        ("c", "2024-03-20T12:00:00Z", 1, 1, 1, 10.0),
+    ]
+)
+NEW_DAY = make_df([("d", "2024-04-01T08:00:00Z", 7, 3, 4, 5.0)])
+
+
+def test_daily_weekly_monthly_in_timezone():
+    rollup = TimeSeriesRollup("Asia/Shanghai").append(HISTORY)
+    daily = rollup.series("D")
+    assert daily.loc["2024-03-05", "conversations"] == 2
+    assert daily.loc["2024-03-05", "total_tokens"] == 40
+    # 没有数据的日期补 0
+    assert daily.loc["2024-03-10", "conversations"] == 0
+
+    weekly = rollup.series("W")
+    assert weekly.index[0] == pd.Timestamp("2024-03-04")
+    assert weekly["conversations"].sum() == 3
+    assert rollup.series("M").loc["2024-03-01", "duration_seconds"] == 100
+
+    heatmap = rollup.hour_weekday_heatmap()
+    assert heatmap.loc["Tue", 7] == 1 and heatmap.loc["Tue", 10] == 1
+    assert heatmap.to_numpy().sum() == 3
+
+
+def test_incremental_append_matches_full_recompute(tmp_path):
+    rollup = TimeSeriesRollup("Asia/Shanghai").append(HISTORY)
+    rollup.save(tmp_path)
+
+    incremental = TimeSeriesRollup.load(tmp_path, "Asia/Shanghai").append(NEW_DAY).append(NEW_DAY)
+    full = TimeSeriesRollup("Asia/Shanghai").append(pd.concat([HISTORY, NEW_DAY]))
+    pd.testing.assert_frame_equal(incremental.series("D"), full.series("D"))
+    np.testing.assert_array_equal(incremental.heatmap, full.heatmap)
+
+    # 时区不同，日边界不同，不复用已保存的汇总
+    assert TimeSeriesRollup.load(tmp_path, "UTC").daily.empty
+
+
+def test_continued_conversation_replaces_previous_contribution(tmp_path):
+    TimeSeriesRollup("Asia/Shanghai").append(HISTORY).save(tmp_path)
+
+    # b 续聊：轮次、token 和时长都变了，updated_at 随之变化
+    continued = make_df([("b", "2024-03-05T02:00:00Z", 50, 20, 6, 900.0)])
+    rollup = TimeSeriesRollup.load(tmp_path, "Asia/Shanghai").append(continued)
+    full = TimeSeriesRollup("Asia/Shanghai").append(pd.concat([HISTORY[HISTORY["uuid"] != "b"], continued]))
+    pd.testing.assert_frame_equal(rollup.series("D"), full.series("D"))
+    np.testing.assert_array_equal(rollup.heatmap, full.heatmap)
+    assert rollup.series("D").loc["2024-03-05", "conversations"] == 2
+    assert rollup.series("D").loc["2024-03-05", "total_tokens"] == 85
+
+    # 同一版本再次追加不变
+    again = rollup.append(pd.concat([HISTORY[HISTORY["uuid"] != "b"], continued]))
+    pd.testing.assert_frame_equal(again.series("D"), full.series("D"))
+
+
+def test_rolling_average_and_export():
+    rollup = TimeSeriesRollup().append(HISTORY)
+    rolling = rollup.rolling(window=2)
+    assert rolling.loc["2024-03-06", "conversations"] == pytest.approx(0.5)
+
+    data = rollup.to_dict()
+    assert data["daily"][0]["day"] == "2024-03-04"
+    assert np.array(data["heatmap"]["conversations"]).shape == (7, 24)
+
+
+def make_messages(rows):
+    return pd.DataFrame(rows, columns=["uuid", "created_at", "input_tokens", "output_tokens"]).assign(
+        created_at=lambda df: pd.to_datetime(df["created_at"], utc=True)
+    )
+
+
+def test_message_tokens_are_counted_on_their_own_day(tmp_path):
+    # a 从上海时间 3 月 5 日开始，3 月 7 日又聊了一轮
+    messages = make_messages(
+        [
+            ("a", "2024-03-04T23:30:00Z", 4, 0),
+            ("a", "2024-03-04T23:31:00Z", 0, 2),
+            ("a", "2024-03-07T01:00:00Z", 6, 3),
+            ("b", "2024-03-05T02:00:00Z", 20, 5),
+            ("c", "2024-03-20T12:00:00Z", 1, 1),
+        ]
+    )
+    rollup = TimeSeriesRollup("Asia/Shanghai").append(HISTORY, messages)
+    daily = rollup.series("D")
+    assert daily.loc["2024-03-05", "total_tokens"] == 31
+    assert daily.loc["2024-03-07", "total_tokens"] == 9
+    # 对话数、轮次和时长仍计入开始的那一天
+    assert daily.loc["2024-03-07", "conversations"] == 0
+    assert daily.loc["2024-03-05", "conversations"] == 2
+    assert daily["total_tokens"].sum() == HISTORY[["input_tokens", "output_tokens"]].to_numpy().sum()
+    tokens = rollup.hour_weekday_heatmap("total_tokens")
+    assert tokens.loc["Tue", 7] == 6 and tokens.loc["Thu", 9] == 9
+
+    # a 续聊到 3 月 8 日：旧的两天贡献全部扣除，重新计入三天
+    rollup.save(tmp_path)
+    continued = make_df([("a", "2024-03-04T23:30:00Z", 12, 5, 3, 200000.0)])
+    more = pd.concat(
+        [messages[messages["uuid"] == "a"], make_messages([("a", "2024-03-08T03:00:00Z", 2, 0)])]
+    )
+    incremental = TimeSeriesRollup.load(tmp_path, "Asia/Shanghai").append(continued, more)
+    rest = HISTORY["uuid"] != "a"
+    full = TimeSeriesRollup("Asia/Shanghai").append(
+        pd.concat([HISTORY[rest], continued]), pd.concat([messages[messages["uuid"] != "a"], more])
+    )
+    pd.testing.assert_frame_equal(incremental.series("D"), full.series("D"))
+    np.testing.assert_array_equal(incremental.heatmap, full.heatmap)
+    assert incremental.series("D").loc["2024-03-08", "total_tokens"] == 2
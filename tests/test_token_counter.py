@@ -0,0 +1,38 @@
+import tiktoken
+
+from token_counter import TokenCounter
+
+# 按字节切分的小编码器，测试时不需要下载 o200k_base
+BYTE_ENCODING = tiktoken.Encoding(
+    "bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+TEXTS = ["hello world", "", "你好", "<|endoftext|>", "hello world"]
+
+
+def test_count_batch_matches_encode():
+    counter = TokenCounter(encoding=BYTE_ENCODING, batch_size=2)
+    expected = [len(BYTE_ENCODING.encode(t, disallowed_special=())) for t in TEXTS]
+    assert counter.count_batch(TEXTS) == expected
+
+
+def test_process_executor():
+    with TokenCounter(encoding=BYTE_ENCODING, executor="process", num_workers=2, batch_size=1) as counter:
+        assert counter.count_batch(TEXTS) == [11, 0, 6, 13, 11]
+
+
+def test_cache_roundtrip(tmp_path):
+    cache_path = tmp_path / "token_cache.json"
+    with TokenCounter(encoding=BYTE_ENCODING, cache_path=str(cache_path)) as counter:
+        counts = counter.count_batch(TEXTS)
+    assert cache_path.exists()
+
+    counter = TokenCounter(encoding=BYTE_ENCODING, cache_path=str(cache_path))
+    calls = []
+    counter._count_uncached = lambda texts: calls.append(texts) or [0] * len(texts)
+    assert counter.count_batch(TEXTS) == counts
+    assert counter.count_batch(["new text"]) == [0]
+    assert calls == [["new text"]]
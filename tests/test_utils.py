@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from utils import iter_chat_data
+
+
+def _write(tmp_path, content):
+    path = tmp_path / "conversations.json"
+    path.write_text(content, encoding="utf-8")
+    return path
+
+
+def test_iter_chat_data_matches_json_load(tmp_path):
+    data = [
+        {
+            "uuid": str(i),
+            "name": f"对话 {i}",
+            "chat_messages": [{"text": "x" * (i * 37), "sender": "human"}] * i,
+        }
+        for i in range(20)
+    ]
+    path = _write(tmp_path, json.dumps(data, ensure_ascii=False, indent=2))
+
+    # 很小的块大小可以覆盖对话跨越多个块的情况
+    assert list(iter_chat_data(path, chunk_size=7)) == data
+    assert list(iter_chat_data(path)) == data
+
+
+def test_iter_chat_data_empty_array(tmp_path):
+    path = _write(tmp_path, " [ \n ] ")
+    assert list(iter_chat_data(path, chunk_size=1)) == []
+
+
+def test_iter_chat_data_rejects_truncated_file(tmp_path):
+    path = _write(tmp_path, '[{"uuid": "a"}, {"uuid": "b"')
+    with pytest.raises(ValueError):
+        list(iter_chat_data(path, chunk_size=4))
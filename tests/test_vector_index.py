@@ -0,0 +1,82 @@
+from collections import Counter
+
+import faiss
+import numpy as np
+import pytest
+
+from vector_index import (
+    _pq_subquantizers,
+    build_index,
+    default_nlist,
+    knn_vote,
+    recall_at_k,
+    set_search_params,
+)
+
+
+def _normalized(n, dim=32, seed=0):
+    x = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw", "ivf_pq"])
+def test_build_index_searches_itself(index_type):
+    x = _normalized(2000)
+    index = build_index(x, index_type=index_type, pq_m=8, nprobe=64)
+    report = recall_at_k(index, x, k=5, n_queries=100)
+    assert index.ntotal == len(x)
+    assert report["recall"] > (0.99 if index_type == "flat" else 0.3)
+
+
+def test_recall_improves_with_search_params():
+    x = _normalized(4000, seed=2)
+    ivf = build_index(x, index_type="ivf_flat", nlist=64, nprobe=1)
+    assert faiss.extract_index_ivf(ivf).nprobe == 1
+    low = recall_at_k(ivf, x, k=10, n_queries=200)["recall"]
+    set_search_params(ivf, nprobe=1000)
+    # nprobe 不超过 nlist，全部探查时与精确检索一致
+    assert faiss.extract_index_ivf(ivf).nprobe == 64
+    assert recall_at_k(ivf, x, k=10, n_queries=200)["recall"] == pytest.approx(1.0)
+    assert low < 1.0
+
+    hnsw = build_index(x, index_type="hnsw", ef_search=16)
+    set_search_params(hnsw, ef_search=256)
+    assert hnsw.hnsw.efSearch == 256
+
+
+def test_recall_report_and_index_defaults():
+    x = _normalized(3000, seed=3)
+    index = build_index(x, index_type="ivf_pq", metric="l2", pq_m=12)
+    assert index.metric_type == faiss.METRIC_L2
+    # 32 维不能被 12 整除，退到能整除的 8 个子空间
+    assert faiss.downcast_index(faiss.extract_index_ivf(index)).pq.M == _pq_subquantizers(32, 12) == 8
+    assert faiss.extract_index_ivf(index).nlist == default_nlist(3000) == 76
+
+    report = recall_at_k(index, x, k=10, n_queries=50)
+    assert report["k"] == 10 and report["n_queries"] == 50
+    # PQ 压缩后的索引小于精确索引
+    assert report["memory_bytes"] < report["exact_memory_bytes"]
+
+    # 数据太少无法训练时退回 flat
+    small = build_index(x[:20], index_type="ivf_flat")
+    assert faiss.try_extract_index_ivf(small) is None and small.ntotal == 20
+    with pytest.raises(ValueError):
+        build_index(x, index_type="annoy")
+
+
+def test_knn_vote_matches_counter():
+    labels = np.random.default_rng(1).integers(-1, 4, size=(500, 6))
+    voted, confidence = knn_vote(labels)
+    expected = [Counter(row.tolist()).most_common(1)[0] for row in labels]
+    assert voted.tolist() == [label for label, _ in expected]
+    assert np.allclose(confidence, [count / 6 for _, count in expected])
+
+
+def test_knn_vote_weights_and_missing_neighbours():
+    labels = np.array([[1, 2, 2], [3, 3, 3]])
+    weights = np.array([[10.0, 1.0, 1.0], [1.0, 1.0, 1.0]])
+    valid = np.array([[True, True, True], [False, False, False]])
+    voted, confidence = knn_vote(labels, weights=weights, valid=valid)
+    assert voted.tolist() == [1, -1]
+    assert confidence[0] == pytest.approx(10 / 12)
+    assert confidence[1] == 0
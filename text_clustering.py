@@ -1,20 +1,39 @@
 import json
 import logging
 import os
+import pickle
 import random
+import shutil
 import textwrap
-from collections import Counter, defaultdict
+from collections import Counter
 
 import faiss
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import plotly.express as px
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer
-from sklearn.cluster import DBSCAN
 from tqdm import tqdm
-from umap import UMAP
+
+from artifacts import (
+    TextStore,
+    load_array,
+    read_meta,
+    save_array,
+    write_meta,
+    write_texts,
+)
+from chunking import AGG_STRATEGIES, encode_length_sorted, pool_chunks, split_windows
+from embedding_engine import EmbeddingEngine, load_model
+from dedup import Duplicates, exact_duplicates, near_duplicates
+from embedding_store import EmbeddingStore
+from graph_clustering import dbscan_sweep, graph_dbscan, knn_radius_graph
+from membership import ClusterMembership
+from profiling import profiled
+from utils import available_cpus, text_hash
+from vector_index import (
+    build_index,
+    distance_weights,
+    knn_vote,
+    recall_at_k,
+    set_search_params,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -34,11 +53,38 @@ class ClusterClassifier:
         embed_batch_size=64,
         embed_max_seq_length=512,
         embed_agg_strategy=None,
+        embed_chunk_overlap=64,
+        embed_first_k=2,
+        embed_cache_dir=None,
+        embed_backend="torch",
+        embed_onnx_file_name=None,
+        embed_num_workers=1,
+        embed_memory_budget_mb=1024,
+        embed_model=None,
+        index_type="flat",
+        index_metric="ip",
+        index_nlist=None,
+        index_nprobe=8,
+        index_hnsw_m=32,
+        index_ef_search=64,
+        index_pq_m=16,
+        index_train_size=None,
         umap_components=2,
         umap_metric="cosine",
+        umap_pca_components=None,
+        umap_landmarks=None,
+        umap_strata=None,
+        umap_transform_batch_size=16384,
+        umap_n_jobs=1,
         dbscan_eps=0.08,
         dbscan_min_samples=50,
-        dbscan_n_jobs=16,
+        dbscan_n_jobs=None,
+        cluster_method="dbscan",
+        cluster_graph_k=30,
+        cluster_graph_eps=0.3,
+        dedup_method=None,
+        dedup_eps=0.02,
+        dedup_k=16,
         summary_create=True,
         summary_model="gpt-3.5-turbo",
         summary_model_base="https://api.openai.com/v1",
@@ -48,19 +94,77 @@ class ClusterClassifier:
         summary_chunk_size=420,
         summary_template=None,
         summary_instruction=None,
+        summary_concurrency=8,
+        summary_requests_per_minute=None,
+        summary_tokens_per_minute=None,
+        summary_max_retries=3,
+        summary_timeout=60,
+        summary_cache_path=None,
+        summary_reuse_threshold=0.8,
     ):
         self.embed_model_name = embed_model_name
         self.embed_device = embed_device
         self.embed_batch_size = embed_batch_size
         self.embed_max_seq_length = embed_max_seq_length
+        # None 表示沿用截断到 embed_max_seq_length 的方式，
+        # "mean" / "max" / "first_k" 表示分块编码后按对应方式聚合
+        if embed_agg_strategy is not None and embed_agg_strategy not in AGG_STRATEGIES:
+            raise ValueError(
+                f"Unknown embed_agg_strategy '{embed_agg_strategy}', "
+                f"use None or one of {AGG_STRATEGIES}."
+            )
         self.embed_agg_strategy = embed_agg_strategy
+        self.embed_chunk_overlap = embed_chunk_overlap
+        self.embed_first_k = embed_first_k
+        self.embed_cache_dir = embed_cache_dir
+        self._embed_store = None
+        # embed_batch_size=None 时按 embed_memory_budget_mb 自动估算
+        self.embed_backend = embed_backend
+        self.embed_onnx_file_name = embed_onnx_file_name
+        self.embed_num_workers = embed_num_workers
+        self.embed_memory_budget_mb = embed_memory_budget_mb
+
+        self.index_type = index_type
+        self.index_metric = index_metric
+        self.index_nlist = index_nlist
+        self.index_nprobe = index_nprobe
+        self.index_hnsw_m = index_hnsw_m
+        self.index_ef_search = index_ef_search
+        self.index_pq_m = index_pq_m
+        self.index_train_size = index_train_size
 
         self.umap_components = umap_components
         self.umap_metric = umap_metric
+        # umap_landmarks 为 umap 最多拟合的点数，数据超过这个规模时只在分层抽样的 landmark 上拟合，
+        # 其余点分批 transform；umap_pca_components 为拟合前 PCA 降到的维数（None 表示不降维），
+        # 与是否抽样无关
+        self.umap_pca_components = umap_pca_components
+        self.umap_landmarks = umap_landmarks
+        self.umap_strata = umap_strata
+        self.umap_transform_batch_size = umap_transform_batch_size
+        self.umap_n_jobs = umap_n_jobs or available_cpus()
 
         self.dbscan_eps = dbscan_eps
         self.dbscan_min_samples = dbscan_min_samples
-        self.dbscan_n_jobs = dbscan_n_jobs
+        # 默认使用当前进程可用的全部CPU
+        self.dbscan_n_jobs = dbscan_n_jobs or available_cpus()
+        if cluster_method not in ("dbscan", "knn_graph", "hdbscan"):
+            raise ValueError(
+                f"Unknown cluster method '{cluster_method}', "
+                "use 'dbscan', 'knn_graph' or 'hdbscan'."
+            )
+        self.cluster_method = cluster_method
+        self.cluster_graph_k = cluster_graph_k
+        self.cluster_graph_eps = cluster_graph_eps
+
+        # exact: 合并完全相同的文本；near: 再合并余弦距离不超过 dedup_eps 的近似重复
+        if dedup_method not in (None, "exact", "near"):
+            raise ValueError(
+                f"Unknown dedup method '{dedup_method}', use None, 'exact' or 'near'."
+            )
+        self.dedup_method = dedup_method
+        self.dedup_eps = dedup_eps
+        self.dedup_k = dedup_k
 
         self.summary_create = summary_create
         self.summary_model = summary_model
@@ -70,6 +174,13 @@ class ClusterClassifier:
         self.summary_n_examples = summary_n_examples
         self.summary_chunk_size = summary_chunk_size
         self.summary_model_token = summary_model_token
+        self.summary_concurrency = summary_concurrency
+        self.summary_requests_per_minute = summary_requests_per_minute
+        self.summary_tokens_per_minute = summary_tokens_per_minute
+        self.summary_max_retries = summary_max_retries
+        self.summary_timeout = summary_timeout
+        self.summary_cache_path = summary_cache_path
+        self.summary_reuse_threshold = summary_reuse_threshold
 
         if summary_template is None:
             self.summary_template = DEFAULT_TEMPLATE
@@ -86,49 +197,103 @@ class ClusterClassifier:
         self.cluster_labels = None
         self.texts = None
         self.projections = None
-        self.umap_mapper = None
+        self._umap_mapper = None
+        # load 时只记下 umap_mapper.pkl 的路径，第一次用到 mapper 时才反序列化
+        self._umap_mapper_path = None
         self.id2label = None
         self.label2docs = None
-
-        self.embed_model = SentenceTransformer(
-            self.embed_model_name, device=self.embed_device
-        )
+        self.membership = None
+        self.duplicates = None
+        self.cluster_summaries = None
+        # 最近一次 summarize 中请求失败、用 "Cluster <label>" 代替的簇
+        self.summary_failures = []
+        self._faiss_index_path = None
+
+        # embed_model 为已加载的模型（如压测用的 StubEmbedder），为 None 时按名称和后端加载
+        if embed_model is None:
+            embed_model = load_model(
+                self.embed_model_name,
+                device=self.embed_device,
+                backend=self.embed_backend,
+                onnx_file_name=self.embed_onnx_file_name,
+            )
+        self.embed_model = embed_model
         self.embed_model.max_seq_length = self.embed_max_seq_length
+        self.embed_engine = EmbeddingEngine(
+            self.embed_model,
+            batch_size=self.embed_batch_size,
+            num_workers=self.embed_num_workers,
+            memory_budget_mb=self.embed_memory_budget_mb,
+        )
+
+    def close(self):
+        """停止 embedding 和投影 transform 的多进程池"""
+        self.embed_engine.close()
+        if hasattr(self._umap_mapper, "close"):
+            self._umap_mapper.close()
+
+    @property
+    def umap_mapper(self):
+        """投影用的 mapper，只有 update 需要；从目录加载时推迟到第一次访问才读取"""
+        if self._umap_mapper is None and self._umap_mapper_path is not None:
+            with open(self._umap_mapper_path, "rb") as f:
+                self._umap_mapper = pickle.load(f)
+            self._umap_mapper_path = None
+        return self._umap_mapper
+
+    @umap_mapper.setter
+    def umap_mapper(self, mapper):
+        self._umap_mapper = mapper
+        self._umap_mapper_path = None
 
     def fit(self, texts, embeddings=None):
         self.texts = texts
+        exact = exact_duplicates(texts) if self.dedup_method is not None else None
 
         if embeddings is None:
             logging.info("embedding texts...")
-            self.embeddings = self.embed(texts)
+            if exact is not None:
+                # 完全相同的文本只编码一次
+                unique = [texts[i] for i in exact.representatives]
+                self.embeddings = exact.expand(self.embed(unique))
+            else:
+                self.embeddings = self.embed(texts)
         else:
             logging.info("using precomputed embeddings...")
             self.embeddings = embeddings
         print(f"embeddings shape: {self.embeddings.shape}")
         logging.info("building faiss index...")
         self.faiss_index = self.build_faiss_index(self.embeddings)
-        logging.info("projecting with umap...")
-        self.projections, self.umap_mapper = self.project(self.embeddings)
-        logging.info("dbscan clustering...")
-        self.cluster_labels = self.cluster(self.projections)
-        self.id2cluster = {
-            index: label for index, label in enumerate(self.cluster_labels)
-        }
-        self.label2docs = defaultdict(list)
-        for i, label in enumerate(self.cluster_labels):
-            self.label2docs[label].append(i)
-
-        self.cluster_centers = {}
-        for label in self.label2docs.keys():
-            x = np.mean([self.projections[doc, 0] for doc in self.label2docs[label]])
-            y = np.mean([self.projections[doc, 1] for doc in self.label2docs[label]])
-            self.cluster_centers[label] = (x, y)
-
-        print(f"Number of clusters is {len(set(self.cluster_labels))}")
-
-        cluster_sizes = Counter(self.cluster_labels)
+        self._faiss_index_path = None
+
+        self.duplicates = self.find_duplicates(texts, self.embeddings, exact=exact)
+        if self.duplicates is None:
+            logging.info("projecting with umap...")
+            self.projections, self.umap_mapper = self.project(self.embeddings)
+            logging.info("dbscan clustering...")
+            self.cluster_labels = self.cluster(
+                self.cluster_space(self.embeddings, self.projections)
+            )
+        else:
+            # 降维和聚类只在每组的代表上进行，组大小作为权重，结果再展开回全部文档
+            representatives = self.duplicates.representatives
+            logging.info("projecting representatives with umap...")
+            projections, self.umap_mapper = self.project(self.embeddings[representatives])
+            logging.info("dbscan clustering...")
+            labels = self.cluster(
+                self.cluster_space(self.embeddings[representatives], projections),
+                sample_weight=self.duplicates.weights,
+            )
+            self.projections = self.duplicates.expand(projections)
+            self.cluster_labels = self.duplicates.expand(labels)
+        self._build_cluster_index()
+
+        print(f"Number of clusters is {len(self.membership.label_ids)}")
+
         print("\nCluster sizes:")
-        for label, size in sorted(cluster_sizes.items()):
+        for label, size in zip(
+            self.membership.label_ids.tolist(), self.membership.sizes.tolist()
+        ):
             if label == -1:
                 print(f"Noise points: {size}")
             else:
@@ -142,45 +307,349 @@ class ClusterClassifier:
 
         return self.embeddings, self.cluster_labels, self.cluster_summaries
 
-    def infer(self, texts, top_k=1):
-        embeddings = self.embed(texts)
+    def _build_cluster_index(self):
+        self.membership = ClusterMembership.from_labels(
+            self.cluster_labels, self.projections
+        )
+        self._set_cluster_index()
+
+    def _set_cluster_index(self):
+        # 兼容原有属性：id2cluster 直接使用类别数组，label2docs 为文档id数组视图
+        self.id2cluster = self.cluster_labels
+        self.label2docs = self.membership.label2docs()
+        self.cluster_centers = self.membership.center_map()
+
+    def find_duplicates(self, texts, embeddings, faiss_index=None, exact=None):
+        """按 dedup_method 分组重复文档，未开启时返回 None"""
+        if self.dedup_method is None:
+            return None
+        duplicates = exact if exact is not None else exact_duplicates(texts)
+        if self.dedup_method == "near":
+            duplicates = near_duplicates(
+                faiss_index if faiss_index is not None else self.faiss_index,
+                embeddings,
+                eps=self.dedup_eps,
+                k=self.dedup_k,
+                exact=duplicates,
+            )
+        logging.info(
+            f"dedup: {len(duplicates)} texts -> {duplicates.n_groups} groups "
+            f"(duplicate rate {duplicates.duplicate_rate:.3f})"
+        )
+        return duplicates
+
+    def _cluster_size(self, label):
+        """簇内的对话数，合并了重复时按重复组计数"""
+        docs = self.label2docs[label]
+        if self.duplicates is None:
+            return len(docs)
+        return self.duplicates.group_counts(docs)
+
+    @profiled("update", items=lambda self, new_texts, *args, **kwargs: len(new_texts))
+    def update(self, new_texts, top_k=10, noise_threshold=0.3, drift_threshold=0.5):
+        """增量加入新对话，不重新训练
+
+        只对新对话做embedding，用已有的 faiss 索引做近邻投票分配类别，
+        再用保存的 umap_mapper.transform 投影。新对话中噪声比例超过 noise_threshold，
+        或簇中心的平均偏移超过簇平均半径的 drift_threshold 倍时，才会整体重新 fit。
+
+        返回 (新对话的类别, 是否重新fit)
+        """
+        new_labels, new_embeddings = self.infer(new_texts, top_k=top_k)
+        new_labels = np.asarray(new_labels, dtype=self.cluster_labels.dtype)
+        new_projections = self.umap_mapper.transform(new_embeddings)
+
+        # 与 DBSCAN 一致：投影后离所有已有点都超过 eps 的新对话视为噪声
+        projection_index = faiss.IndexFlatL2(self.projections.shape[1])
+        projection_index.add(np.ascontiguousarray(self.projections, dtype=np.float32))
+        nearest, _ = projection_index.search(
+            np.ascontiguousarray(new_projections, dtype=np.float32), 1
+        )
+        new_labels[np.sqrt(nearest[:, 0]) > self.dbscan_eps] = -1
+
+        old_centers = dict(self.cluster_centers)
+        old_radius = self._cluster_radius()
+
+        self.texts = list(self.texts) + list(new_texts)
+        self.embeddings = np.vstack([self.embeddings, new_embeddings])
+        self.projections = np.vstack([self.projections, new_projections])
+        self.cluster_labels = np.concatenate([self.cluster_labels, new_labels])
+        if self.duplicates is not None:
+            self.duplicates = self.duplicates.extend(len(new_labels))
+        if self._faiss_index_path is not None:
+            # 映射打开的索引是只读的，追加前先完整读入内存
+            self.faiss_index = self._read_faiss_index(self._faiss_index_path)
+            set_search_params(
+                self.faiss_index, nprobe=self.index_nprobe, ef_search=self.index_ef_search
+            )
+        self.faiss_index.add(new_embeddings)
+        self._build_cluster_index()
 
-        dist, neighbours = self.faiss_index.search(embeddings, top_k)
-        inferred_labels = []
-        for i in tqdm(range(embeddings.shape[0])):
-            labels = [self.cluster_labels[doc] for doc in neighbours[i]]
-            inferred_labels.append(Counter(labels).most_common(1)[0][0])
+        noise_fraction = float(np.mean(new_labels == -1)) if len(new_labels) else 0.0
+        # 簇漂移：各簇中心偏移量与簇平均半径之比，按新增文档数加权平均
+        drift, n_assigned = 0.0, 0
+        for label, n_new in Counter(new_labels.tolist()).items():
+            if label == -1:
+                continue
+            shift = np.linalg.norm(
+                np.subtract(self.cluster_centers[label], old_centers[label])
+            )
+            drift += n_new * shift / max(old_radius[label], 1e-12)
+            n_assigned += n_new
+        drift = drift / n_assigned if n_assigned else 0.0
+        logging.info(f"update: noise fraction {noise_fraction:.3f}, drift {drift:.3f}")
 
-        return inferred_labels, embeddings
+        if noise_fraction > noise_threshold or drift > drift_threshold:
+            logging.info("update thresholds exceeded, refitting...")
+            self.fit(self.texts, embeddings=self.embeddings)
+            return self.cluster_labels[-len(new_labels) :], True
 
-    def embed(self, texts):
-        embeddings = self.embed_model.encode(
-            texts,
-            batch_size=self.embed_batch_size,
-            show_progress_bar=True,
-            convert_to_numpy=True,
-            normalize_embeddings=True,
+        if self.cluster_summaries is not None:
+            for label, summary in self.cluster_summaries.items():
+                if isinstance(summary, dict):
+                    summary["nums"] = self._cluster_size(label)
+
+        return new_labels, False
+
+    def _cluster_radius(self):
+        """每个簇内文档到簇中心的平均距离（投影空间）"""
+        radius = self.membership.mean_distance_to_center(
+            self.projections, self.cluster_labels
         )
+        return dict(zip(self.membership.label_ids.tolist(), radius.tolist()))
 
+    @profiled("infer", items=lambda self, texts, *args, **kwargs: len(texts))
+    def infer(
+        self, texts, top_k=1, weighted=False, batch_size=4096, return_confidence=False
+    ):
+        """按近邻多数投票推断类别
+
+        查询按 batch_size 分批embedding和检索，控制内存占用；weighted=True 时按距离加权投票。
+        返回 (类别, embeddings)，return_confidence=True 时返回 (类别, 置信度, embeddings)。
+        """
+        labels, confidence, embeddings = [], [], []
+        for start in tqdm(range(0, len(texts), batch_size)):
+            batch_embeddings = self.embed(texts[start : start + batch_size])
+            batch_labels, batch_confidence = self.infer_embeddings(
+                batch_embeddings, top_k=top_k, weighted=weighted
+            )
+            labels.append(batch_labels)
+            confidence.append(batch_confidence)
+            embeddings.append(batch_embeddings)
+
+        if not embeddings:
+            labels = np.empty(0, dtype=np.int64)
+            confidence = np.empty(0, dtype=np.float64)
+            embeddings = np.empty((0, self.faiss_index.d), dtype=np.float32)
+        else:
+            labels = np.concatenate(labels)
+            confidence = np.concatenate(confidence)
+            embeddings = np.vstack(embeddings)
+
+        if return_confidence:
+            return labels, confidence, embeddings
+        return labels, embeddings
+
+    def infer_embeddings(self, embeddings, top_k=1, weighted=False):
+        """对已经计算好的embedding推断类别，返回 (类别, 置信度)"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        dist, neighbours = self.faiss_index.search(embeddings, top_k)
+        # 近邻不足 top_k 时 faiss 用 -1 填充
+        valid = neighbours >= 0
+        cluster_labels = np.asarray(self.cluster_labels)
+        neighbour_labels = cluster_labels[np.where(valid, neighbours, 0)]
+        weights = (
+            distance_weights(dist, self.faiss_index.metric_type) if weighted else None
+        )
+        return knn_vote(neighbour_labels, weights=weights, valid=valid)
+
+    @profiled("embed", items=lambda self, texts: len(texts))
+    def embed(self, texts):
+        if self.embed_cache_dir is None:
+            return self._encode(texts)
+
+        # 按 (模型, max_seq_length, 文本哈希) 查缓存，只编码未命中的文本
+        if self._embed_store is None:
+            extra = {}
+            # 量化 / ONNX 后端的向量和 fp32 不完全一致，单独缓存
+            if self.embed_backend != "torch":
+                extra["backend"] = self.embed_backend
+                extra["onnx_file_name"] = self.embed_onnx_file_name
+            if self.embed_agg_strategy is not None:
+                extra |= {
+                    "agg_strategy": self.embed_agg_strategy,
+                    "chunk_overlap": self.embed_chunk_overlap,
+                    "first_k": self.embed_first_k,
+                }
+            self._embed_store = EmbeddingStore(
+                self.embed_cache_dir,
+                self.embed_model_name,
+                self.embed_max_seq_length,
+                **extra,
+            )
+        embeddings = self._embed_store.get_or_compute(list(texts), self._encode)
+        logging.info(f"embedding cache size: {len(self._embed_store)}")
         return embeddings
 
-    def project(self, embeddings):
+    def _encode(self, texts):
+        if self.embed_agg_strategy is not None:
+            return self._encode_chunked(texts)
+        return self._encode_batch(texts)
+
+    def _encode_chunked(self, texts):
+        """把长对话按 token 窗口切块，所有分块按长度排序后统一编码，再按 embed_agg_strategy 聚合"""
+        texts = list(texts)
+        # 留出 [CLS] 和 [SEP] 的位置
+        window = self.embed_max_seq_length - 2
+        # 重叠不超过半个窗口，否则分块数会随重叠急剧膨胀
+        stride = max(1, window - min(self.embed_chunk_overlap, window // 2))
+        max_chunks = self.embed_first_k if self.embed_agg_strategy == "first_k" else None
+
+        encoded = self.embed_model.tokenizer(
+            texts,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            truncation=False,
+        )
+        chunks, lengths, chunk_offsets = split_windows(
+            texts, encoded["offset_mapping"], window, stride, max_chunks
+        )
+        logging.info(f"split {len(texts)} texts into {len(chunks)} chunks")
+
+        chunk_embeddings = encode_length_sorted(chunks, lengths, self._encode_batch)
+        return pool_chunks(chunk_embeddings, chunk_offsets, self.embed_agg_strategy)
+
+    def _encode_batch(self, texts):
+        return self.embed_engine.encode(texts)
+
+    @profiled("umap", items=lambda self, embeddings, *args, **kwargs: len(embeddings))
+    def project(self, embeddings, faiss_index=None):
+        """umap 降维，返回 (投影, mapper)
+
+        设置了 umap_pca_components 或点数超过 umap_landmarks 时用 LandmarkProjector：先做 PCA，
+        再在 landmark（点数不超过 umap_landmarks 时为全部点）上拟合，其余点分批 transform；
+        否则在全部原始向量上拟合，并复用 faiss 索引（默认 self.faiss_index）检索的近邻图。
+        """
+        # umap 依赖 numba，导入耗时较长，只在降维时导入
+        from umap import UMAP
+
+        from projection import LandmarkProjector, faiss_knn, fit_umap
+
+        umap_mapper = UMAP(
+            n_components=self.umap_components,
+            metric=self.umap_metric,
+            low_memory=True,
+            n_neighbors=10,
+            min_dist=0.1,
+            random_state=42,
+        )
+        faiss_index = faiss_index if faiss_index is not None else self.faiss_index
         try:
-            umap_mapper = UMAP(
-                n_components=self.umap_components,
-                metric=self.umap_metric,
-                low_memory=True,
-                n_neighbors=10,
-                min_dist=0.1,
-                random_state=42,
-            )
-            projections = umap_mapper.fit_transform(embeddings)
+            sampled = self.umap_landmarks is not None and self.umap_landmarks < len(embeddings)
+            if sampled or self.umap_pca_components:
+                projector = LandmarkProjector(
+                    umap_mapper,
+                    pca_components=self.umap_pca_components,
+                    n_landmarks=self.umap_landmarks,
+                    n_strata=self.umap_strata,
+                    batch_size=self.umap_transform_batch_size,
+                    n_jobs=self.umap_n_jobs,
+                )
+                return projector.fit_transform(embeddings), projector
+
+            knn = None
+            # 索引按余弦（归一化向量的内积 / L2）检索，与 umap 的 cosine 度量一致时才复用
+            if (
+                faiss_index is not None
+                and self.umap_metric == "cosine"
+                and faiss_index.ntotal == len(embeddings)
+            ):
+                logging.info("reusing faiss index for the umap knn graph...")
+                knn = faiss_knn(faiss_index, embeddings, umap_mapper.n_neighbors)
+            projections = fit_umap(umap_mapper, embeddings, knn)
             return projections, umap_mapper
         except Exception as e:
             logging.error(f"UMAP projection failed: {str(e)}")
             raise
 
-    def cluster(self, embeddings):
+    def evaluate_projection(self, k=10, n_samples=1000, full_fit=False):
+        """评估当前投影的 trustworthiness 和近邻保持率，原始空间的近邻用已建好的 faiss 索引检索
+
+        full_fit=True 时另做一次完整拟合，报告 landmark 投影相对完整拟合的质量差异。
+        """
+        from projection import compare_projections, projection_quality
+
+        if not full_fit:
+            report = projection_quality(
+                self.embeddings, self.projections, k, n_samples, index=self.faiss_index
+            )
+        else:
+            landmarks, self.umap_landmarks = self.umap_landmarks, None
+            try:
+                reference, _ = self.project(self.embeddings)
+            finally:
+                self.umap_landmarks = landmarks
+            report = compare_projections(
+                self.embeddings,
+                self.projections,
+                reference,
+                k,
+                n_samples,
+                index=self.faiss_index,
+            )
+        logging.info(f"projection quality: {report}")
+        return report
+
+    @profiled("cluster", items=lambda self, embeddings, *args, **kwargs: len(embeddings))
+    def cluster_space(self, embeddings, projections):
+        """cluster 的输入：knn_graph 在原始 embedding 上建图，其余方法在投影上聚类"""
+        return embeddings if self.cluster_method == "knn_graph" else projections
+
+    def cluster(self, embeddings, sample_weight=None):
+        """对传入的向量聚类（用 cluster_space 选择原始 embedding 还是投影）
+
+        - dbscan: sklearn DBSCAN
+        - knn_graph: 在 embeddings 上构建稀疏 k 近邻图（只保留余弦距离不超过 cluster_graph_eps
+          的边），再在图上执行 DBSCAN，内存 O(N·k)；embeddings 就是 self.embeddings 时复用已建好的
+          faiss 索引，否则（如合并重复后的代表）按同样的设置在 embeddings 上新建索引
+        - hdbscan: sklearn HDBSCAN，min_cluster_size 取 dbscan_min_samples
+
+        sample_weight 为合并重复后每个代表的组大小，计入核心点的邻域点数（hdbscan 不支持权重，
+        每个代表按一个点计算并给出警告）。
+        """
+        if self.cluster_method == "knn_graph":
+            print(
+                f"Using kNN graph DBSCAN (k, eps, min_samples)=({self.cluster_graph_k}, "
+                f"{self.cluster_graph_eps}, {self.dbscan_min_samples})"
+            )
+            index = self.faiss_index
+            if index is None or embeddings is not self.embeddings or index.ntotal != len(embeddings):
+                index = self.build_faiss_index(embeddings)
+            graph = knn_radius_graph(
+                index,
+                embeddings,
+                k=self.cluster_graph_k,
+                eps=self.cluster_graph_eps,
+            )
+            return graph_dbscan(graph, self.dbscan_min_samples, sample_weight=sample_weight)
+
+        if self.cluster_method == "hdbscan":
+            from sklearn.cluster import HDBSCAN
+
+            if sample_weight is not None:
+                logging.warning(
+                    "HDBSCAN does not support sample weights, "
+                    "each group of duplicates counts as a single point"
+                )
+            print(f"Using HDBSCAN (min_cluster_size)=({self.dbscan_min_samples})")
+            clustering = HDBSCAN(
+                min_cluster_size=self.dbscan_min_samples,
+                n_jobs=self.dbscan_n_jobs,
+            ).fit(embeddings)
+            return clustering.labels_
+
+        from sklearn.cluster import DBSCAN
+
         print(
             f"Using DBSCAN (eps, nim_samples)=({self.dbscan_eps,}, {self.dbscan_min_samples})"
         )
@@ -188,94 +657,267 @@ class ClusterClassifier:
             eps=self.dbscan_eps,
             min_samples=self.dbscan_min_samples,
             n_jobs=self.dbscan_n_jobs,
-        ).fit(embeddings)
+        ).fit(embeddings, sample_weight=sample_weight)
 
         return clustering.labels_
 
+    @profiled("dbscan_sweep")
+    def sweep(self, eps_values, min_samples_values, n_jobs=None, silhouette_sample=None):
+        """在当前投影上评估一组 DBSCAN 参数 (eps, min_samples)
+
+        近邻只按最大的 eps 检索一次，各组参数在同一张图上截取，结果与 cluster 方法 dbscan 一致。
+        合并过重复时只用代表，组大小作为权重。返回每组参数的簇数、噪声比例，
+        指定 silhouette_sample 时还有抽样计算的 silhouette。
+        """
+        projections, weights = self.projections, None
+        if self.duplicates is not None:
+            projections = projections[self.duplicates.representatives]
+            weights = self.duplicates.weights
+        results = dbscan_sweep(
+            projections,
+            eps_values,
+            min_samples_values,
+            sample_weight=weights,
+            n_jobs=n_jobs or self.dbscan_n_jobs,
+            silhouette_sample=silhouette_sample,
+        )
+        for r in results:
+            silhouette = f", silhouette {r['silhouette']:.3f}" if "silhouette" in r else ""
+            logging.info(
+                f"dbscan (eps={r['eps']}, min_samples={r['min_samples']}): "
+                f"{r['n_clusters']} clusters, noise {r['noise_fraction']:.3f}{silhouette}"
+            )
+        return results
+
+    @profiled("faiss_build", items=lambda self, embeddings: len(embeddings))
     def build_faiss_index(self, embeddings):
-        index = faiss.IndexFlatL2(embeddings.shape[1])
-        index.add(embeddings)
-        return index
+        return build_index(
+            embeddings,
+            index_type=self.index_type,
+            metric=self.index_metric,
+            nlist=self.index_nlist,
+            nprobe=self.index_nprobe,
+            hnsw_m=self.index_hnsw_m,
+            ef_search=self.index_ef_search,
+            pq_m=self.index_pq_m,
+            train_size=self.index_train_size,
+        )
 
-    def summarize(self, texts, labels):
-        unique_labels = len(set(labels)) - 1  # exclude the "-1" label
-        client = OpenAI(
-            api_key=self.summary_model_token, base_url=self.summary_model_base
+    def evaluate_index(self, k=10, n_queries=1000):
+        """与精确检索对比，报告当前索引的 recall@k、单次检索耗时和内存占用"""
+        report = recall_at_k(self.faiss_index, self.embeddings, k=k, n_queries=n_queries)
+        logging.info(
+            f"{self.index_type} index recall@{report['k']}: {report['recall']:.4f}, "
+            f"{report['latency_ms']:.3f} ms/query (exact {report['exact_latency_ms']:.3f} ms)"
         )
+        return report
+
+    @profiled("summarize")
+    def summarize(self, texts, labels):
+        from summarizer import ClusterSummarizer, SummaryCache
+
+        # exclude the "-1" label
+        unique_labels = [label for label in np.unique(labels).tolist() if label != -1]
         cluster_summaries = {-1: "None"}
 
-        for label in range(unique_labels):
-            num = len(self.label2docs[label])
-            ids = np.random.choice(
-                self.label2docs[label], min(self.summary_n_examples, num), replace=False
-            )
+        cache = None
+        if self.summary_cache_path is not None:
+            cache = SummaryCache(self.summary_cache_path, self.summary_reuse_threshold)
+        scope = SummaryCache.scope(self.summary_model, self.summary_instruction)
+
+        prompts, nums, cache_keys, cached = {}, {}, {}, {}
+        for label in unique_labels:
+            num = self._cluster_size(label)
+            ids = self._select_examples(label)
             examples = "\n\n".join(
                 [
                     f"Example {i+1}:\n{texts[_id][:self.summary_chunk_size]}"
                     for i, _id in enumerate(ids)
                 ]
             )
+            nums[label] = num
 
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that summarizes text clusters.",
-                },
-                {
-                    "role": "user",
-                    "content": f"{examples}\n\n{self.summary_instruction}",
-                },
-            ]
-
-            try:
-                response = client.chat.completions.create(
-                    model=self.summary_model,
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=128,
+            if cache is not None:
+                key = SummaryCache.make_key(
+                    scope, [text_hash(texts[_id][: self.summary_chunk_size]) for _id in ids]
                 )
-                print(f"Example request:\n{examples}\n{self.summary_instruction}")
+                members = [text_hash(texts[doc]) for doc in self.label2docs[label]]
+                cache_keys[label] = (key, members)
+                summary = cache.get(key, scope, members)
+                if summary is not None:
+                    cached[label] = summary
+                    continue
+
+            prompts[label] = f"{examples}\n\n{self.summary_instruction}"
+
+        if cache is not None:
+            logging.info(
+                f"summary cache hits: {len(unique_labels) - len(prompts)}/{len(unique_labels)}"
+            )
+
+        def on_result(label, summary):
+            if cache is not None and summary is not None:
+                key, members = cache_keys[label]
+                cache.put(key, scope, members, summary)
+
+        summarizer = ClusterSummarizer(
+            model=self.summary_model,
+            base_url=self.summary_model_base,
+            api_key=self.summary_model_token,
+            concurrency=self.summary_concurrency,
+            requests_per_minute=self.summary_requests_per_minute,
+            tokens_per_minute=self.summary_tokens_per_minute,
+            max_retries=self.summary_max_retries,
+            timeout=self.summary_timeout,
+        )
+        try:
+            responses = summarizer.summarize(prompts, on_result=on_result)
+        finally:
+            if cache is not None:
+                cache.save()
+
+        responses.update(cached)
+        self.summary_failures = [label for label in unique_labels if responses.get(label) is None]
+        if self.summary_failures:
+            logging.warning(f"summaries failed for {len(self.summary_failures)} clusters")
+        for label in unique_labels:
+            if responses.get(label) is None:
+                cluster_summaries[label] = {
+                    "cluster": f"Cluster {label}",
+                    "nums": nums[label],
+                }
+            else:
                 cluster_summaries[label] = {
-                    "cluster": response.choices[0].message.content,
-                    "nums": num,
+                    "cluster": responses[label],
+                    "nums": nums[label],
                 }
-            except Exception as e:
-                logging.error(f"Error summarizing cluster {label}: {str(e)}")
-                cluster_summaries[label] = {"cluster": f"Cluster {label}", "nums": num}
 
         print(f"Number of clusters is {len(cluster_summaries)}")
         return cluster_summaries
 
+    def _select_examples(self, label):
+        """确定性地选择示例：取embedding空间中离簇中心最近的文档"""
+        docs = np.asarray(self.label2docs[label])
+        if self.duplicates is not None:
+            # 同一组重复只取代表，避免示例里出现重复内容
+            docs = docs[self.duplicates.representatives[self.duplicates.inverse[docs]] == docs]
+        n = min(self.summary_n_examples, len(docs))
+        embeddings = self.embeddings[docs]
+        centroid = embeddings.mean(axis=0)
+        scores = embeddings @ centroid
+        return docs[np.argsort(-scores, kind="stable")[:n]]
+
     def _postprocess_response(self, response):
         """No longer needed with OpenAI API"""
         return response
 
+    @profiled("save_model")
     def save(self, folder):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
-        with open(f"{folder}/embeddings.npy", "wb") as f:
-            np.save(f, self.embeddings)
-
-        faiss.write_index(self.faiss_index, f"{folder}/faiss.index")
-
-        with open(f"{folder}/projections.npy", "wb") as f:
-            np.save(f, self.projections)
-
-        with open(f"{folder}/cluster_labels.npy", "wb") as f:
-            np.save(f, self.cluster_labels)
-
-        with open(f"{folder}/texts.json", "w") as f:
-            json.dump(self.texts, f)
+        save_array(folder, "embeddings", self.embeddings)
+        # 索引可能是从同一个文件映射加载的，同样先写临时文件再替换
+        faiss.write_index(self.faiss_index, f"{folder}/faiss.index.tmp")
+        os.replace(f"{folder}/faiss.index.tmp", f"{folder}/faiss.index")
+        save_array(folder, "projections", self.projections)
+        save_array(folder, "cluster_labels", self.cluster_labels)
+        if self.duplicates is not None:
+            save_array(folder, "duplicates", self.duplicates.inverse)
+        elif os.path.exists(f"{folder}/duplicates.npy"):
+            # 目录里可能是之前保存的去重模型，load 会读到与当前文本不匹配的分组
+            os.remove(f"{folder}/duplicates.npy")
+        write_texts(folder, self.texts)
+
+        # 预先计算好 CSR 形式的 类别 -> 文档id，加载时不需要再遍历
+        self.membership.save(folder)
+
+        mapper_path = f"{folder}/umap_mapper.pkl"
+        if self._umap_mapper is not None:
+            with open(f"{mapper_path}.tmp", "wb") as f:
+                pickle.dump(self._umap_mapper, f)
+            os.replace(f"{mapper_path}.tmp", mapper_path)
+        elif self._umap_mapper_path is not None and not (
+            os.path.exists(mapper_path) and os.path.samefile(self._umap_mapper_path, mapper_path)
+        ):
+            # 还没读取的 mapper 直接复制文件，不需要反序列化
+            shutil.copyfile(self._umap_mapper_path, f"{mapper_path}.tmp")
+            os.replace(f"{mapper_path}.tmp", mapper_path)
 
         if self.cluster_summaries is not None:
             with open(f"{folder}/cluster_summaries.json", "w") as f:
                 json.dump(self.cluster_summaries, f)
 
+        write_meta(
+            folder,
+            n_docs=len(self.texts),
+            embed_model_name=self.embed_model_name,
+            embed_max_seq_length=self.embed_max_seq_length,
+            embed_agg_strategy=self.embed_agg_strategy,
+            embed_chunk_overlap=self.embed_chunk_overlap,
+            embed_first_k=self.embed_first_k,
+            embed_backend=self.embed_backend,
+            embed_onnx_file_name=self.embed_onnx_file_name,
+            umap_components=self.umap_components,
+            index_type=self.index_type,
+            index_metric=self.index_metric,
+            index_nprobe=self.index_nprobe,
+            index_ef_search=self.index_ef_search,
+        )
+
+    @profiled("load_model")
     def load(self, folder):
         if not os.path.exists(folder):
             raise ValueError(f"The folder '{folder}' does not exsit.")
 
+        meta = read_meta(folder)
+        if meta is None:
+            self._load_legacy(folder)
+        else:
+            # 大数组都以只读内存映射方式打开，多个进程共享同一份页缓存
+            self.embeddings = load_array(folder, "embeddings")
+            self.projections = load_array(folder, "projections")
+            self.cluster_labels = load_array(folder, "cluster_labels")
+            self.texts = TextStore(folder)
+            self.faiss_index = self._read_faiss_index(f"{folder}/faiss.index", mmap=True)
+
+            self.membership = ClusterMembership.load(folder)
+            self._set_cluster_index()
+            self.duplicates = None
+            if os.path.exists(f"{folder}/duplicates.npy"):
+                self.duplicates = Duplicates(load_array(folder, "duplicates"))
+
+            # mapper 的 pickle 包含训练数据和近邻图，比 embeddings 还大，检索服务用不到，
+            # 这里只记下路径
+            self.umap_mapper = None
+            if os.path.exists(f"{folder}/umap_mapper.pkl"):
+                self._umap_mapper_path = f"{folder}/umap_mapper.pkl"
+
+        set_search_params(
+            self.faiss_index, nprobe=self.index_nprobe, ef_search=self.index_ef_search
+        )
+
+        if os.path.exists(f"{folder}/cluster_summaries.json"):
+            with open(f"{folder}/cluster_summaries.json", "r") as f:
+                self.cluster_summaries = json.load(f)
+                keys = list(self.cluster_summaries.keys())
+                for key in keys:
+                    self.cluster_summaries[int(key)] = self.cluster_summaries.pop(key)
+
+    def _read_faiss_index(self, path, mmap=False):
+        # IVF 等索引的倒排表可以直接映射（只读），不支持映射的索引类型退回普通读取
+        self._faiss_index_path = path if mmap else None
+        if mmap:
+            try:
+                return faiss.read_index(
+                    path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                )
+            except RuntimeError:
+                self._faiss_index_path = None
+        return faiss.read_index(path)
+
+    def _load_legacy(self, folder):
+        """读取 texts.json 格式的旧模型目录"""
         with open(f"{folder}/embeddings.npy", "rb") as f:
             self.embeddings = np.load(f)
 
@@ -290,116 +932,108 @@ class ClusterClassifier:
         with open(f"{folder}/texts.json", "r") as f:
             self.texts = json.load(f)
 
-        if os.path.exists(f"{folder}/cluster_summaries.json"):
-            with open(f"{folder}/cluster_summaries.json", "r") as f:
-                self.cluster_summaries = json.load(f)
-                keys = list(self.cluster_summaries.keys())
-                for key in keys:
-                    self.cluster_summaries[int(key)] = self.cluster_summaries.pop(key)
-
         # those objects can be inferred and don't need to be saved/loaded
-        self.id2cluster = {
-            index: label for index, label in enumerate(self.cluster_labels)
-        }
-        self.label2docs = defaultdict(list)
-        for i, label in enumerate(self.cluster_labels):
-            self.label2docs[label].append(i)
-
-        self.cluster_centers = {}
-        for label in self.label2docs.keys():
-            x = np.mean([self.projections[doc, 0] for doc in self.label2docs[label]])
-            y = np.mean([self.projections[doc, 1] for doc in self.label2docs[label]])
-            self.cluster_centers[label] = (x, y)
-
-    def show(self, interactive=False):
-        df = pd.DataFrame(
-            data={
-                "X": self.projections[:, 0],
-                "Y": self.projections[:, 1],
-                "labels": self.cluster_labels,
-                "content_display": [
-                    textwrap.fill(txt[:1024], 64) for txt in self.texts
-                ],
-            }
+        self._build_cluster_index()
+
+    def show(self, interactive=False, bins=1024, max_points=20000):
+        """绘制投影
+
+        底图为按簇分箱的密度图，分辨率由 bins 决定；plotly 的交互点只取不超过 max_points 的
+        LOD 样本，悬停文本也只为样本生成。绘制耗时和输出大小与数据量无关。
+        """
+        from rendering import cluster_histograms, data_extent, render_density
+
+        extent = data_extent(self.projections)
+        hist, label_ids = cluster_histograms(
+            self.projections, self.cluster_labels, extent, bins
         )
+        image = render_density(hist, label_ids, bins)
 
         if interactive:
-            self._show_plotly(df)
+            self._show_plotly(image, extent, max_points)
         else:
-            self._show_mpl(df)
+            self._show_mpl(image, extent)
 
-    def _show_mpl(self, df):
-        fig, ax = plt.subplots(figsize=(12, 8), dpi=300)
+    def _summary_labels(self):
+        if self.cluster_summaries is None:
+            return []
+        return [
+            (self.cluster_centers[label], s["cluster"] if isinstance(s, dict) else s)
+            for label, s in self.cluster_summaries.items()
+            if label != -1
+        ]
 
-        df["color"] = df["labels"].apply(lambda x: "C0" if x == -1 else f"C{(x%9)+1}")
-
-        df.plot(
-            kind="scatter",
-            x="X",
-            y="Y",
-            color=df["color"],
-            s=0.75,
-            alpha=0.8,
-            linewidth=0,
-            ax=ax,
-            colorbar=False,
-        )
+    def _show_mpl(self, image, extent):
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots(figsize=(12, 8), dpi=300)
+        ax.imshow(image, extent=extent, origin="upper", aspect="auto", interpolation="nearest")
 
         # Only show summaries if they exist
-        if self.cluster_summaries is not None:
-            for label in self.cluster_summaries.keys():
-                if label == -1:
-                    continue
-                summary = self.cluster_summaries[label]
-                position = self.cluster_centers[label]
-                t = ax.text(
-                    position[0],
-                    position[1],
-                    summary,
-                    horizontalalignment="center",
-                    verticalalignment="center",
-                    fontsize=4,
-                )
-                t.set_bbox(
-                    dict(
-                        facecolor="white",
-                        alpha=0.9,
-                        linewidth=0,
-                        boxstyle="square,pad=0.1",
-                    )
+        for position, summary in self._summary_labels():
+            t = ax.text(
+                position[0],
+                position[1],
+                summary,
+                horizontalalignment="center",
+                verticalalignment="center",
+                fontsize=4,
+            )
+            t.set_bbox(
+                dict(
+                    facecolor="white",
+                    alpha=0.9,
+                    linewidth=0,
+                    boxstyle="square,pad=0.1",
                 )
+            )
         ax.set_axis_off()
 
-    def _show_plotly(self, df):
-        fig = px.scatter(
-            df,
-            x="X",
-            y="Y",
-            color="labels",
-            hover_data={"content_display": True, "X": False, "Y": False},
-            width=1600,
-            height=800,
-            color_continuous_scale="HSV",
-        )
-
-        fig.update_traces(hovertemplate="%{customdata[0]}<extra></extra>")
-
-        fig.update_traces(
-            marker=dict(size=1, opacity=0.8),  # color="white"
-            selector=dict(mode="markers"),
+    def _show_plotly(self, image, extent, max_points):
+        import plotly.graph_objects as go
+        from PIL import Image
+
+        from rendering import label_color, lod_sample
+
+        xmin, xmax, ymin, ymax = extent
+        sample = lod_sample(self.projections, max_points, extent)
+        labels = np.asarray(self.cluster_labels)[sample]
+
+        fig = go.Figure(
+            go.Scattergl(
+                x=self.projections[sample, 0],
+                y=self.projections[sample, 1],
+                mode="markers",
+                marker=dict(
+                    size=2,
+                    opacity=0.8,
+                    color=[label_color(label) for label in labels.tolist()],
+                ),
+                customdata=sample,
+                hovertext=[
+                    textwrap.fill(self.texts[i][:1024], 64).replace("\n", "<br>")
+                    for i in sample.tolist()
+                ],
+                hovertemplate="%{hovertext}<extra>%{customdata}</extra>",
+            )
         )
-
-        fig.update_layout(
-            template="plotly_dark",
+        fig.add_layout_image(
+            source=Image.fromarray(image, "RGBA"),
+            xref="x",
+            yref="y",
+            x=xmin,
+            y=ymax,
+            sizex=xmax - xmin,
+            sizey=ymax - ymin,
+            sizing="stretch",
+            layer="below",
         )
+        fig.update_xaxes(range=[xmin, xmax], visible=False)
+        fig.update_yaxes(range=[ymin, ymax], visible=False)
+        fig.update_layout(template="plotly_dark", width=1600, height=800)
 
         # show cluster summaries
-        for label in self.cluster_summaries.keys():
-            if label == -1:
-                continue
-            summary = self.cluster_summaries[label]
-            position = self.cluster_centers[label]
-
+        for position, summary in self._summary_labels():
             fig.add_annotation(
                 x=position[0],
                 y=position[1],
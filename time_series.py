@@ -0,0 +1,207 @@
+"""
+Description: 按时区汇总的 token / 对话轮次 / 时长时间序列
+
+以本地日为最小粒度累积：每次 append 只对新数据做一次向量化的分组求和，再与已有的日汇总相加，
+周、月序列和滑动平均都由日汇总重采样得到，不需要回看历史明细。每段对话按 (uuid, updated_at)
+记录它对汇总的贡献：重复追加同一版本不会重复计数，对话续聊后（updated_at 变化）先减去旧的贡献
+再加上新的。从导出中删除的对话不会被扣除。
+
+对话数、轮次和时长计入对话开始的时间；token 按消息级的表计入每条消息的时间，跨天的对话
+分摊到各天。没有消息级数据时整段对话的 token 都计入开始的时间。
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+METRICS = [
+    "conversations",
+    "input_tokens",
+    "output_tokens",
+    "total_tokens",
+    "dialogue_turns",
+    "duration_seconds",
+]
+HEATMAP_METRICS = ["conversations", "total_tokens"]
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class TimeSeriesRollup:
+    def __init__(self, tz="UTC"):
+        self.tz = tz
+        self.daily = pd.DataFrame(
+            columns=METRICS, index=pd.DatetimeIndex([], name="day"), dtype="float64"
+        )
+        # (指标, 星期, 小时)
+        self.heatmap = np.zeros((len(HEATMAP_METRICS), 7, 24), dtype=np.float64)
+        # 每段对话的贡献，按 uuid 索引，每个（本地日，热力图格子）一行：版本（end_time）和各项指标
+        self.conversations = pd.DataFrame(
+            {
+                "updated_at": pd.Series(dtype="datetime64[ns, UTC]"),
+                "day": pd.Series(dtype="datetime64[ns]"),
+                "cell": pd.Series(dtype="int64"),
+                **{metric: pd.Series(dtype="float64") for metric in METRICS},
+            },
+            index=pd.Index([], name="uuid", dtype="object"),
+        )
+
+    def append(self, df, messages=None):
+        """追加对话级数据（ChatAnalyzer.df 的格式），返回 self 以便链式调用
+
+        messages 为消息级的 token 表（ChatAnalyzer.activity：uuid / created_at / input_tokens /
+        output_tokens），为 None 时使用 df 中整段对话的 token 数
+        """
+        # 同一批里重复的对话只保留最新的版本
+        df = df.assign(updated_at=pd.to_datetime(df["end_time"], utc=True))
+        df = df.sort_values("updated_at", kind="stable").drop_duplicates("uuid", keep="last")
+        versions = self.conversations["updated_at"]
+        versions = versions[~versions.index.duplicated()]
+        previous = versions.reindex(df["uuid"]).to_numpy()
+        df = df[previous != df["updated_at"].to_numpy()]
+        if df.empty:
+            return self
+
+        rows = self._contributions(
+            df["uuid"],
+            df["start_time"],
+            df["updated_at"],
+            conversations=1.0,
+            dialogue_turns=df["dialogue_turns"],
+            duration_seconds=df["duration"],
+            input_tokens=df["input_tokens"] if messages is None else 0.0,
+            output_tokens=df["output_tokens"] if messages is None else 0.0,
+        )
+        if messages is not None:
+            messages = messages[messages["uuid"].isin(df["uuid"])]
+            updated_at = df.set_index("uuid")["updated_at"].reindex(messages["uuid"])
+            rows = pd.concat(
+                [
+                    rows,
+                    self._contributions(
+                        messages["uuid"],
+                        messages["created_at"],
+                        updated_at,
+                        input_tokens=messages["input_tokens"],
+                        output_tokens=messages["output_tokens"],
+                    ),
+                ]
+            )
+            # 同一段对话落在同一格子里的消息合并成一行
+            rows = (
+                rows.groupby(["uuid", "day", "cell"], sort=False)
+                .agg({"updated_at": "first", **{metric: "sum" for metric in METRICS}})
+                .reset_index(["day", "cell"])[rows.columns]
+            )
+
+        # 续聊的对话先减去上一版本的贡献
+        continued = self.conversations.index.isin(df["uuid"])
+        if continued.any():
+            self._accumulate(self.conversations[continued], -1.0)
+            self.conversations = self.conversations[~continued]
+        self._accumulate(rows, 1.0)
+        if self.conversations.empty:
+            self.conversations = rows
+        else:
+            self.conversations = pd.concat([self.conversations, rows])
+        return self
+
+    def _contributions(self, uuid, time, updated_at, **metrics):
+        """每个时间点对汇总的贡献，没有给出的指标为 0"""
+        local = pd.to_datetime(time, utc=True).dt.tz_convert(self.tz)
+        rows = pd.DataFrame(
+            {
+                "updated_at": pd.DatetimeIndex(updated_at),
+                # 本地零点，去掉时区后作为日索引，夏令时切换日也按当地日期归组
+                "day": local.dt.normalize().dt.tz_localize(None).to_numpy(),
+                "cell": (local.dt.weekday * 24 + local.dt.hour).to_numpy(dtype=np.int64),
+                **{
+                    metric: np.broadcast_to(
+                        np.asarray(metrics.get(metric, 0.0), dtype=np.float64), len(local)
+                    )
+                    for metric in METRICS
+                },
+            },
+            index=pd.Index(np.asarray(uuid), name="uuid"),
+        )
+        rows["total_tokens"] = rows["input_tokens"] + rows["output_tokens"]
+        return rows
+
+    def _accumulate(self, rows, sign):
+        new_daily = rows[METRICS].groupby(rows["day"].rename("day")).sum() * sign
+        daily = new_daily.add(self.daily, fill_value=0).sort_index()
+        # 对话和 token 都移走的日期不再保留，避免序列两端多出全 0 的日期；两者都是整数，加减没有误差
+        self.daily = daily[(daily["conversations"] != 0) | (daily["total_tokens"] != 0)]
+
+        cell = rows["cell"].to_numpy()
+        for i, metric in enumerate(HEATMAP_METRICS):
+            weights = rows[metric].to_numpy() * sign
+            self.heatmap[i] += np.bincount(cell, weights=weights, minlength=7 * 24).reshape(7, 24)
+
+    def series(self, freq="D"):
+        """D / W / M 粒度的序列，没有数据的日期补 0；周从周一开始，月以月初为标签"""
+        if self.daily.empty:
+            return self.daily.copy()
+        daily = self.daily.asfreq("D", fill_value=0)
+        if freq == "D":
+            return daily
+        if freq == "W":
+            return daily.resample("W-MON", label="left", closed="left").sum()
+        if freq == "M":
+            return daily.resample("MS").sum()
+        raise ValueError(f"Unknown frequency '{freq}', use 'D', 'W' or 'M'.")
+
+    def rolling(self, window=7, freq="D"):
+        """按 freq 粒度的滑动平均，开头不足一个窗口时按已有数据平均"""
+        return self.series(freq).rolling(window, min_periods=1).mean()
+
+    def hour_weekday_heatmap(self, metric="conversations"):
+        data = self.heatmap[HEATMAP_METRICS.index(metric)]
+        return pd.DataFrame(data, index=pd.Index(WEEKDAYS, name="weekday"), columns=range(24))
+
+    def to_dict(self, rolling_window=7):
+        """看板使用的 JSON 结构"""
+
+        def records(frame):
+            frame = frame.reset_index()
+            frame[frame.columns[0]] = frame[frame.columns[0]].dt.strftime("%Y-%m-%d")
+            return json.loads(frame.to_json(orient="records"))
+
+        return {
+            "timezone": self.tz,
+            "daily": records(self.series("D")),
+            "weekly": records(self.series("W")),
+            "monthly": records(self.series("M")),
+            f"rolling_{rolling_window}d": records(self.rolling(rolling_window)),
+            "heatmap": {
+                metric: self.hour_weekday_heatmap(metric).to_numpy().tolist()
+                for metric in HEATMAP_METRICS
+            },
+        }
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.daily.to_parquet(os.path.join(folder, "daily.parquet"))
+        np.save(os.path.join(folder, "heatmap.npy"), self.heatmap)
+        self.conversations.to_parquet(os.path.join(folder, "conversations.parquet"))
+        with open(os.path.join(folder, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"tz": self.tz, "metrics": METRICS}, f)
+
+    @classmethod
+    def load(cls, folder, tz="UTC"):
+        """读取已保存的汇总；不存在、缺少对话贡献或时区不同（日边界不同，无法复用）时返回空汇总"""
+        meta_path = os.path.join(folder, "meta.json")
+        conversations_path = os.path.join(folder, "conversations.parquet")
+        if not os.path.exists(meta_path) or not os.path.exists(conversations_path):
+            return cls(tz)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["tz"] != tz or meta["metrics"] != METRICS:
+            return cls(tz)
+
+        rollup = cls(tz)
+        rollup.daily = pd.read_parquet(os.path.join(folder, "daily.parquet"))
+        rollup.heatmap = np.load(os.path.join(folder, "heatmap.npy"))
+        rollup.conversations = pd.read_parquet(conversations_path)
+        return rollup
@@ -0,0 +1,162 @@
+"""
+Description: 批量统计token数量，复用同一个编码器，并在磁盘上缓存已统计过的文本
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils import get_encoding, text_hash
+
+_worker_encoding = None
+
+
+def _init_worker(encoding):
+    global _worker_encoding
+    _worker_encoding = get_encoding(encoding) if isinstance(encoding, str) else encoding
+
+
+def _count_texts(encoding, texts):
+    return [len(encoding.encode_ordinary(text)) for text in texts]
+
+
+def _count_in_worker(texts):
+    return _count_texts(_worker_encoding, texts)
+
+
+class TokenCounter:
+    """批量token计数器
+
+    - 编码器只创建一次，文本按批分发给常驻的线程池或进程池
+    - tiktoken 编码时会释放GIL，因此线程池即可利用多核；"process" 适合文本极多的场景
+    - 指定 cache_path 后按文本内容哈希缓存token数，重复运行时跳过已经统计过的文本
+    """
+
+    def __init__(
+        self,
+        encoding="o200k_base",
+        num_workers=None,
+        executor="thread",
+        batch_size=1024,
+        cache_path=None,
+    ):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor '{executor}', use 'thread' or 'process'.")
+        self.encoding = encoding
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.executor = executor
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+
+        self._encoder = None
+        self._pool = None
+        self._cache = self._load_cache() if cache_path else None
+        self._cache_dirty = False
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = (
+                get_encoding(self.encoding)
+                if isinstance(self.encoding, str)
+                else self.encoding
+            )
+        return self._encoder
+
+    @property
+    def encoding_name(self):
+        return self.encoding if isinstance(self.encoding, str) else self.encoding.name
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts) -> list:
+        """返回每条文本的token数量"""
+        texts = list(texts)
+        if self._cache is None:
+            return self._count_uncached(texts)
+
+        keys = [text_hash(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._cache and key not in missing:
+                missing[key] = text
+
+        if missing:
+            counts = self._count_uncached(list(missing.values()))
+            self._cache.update(zip(missing.keys(), counts))
+            self._cache_dirty = True
+        logging.debug(f"token cache hits: {len(texts) - len(missing)}/{len(texts)}")
+
+        return [self._cache[key] for key in keys]
+
+    def _count_uncached(self, texts):
+        batches = [
+            texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        ]
+        if len(batches) <= 1 or self.num_workers == 1:
+            return _count_texts(self.encoder, texts)
+
+        if self.executor == "process":
+            results = self._get_pool().map(_count_in_worker, batches)
+        else:
+            encoder = self.encoder
+            results = self._get_pool().map(
+                lambda batch: _count_texts(encoder, batch), batches
+            )
+
+        counts = []
+        for batch_counts in results:
+            counts.extend(batch_counts)
+        return counts
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.executor == "process":
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    # 父进程里可能已有线程，fork 有死锁风险
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.encoding,),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.num_workers)
+        return self._pool
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        with open(self.cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("encoding") != self.encoding_name:
+            logging.info(f"ignoring token cache built with '{data.get('encoding')}'")
+            return {}
+        return data["counts"]
+
+    def save_cache(self):
+        """把缓存写回磁盘（先写临时文件再替换，避免中断时损坏缓存）"""
+        if self._cache is None or not self._cache_dirty:
+            return
+        folder = os.path.dirname(self.cache_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"encoding": self.encoding_name, "counts": self._cache}, f)
+        os.replace(tmp_path, self.cache_path)
+        self._cache_dirty = False
+
+    def close(self):
+        self.save_cache()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
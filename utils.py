@@ -5,8 +5,14 @@ FilePath: /ClaudeAnnualAnalysis/utils.py
 Description: 
 """
 
-import tiktoken
+import functools
+import hashlib
 import json
+import os
+
+import tiktoken
+
+_JSON_WHITESPACE = " \t\n\r"
 
 
 def load_chat_data(file_path):
@@ -15,11 +21,108 @@ def load_chat_data(file_path):
         return json.load(f)
 
 
+def iter_chat_data(file_path, chunk_size=1 << 20):
+    """逐条读取聊天数据文件中的对话，峰值内存只取决于最大的单个对话
+
+    导出文件的顶层是一个JSON数组，这里按块读取文件，用 raw_decode
+    依次解析数组中的每个元素，并及时丢弃已经消费的缓冲区。
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        reader = _ChunkReader(f, chunk_size)
+
+        if reader.next_char() != "[":
+            raise ValueError(f"'{file_path}' is not a JSON array of conversations.")
+        reader.pos += 1
+        if reader.next_char() == "]":
+            return
+
+        while True:
+            reader.next_char()
+            try:
+                item, end = decoder.raw_decode(reader.buffer, reader.pos)
+            except json.JSONDecodeError:
+                # 当前对话还没有读完，继续读取后重试
+                if not reader.read_more(grow=True):
+                    raise
+                continue
+            reader.pos = end
+            reader.reset_read_size()
+            yield item
+
+            char = reader.next_char()
+            reader.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(
+                    f"Unexpected character {char!r} between conversations in '{file_path}'."
+                )
+
+
+class _ChunkReader:
+    """iter_chat_data 使用的滑动缓冲区"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.read_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def read_more(self, grow=False):
+        chunk = self.f.read(self.read_size)
+        if not chunk:
+            return False
+        # 丢弃已消费部分；对同一个超大对话反复失败时加倍读取量，避免重复解析
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        if grow:
+            self.read_size *= 2
+        return True
+
+    def reset_read_size(self):
+        self.read_size = self.chunk_size
+
+    def next_char(self):
+        """跳过空白字符，返回下一个有效字符"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                raise ValueError("Unexpected end of conversations file.")
+
+
+def text_digest(text: str) -> bytes:
+    """文本内容哈希，用作各类缓存的key"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def text_hash(text: str) -> str:
+    return text_digest(text).hex()
+
+
+def available_cpus():
+    """当前进程实际可用的CPU数（考虑 taskset/cgroup 的CPU亲和性）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
 def save_result(file_path, data):
     with open(file_path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(name="o200k_base"):
+    """编码器创建开销较大，每个进程只创建一次"""
+    return tiktoken.get_encoding(name)
+
+
 def tokenize(text: str) -> list:
-    encoding = tiktoken.get_encoding("o200k_base")
+    encoding = get_encoding("o200k_base")
     return encoding.encode(text, disallowed_special=())
@@ -0,0 +1,192 @@
+"""
+Description: FAISS 索引工厂，支持 flat / IVF-Flat / HNSW / IVF-PQ，以及相对精确检索的 recall@k 评估
+"""
+
+import logging
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+
+def default_nlist(n):
+    """IVF 聚类中心数：约 4*sqrt(N)，且保证每个中心至少有 39 个训练样本"""
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+
+def _pq_subquantizers(dim, pq_m):
+    # PQ 的子空间数必须整除向量维度
+    for m in range(min(pq_m, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(
+    embeddings,
+    index_type="flat",
+    metric="ip",
+    nlist=None,
+    nprobe=8,
+    hnsw_m=32,
+    ef_search=64,
+    pq_m=16,
+    pq_bits=8,
+    train_size=None,
+    seed=42,
+):
+    """构建并填充索引
+
+    embeddings 已经归一化时，内积（metric="ip"）与余弦相似度等价。
+    IVF 类索引只在随机抽取的训练样本上训练，默认样本数为 64*nlist。
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', use one of {INDEX_TYPES}.")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', use 'ip' or 'l2'.")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, dim = embeddings.shape
+    faiss_metric = METRICS[metric]
+
+    min_train = {"ivf_flat": 39, "ivf_pq": max(39, 2**pq_bits)}.get(index_type, 0)
+    if n < min_train:
+        logging.warning(
+            f"{n} vectors are too few to train a {index_type} index, using flat instead"
+        )
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlat(dim, faiss_metric)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss_metric)
+    else:
+        nlist = nlist or default_nlist(n)
+        quantizer = faiss.IndexFlat(dim, faiss_metric)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss_metric)
+        else:
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, nlist, _pq_subquantizers(dim, pq_m), pq_bits, faiss_metric
+            )
+
+        train_size = min(n, train_size or 64 * nlist)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, train_size, replace=False))
+        logging.info(f"training {index_type} index (nlist={nlist}) on {train_size} vectors...")
+        index.train(embeddings[sample])
+
+    index.add(embeddings)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """调整检索参数：IVF 的 nprobe，HNSW 的 efSearch"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW) and ef_search is not None:
+        index.hnsw.efSearch = ef_search
+
+
+def index_memory_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def recall_at_k(index, embeddings, k=10, n_queries=1000, seed=42):
+    """以精确的 flat 索引为基准，评估 index 的 recall@k、检索耗时和内存占用"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n = embeddings.shape[0]
+    rng = np.random.default_rng(seed)
+    queries = embeddings[np.sort(rng.choice(n, min(n_queries, n), replace=False))]
+    k = min(k, n)
+
+    exact = faiss.IndexFlat(embeddings.shape[1], index.metric_type)
+    exact.add(embeddings)
+
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    seconds = time.perf_counter() - start
+
+    hits = sum(
+        len(np.intersect1d(truth[i], found[i][found[i] >= 0], assume_unique=True))
+        for i in range(len(queries))
+    )
+    return {
+        "k": k,
+        "n_queries": len(queries),
+        "recall": hits / (len(queries) * k),
+        "latency_ms": 1000 * seconds / len(queries),
+        "exact_latency_ms": 1000 * exact_seconds / len(queries),
+        "memory_bytes": index_memory_bytes(index),
+        "exact_memory_bytes": index_memory_bytes(exact),
+    }
+
+
+def distance_weights(distances, metric_type, eps=1e-6):
+    """把检索距离换算成投票权重：距离越近权重越大
+
+    METRIC_INNER_PRODUCT 返回的是相似度，对归一化向量换算为欧氏距离 sqrt(2-2s)；
+    METRIC_L2 返回的是欧氏距离的平方。
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        l2 = np.sqrt(np.maximum(2.0 - 2.0 * distances, 0.0))
+    else:
+        l2 = np.sqrt(np.maximum(distances, 0.0))
+    return 1.0 / (l2 + eps)
+
+
+def knn_vote(neighbour_labels, weights=None, valid=None):
+    """对每一行近邻的类别做（加权）多数投票
+
+    平票时选在近邻列表中最先出现的类别，与 Counter.most_common 的行为一致。
+    返回 (类别, 置信度)，置信度为获胜类别的票数占该行总票数的比例；
+    没有任何有效近邻的行返回类别 -1、置信度 0。
+    """
+    neighbour_labels = np.asarray(neighbour_labels)
+    n, k = neighbour_labels.shape
+    labels = np.full(n, -1, dtype=neighbour_labels.dtype)
+    confidence = np.zeros(n, dtype=np.float64)
+    if n == 0 or k == 0:
+        return labels, confidence
+
+    if weights is None:
+        weights = np.ones((n, k), dtype=np.float64)
+    if valid is None:
+        valid = np.ones((n, k), dtype=bool)
+    valid = valid.ravel()
+
+    rows = np.repeat(np.arange(n), k)[valid]
+    positions = np.tile(np.arange(k), n)[valid]
+    flat_weights = np.asarray(weights, dtype=np.float64).ravel()[valid]
+    uniques, codes = np.unique(neighbour_labels.ravel()[valid], return_inverse=True)
+    if len(rows) == 0:
+        return labels, confidence
+
+    # 每个 (行, 类别) 组合为一组，统计票数和最早出现的位置
+    n_codes = len(uniques)
+    groups, group_index = np.unique(rows * n_codes + codes, return_inverse=True)
+    scores = np.bincount(group_index, weights=flat_weights)
+    first = np.full(len(groups), k, dtype=np.int64)
+    np.minimum.at(first, group_index, positions)
+    group_rows = groups // n_codes
+
+    # 每行内按票数降序、首次出现位置升序排列，取第一个
+    order = np.lexsort((first, -scores, group_rows))
+    row_starts = np.flatnonzero(np.diff(group_rows[order], prepend=-1))
+    winners = order[row_starts]
+
+    winner_rows = group_rows[winners]
+    labels[winner_rows] = uniques[groups[winners] % n_codes]
+    totals = np.bincount(rows, weights=flat_weights, minlength=n)
+    confidence[winner_rows] = scores[winners] / totals[winner_rows]
+    return labels, confidence